@@ -1,17 +1,28 @@
 import streamlit as st
 from modules import conciliacion
 from modules import conciliador_v2
+from modules import ocr_facturas
+from modules import panel
+from modules import monitor
+from modules import instrumentacion
+from modules import mantenimiento
 
 # --- NUEVOS IMPORTS PARA LA BASE DE DATOS ---
 # Importamos la conexión y el modelo de Usuario desde models.py
-from models import SessionLocal, User, init_db
+from models import SessionLocal, User, init_db, engine
 
 # 1. CONFIGURACIÓN GENERAL
 st.set_page_config(page_title="Plataforma Contable", layout="wide", page_icon="📊")
 
+# --- INSTRUMENTACIÓN: sentencias SQL por corrida y por ruta (Monitor de Base de Datos) ---
+instrumentacion.instrumentar(engine)
+instrumentacion.iniciar_corrida()
+
 # --- INICIALIZACIÓN DE LA BASE DE DATOS ---
 # Esto crea las tablas si no existen.
 init_db()
+# Limpieza, archivo y compactación periódicos: una vez por proceso, en segundo plano si corresponde
+mantenimiento.programar()
 
 # --- SEGURIDAD Y LOGIN (ACTUALIZADO CON BASE DE DATOS) ---
 
@@ -51,13 +62,17 @@ def login_screen():
 
 # --- APP PRINCIPAL ---
 if not st.session_state['logged_in']:
+    instrumentacion.nombrar_corrida("Login")
     login_screen()
 else:
     # BARRA LATERAL (MENÚ) - (SIN CAMBIOS)
     with st.sidebar:
         st.write(f"👤 **{st.session_state['username']}**")
         st.divider()
-        menu = st.radio("Herramientas", ["Inicio", "Conciliación Bancaria", "Segunda version conciliador", "OCR Facturas (Beta)"])
+        opciones_menu = ["Inicio", "Conciliación Bancaria", "Segunda version conciliador", "OCR Facturas (Beta)"]
+        if monitor.es_administrador(): opciones_menu.append("Monitor de Base de Datos")
+        menu = st.radio("Herramientas", opciones_menu)
+        instrumentacion.nombrar_corrida(menu)
         st.divider()
         if st.button("Cerrar Sesión"):
             st.session_state['logged_in'] = False
@@ -67,8 +82,7 @@ else:
 
     # RUTEO DE MÓDULOS - (SIN CAMBIOS)
     if menu == "Inicio":
-        st.title("Bienvenido a tu Panel Contable")
-        st.info("Selecciona una herramienta en el menú de la izquierda para comenzar.")
+        panel.render()
         
     elif menu == "Conciliación Bancaria":
         # Llamamos al módulo tal cual estaba
@@ -78,5 +92,9 @@ else:
         conciliador_v2.run()
         
     elif menu == "OCR Facturas (Beta)":
-        st.title("📷 OCR de Facturas")
-        st.warning("Este módulo está en construcción.")
+        ocr_facturas.render()
+
+    elif menu == "Monitor de Base de Datos":
+        monitor.render()
+
+instrumentacion.cerrar_corrida()
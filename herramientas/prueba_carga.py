@@ -0,0 +1,270 @@
+"""Prueba de carga: N contadores simultáneos sobre app.py, sin navegador (streamlit.testing AppTest).
+
+    python herramientas/prueba_carga.py --usuarios 8 --filas 2000 --salida resultados_carga
+
+Cada usuario simulado corre en su propio proceso (así la memoria de cada sesión se mide por separado) y
+recorre login -> inicialización -> carga -> mapeo -> conciliación -> cierre sobre archivos sintéticos,
+todos contra la misma base SQLite de un directorio de trabajo descartable. Los pasos arrancan juntos
+(barrera) para que las sesiones se pisen como en un servidor real.
+
+Salida, para comparar entre versiones:
+  <salida>/pasos.csv     una fila por (usuario, paso): segundos, RSS y error
+  <salida>/resumen.json  percentiles de latencia por paso, RSS pico por sesión y escrituras SQLite
+
+Escrituras SQLite: se mide cada INSERT/UPDATE/DELETE y cada COMMIT con eventos de SQLAlchemy. Con un solo
+usuario reflejan el costo de la escritura; el exceso con N usuarios es espera por el lock de la base.
+'bloqueos' cuenta los 'database is locked' (la espera superó el timeout).
+"""
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(RAIZ, 'app.py')
+CLAVE = 'carga123'
+PASOS = ['login', 'inicializar', 'carga', 'mapeo', 'conciliacion', 'cierre']
+PERCENTILES = [50, 90, 95, 99]
+
+# --- Archivos sintéticos ---
+def archivos(filas, semilla, extras=5):
+    """(mayor.csv, banco.csv) en bytes: el banco repite cada partida del mayor (+0 a 2 días) y agrega
+    'extras' movimientos propios (gastos bancarios) que se ajustan en libros durante la prueba."""
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(semilla)
+    fechas = pd.Timestamp('2026-03-01') + pd.to_timedelta(rng.integers(0, 28, filas), unit='D')
+    montos = np.round(rng.integers(100, 10_000_000, filas) / 100, 2) * rng.choice([1, -1], filas)
+    desc = [f"PAGO PROVEEDOR {i}" for i in range(filas)]
+    mayor = pd.DataFrame({'Fecha': fechas.strftime('%d/%m/%Y'), 'Detalle': desc,
+                          'Debe': np.where(montos > 0, montos, 0), 'Haber': np.where(montos < 0, -montos, 0)})
+    desfase = pd.to_timedelta(rng.integers(0, 3, filas), unit='D')
+    banco = pd.DataFrame({'Fecha Op': (fechas + desfase).strftime('%d/%m/%Y'), 'Concepto': [f"TRF {d}" for d in desc],
+                          'Credito': np.where(montos > 0, montos, 0), 'Debito': np.where(montos < 0, -montos, 0)})
+    gastos = pd.DataFrame({'Fecha Op': ['05/03/2026'] * extras, 'Concepto': [f"COMISION MANT CUENTA {i}" for i in range(extras)],
+                           'Credito': 0.0, 'Debito': np.round(rng.integers(100, 500_000, extras) / 100, 2)})
+    banco = pd.concat([banco, gastos], ignore_index=True)
+    return mayor.to_csv(index=False).encode(), banco.to_csv(index=False).encode()
+
+# --- Medición ---
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for linea in f:
+                if linea.startswith('VmRSS:'): return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def instrumentar_sqlite(engine, sesiones, stats):
+    """Tiempo de cada escritura y cada COMMIT (ms) y cantidad de 'database is locked'."""
+    from sqlalchemy import event
+    local = threading.local()
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def antes(conn, cursor, sentencia, parametros, contexto, multiple):
+        conn.info['t0_carga'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def despues(conn, cursor, sentencia, parametros, contexto, multiple):
+        if sentencia.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            stats['escrituras_ms'].append((time.perf_counter() - conn.info.pop('t0_carga')) * 1000)
+
+    @event.listens_for(engine, 'commit')
+    def commit(conn):
+        local.t0 = time.perf_counter()
+
+    @event.listens_for(sesiones, 'after_commit')
+    def despues_commit(sesion):
+        if getattr(local, 't0', None) is not None:
+            stats['commits_ms'].append((time.perf_counter() - local.t0) * 1000)
+            local.t0 = None
+
+    @event.listens_for(engine, 'handle_error')
+    def error(contexto):
+        if 'locked' in str(contexto.original_exception).lower(): stats['bloqueos'] += 1
+
+# --- Usuario simulado ---
+def _errores(at):
+    return [str(e.value) for e in at.exception] + [e.body for e in at.error]
+
+def _boton(at, texto):
+    return next(b for b in at.button if texto in b.label)
+
+def sesion(indice, opciones, barrera, cola):
+    os.chdir(opciones['directorio'])
+    sys.path.insert(0, RAIZ)
+    from streamlit.testing.v1 import AppTest
+    from models import engine, SessionLocal
+    stats = {'escrituras_ms': [], 'commits_ms': [], 'bloqueos': 0}
+    instrumentar_sqlite(engine, SessionLocal, stats)
+    usuario = f"carga_{indice:03d}"
+    mayor, banco = archivos(opciones['filas'], semilla=indice)
+    at = AppTest.from_file(APP, default_timeout=opciones['timeout'])
+    registros = []
+
+    def paso(nombre, accion):
+        t0 = time.perf_counter()
+        error = None
+        try:
+            accion()
+            errores = _errores(at)
+            if errores: error = errores[0][:300]
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:300]
+        registros.append({'usuario': usuario, 'paso': nombre, 'segundos': round(time.perf_counter() - t0, 4),
+                          'rss_mb': round(rss_mb(), 1), 'error': error})
+        return error is None
+
+    def login():
+        at.run()
+        at.text_input[0].set_value(usuario)
+        at.text_input[1].set_value(CLAVE)
+        _boton(at, 'Ingresar').click().run()
+        if not at.session_state['logged_in']: raise RuntimeError('login rechazado')
+
+    def inicializar():
+        at.sidebar.radio[0].set_value("Conciliación Bancaria").run()
+        _boton(at, 'Inicializar Sistema').click().run()
+
+    def carga():
+        # AppTest no maneja st.file_uploader: se cargan los mismos datos que deja el botón "Continuar"
+        at.session_state['temp_inputs'] = {
+            "s_fin_m": 0.0, "s_fin_b": 0.0, "sel_mes": "Marzo", "sel_anio": 2026, "sin_mayor": False, "cuenta": "Cuenta Principal",
+            "f_banco_data": banco, "f_banco_name": "banco.csv", "f_mayor_data": mayor, "f_mayor_name": "mayor.csv"}
+        at.session_state['conciliacion_step'] = 'map_columns'
+        at.run()
+
+    def mapeo():
+        selects = {s.key: s for s in at.selectbox}
+        for clave, columna in dict(fm='Fecha', dm='Detalle', m1m='Debe', m2m='Haber',
+                                   fb='Fecha Op', db='Concepto', m1b='Credito', m2b='Debito').items():
+            selects[clave].set_value(columna)
+        _boton(at, 'Confirmar Mapeo').click().run()
+
+    def conciliacion():
+        next(b for b in at.button if b.key == 'btn_ajustar_all').click().run()
+        next(b for b in at.button if b.key == 'btn_confirmar_ajustes').click().run()
+
+    def cierre():
+        # Saldo final del banco que deja la diferencia en cero, como lo cargaría el usuario
+        dif = [m.value for m in at.metric if m.label == 'Diferencia'][-1]
+        res = at.session_state['conciliacion_activa']
+        res['s_fin_b'] = round(float(res['s_fin_b']) + float(dif.replace('$', '').replace(',', '')), 2)
+        at.run()
+        _boton(at, 'Confirmar Cierre').click().run()
+        if at.session_state['conciliacion_step'] != 'upload': raise RuntimeError('el período no se cerró')
+
+    barrera.wait()
+    t_inicio = time.perf_counter()
+    for nombre, accion in zip(PASOS, [login, inicializar, carga, mapeo, conciliacion, cierre]):
+        if not paso(nombre, accion): break
+    import resource
+    cola.put({'usuario': usuario, 'pasos': registros, 'total_s': round(time.perf_counter() - t_inicio, 3),
+              'rss_pico_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), **stats})
+
+# --- Orquestación ---
+def preparar_base(directorio, usuarios):
+    os.chdir(directorio)
+    sys.path.insert(0, RAIZ)
+    from models import init_db, SessionLocal, User
+    init_db()
+    db = SessionLocal()
+    for i in range(usuarios):
+        nombre = f"carga_{i:03d}"
+        if not db.query(User).filter_by(username=nombre).first():
+            u = User(username=nombre, email=f"{nombre}@carga.local")
+            u.set_password(CLAVE)
+            db.add(u)
+    db.commit()
+    db.close()
+
+def _percentiles(valores):
+    import numpy as np
+    if not valores: return {}
+    v = np.asarray(valores, dtype=float)
+    return {**{f"p{p}": round(float(np.percentile(v, p)), 4) for p in PERCENTILES}, 'max': round(float(v.max()), 4), 'n': len(v)}
+
+def version_repo():
+    try:
+        return subprocess.run(['git', '-C', RAIZ, 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def resumir(resultados, opciones, duracion):
+    pasos = [r for res in resultados for r in res['pasos']]
+    escrituras = [v for res in resultados for v in res['escrituras_ms']]
+    commits = [v for res in resultados for v in res['commits_ms']]
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'), 'version': version_repo(),
+        'config': {k: opciones[k] for k in ('usuarios', 'filas')}, 'duracion_s': round(duracion, 3),
+        'pasos': {p: {**_percentiles([r['segundos'] for r in pasos if r['paso'] == p and not r['error']]),
+                      'errores': sum(1 for r in pasos if r['paso'] == p and r['error'])} for p in PASOS},
+        'sesiones': [{'usuario': r['usuario'], 'total_s': r['total_s'], 'rss_pico_mb': r['rss_pico_mb'],
+                      'escrituras': len(r['escrituras_ms']), 'escrituras_ms': round(sum(r['escrituras_ms']), 2),
+                      'commits_ms': round(sum(r['commits_ms']), 2), 'bloqueos': r['bloqueos'],
+                      'completa': len(r['pasos']) == len(PASOS) and not r['pasos'][-1]['error']} for r in resultados],
+        'sqlite': {'escrituras_ms': _percentiles(escrituras), 'commits_ms': _percentiles(commits),
+                   'espera_total_ms': round(sum(escrituras) + sum(commits), 2),
+                   'bloqueos': sum(r['bloqueos'] for r in resultados)},
+    }
+
+def correr(opciones):
+    directorio = opciones['directorio'] = opciones['directorio'] or tempfile.mkdtemp(prefix='carga_')
+    propio = os.getcwd()
+    preparar_base(directorio, opciones['usuarios'])
+    contexto = multiprocessing.get_context('spawn')
+    barrera, cola = contexto.Barrier(opciones['usuarios']), contexto.Queue()
+    procesos = [contexto.Process(target=sesion, args=(i, opciones, barrera, cola)) for i in range(opciones['usuarios'])]
+    t0 = time.perf_counter()
+    for p in procesos: p.start()
+    resultados = [cola.get() for _ in procesos]
+    for p in procesos: p.join()
+    duracion = time.perf_counter() - t0
+    os.chdir(propio)
+    resultados.sort(key=lambda r: r['usuario'])
+    return resultados, resumir(resultados, opciones, duracion)
+
+def guardar(resultados, resumen, salida):
+    os.makedirs(salida, exist_ok=True)
+    with open(os.path.join(salida, 'pasos.csv'), 'w', newline='', encoding='utf-8') as f:
+        escritor = csv.DictWriter(f, fieldnames=['usuario', 'paso', 'segundos', 'rss_mb', 'error'])
+        escritor.writeheader()
+        for r in resultados: escritor.writerows(r['pasos'])
+    with open(os.path.join(salida, 'resumen.json'), 'w', encoding='utf-8') as f:
+        json.dump(resumen, f, ensure_ascii=False, indent=2)
+
+def imprimir(resumen):
+    print(f"{resumen['config']['usuarios']} usuarios x {resumen['config']['filas']:,} filas  ({resumen['duracion_s']:.1f}s, versión {resumen['version']})")
+    print(f"  {'paso':<14}{'p50':>9}{'p95':>9}{'max':>9}{'errores':>9}")
+    for paso, m in resumen['pasos'].items():
+        print(f"  {paso:<14}{m.get('p50', float('nan')):>9.3f}{m.get('p95', float('nan')):>9.3f}{m.get('max', float('nan')):>9.3f}{m['errores']:>9}")
+    rss = [s['rss_pico_mb'] for s in resumen['sesiones']]
+    print(f"  RSS pico por sesión: {min(rss):.0f}-{max(rss):.0f} MB")
+    sq = resumen['sqlite']
+    print(f"  SQLite: {sq['escrituras_ms'].get('n', 0)} escrituras (p95 {sq['escrituras_ms'].get('p95', 0):.1f} ms), "
+          f"{sq['commits_ms'].get('n', 0)} commits (p95 {sq['commits_ms'].get('p95', 0):.1f} ms), bloqueos: {sq['bloqueos']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga de app.py con N sesiones simultáneas.")
+    parser.add_argument('--usuarios', type=int, default=4)
+    parser.add_argument('--filas', type=int, default=1000, help="Partidas del mayor por usuario (el banco agrega 5 gastos).")
+    parser.add_argument('--salida', default='resultados_carga')
+    parser.add_argument('--directorio', default=None, help="Directorio de trabajo para la base SQLite (por defecto, uno temporal).")
+    parser.add_argument('--timeout', type=float, default=300.0, help="Timeout por corrida del script (segundos).")
+    args = parser.parse_args()
+    opciones = vars(args)
+    temporal = args.directorio is None
+    resultados, resumen = correr(opciones)
+    guardar(resultados, resumen, args.salida)
+    imprimir(resumen)
+    if temporal: shutil.rmtree(opciones['directorio'], ignore_errors=True)
@@ -1,5 +1,6 @@
+import threading
 import sqlalchemy
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Boolean, JSON, Date, Text
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Boolean, JSON, Date, Text, LargeBinary, UniqueConstraint, inspect, text
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from datetime import datetime
 import bcrypt
@@ -26,6 +27,11 @@ class User(Base):
     conciliaciones = relationship("Conciliacion", back_populates="propietario")
     conciliaciones_v2 = relationship("ConciliacionV2", back_populates="propietario")
     reglas_gasto = relationship("ReglaGasto", back_populates="propietario")
+    formatos_archivo = relationship("FormatoArchivo", back_populates="propietario")
+    alias_conciliacion = relationship("AliasConciliacion", back_populates="propietario")
+    facturas = relationship("Factura", back_populates="propietario")
+    vinculos_factura = relationship("VinculoFactura", back_populates="propietario")
+    resumenes = relationship("ResumenPeriodo", back_populates="propietario")
 
     def set_password(self, password):
         p_bytes = password.encode('utf-8')
@@ -45,6 +51,7 @@ class Conciliacion(Base):
     
     periodo_mes = Column(Integer)
     periodo_anio = Column(Integer)
+    cuenta = Column(String) # Cuenta bancaria (un cierre por cuenta en la conciliación multi-cuenta)
     fecha_cierre = Column(DateTime, default=datetime.utcnow)
     
     saldo_mayor = Column(Float)
@@ -53,6 +60,7 @@ class Conciliacion(Base):
     estado = Column(String) 
     
     datos_hoja_trabajo = Column(JSON) 
+    acciones = Column(JSON) # Log de acciones manuales del cierre (modules.eventos)
     
     propietario = relationship("User", back_populates="conciliaciones")
 
@@ -66,7 +74,7 @@ class ConciliacionV2(Base):
     saldo_final_banco = Column(Float, default=0.0)
     saldo_inicial_mayor = Column(Float, default=0.0)
     saldo_final_mayor = Column(Float, default=0.0)
-    estado = Column(String, default="en_progreso") 
+    estado = Column(String, default="en_progreso") # en_progreso / finalizada (período cerrado) / archivada
     fecha_creacion = Column(DateTime, default=datetime.utcnow)
     propietario = relationship("User", back_populates="conciliaciones_v2")
     movimientos_banco = relationship("MovimientoBanco", back_populates="conciliacion", cascade="all, delete-orphan")
@@ -96,17 +104,242 @@ class MovimientoContable(Base):
 
 class ReglaGasto(Base):
     __tablename__ = "reglas_gasto"
+    __table_args__ = (UniqueConstraint("user_id", "texto_a_buscar", name="uq_regla_usuario_texto"),)
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    texto_a_buscar = Column(String, unique=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    texto_a_buscar = Column(String, index=True)
     categoria_asignada = Column(String, default="Gasto Bancario")
+    orden = Column(Integer, default=0) # Prioridad de la categoría (gana la primera que coincide)
     propietario = relationship("User", back_populates="reglas_gasto")
 
+class VersionReglasGasto(Base):
+    __tablename__ = "reglas_gasto_version"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, default=1) # Se incrementa con cada cambio del diccionario (invalida la caché)
+    actualizado = Column(DateTime, default=datetime.utcnow)
+
+class FormatoArchivo(Base):
+    __tablename__ = "formatos_archivo"
+    __table_args__ = (UniqueConstraint("user_id", "modulo", "origen", "huella", name="uq_formato_usuario_huella"),)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    # Cada módulo mapea a su propio esquema ('conciliacion': fecha/descripcion/monto_1/monto_2,
+    # 'conciliador_v2': fecha/concepto/monto): el mismo archivo tiene un formato por módulo
+    modulo = Column(String)
+    origen = Column(String) # 'mayor' / 'banco'
+    huella = Column(String, index=True) # Hash de encabezados + tipo de archivo
+    mapeo = Column(JSON)
+    opciones_lectura = Column(JSON) # usecols, dtypes y formatos detectados de fecha/número
+    usos = Column(Integer, default=0)
+    ultimo_uso = Column(DateTime, default=datetime.utcnow)
+    propietario = relationship("User", back_populates="formatos_archivo")
+
+class HuellaMovimiento(Base):
+    __tablename__ = "huellas_movimiento"
+    __table_args__ = (UniqueConstraint("user_id", "cuenta", "lado", "huella", name="uq_huella_cuenta"),)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    cuenta = Column(String) # Cuenta bancaria / banco_nombre
+    lado = Column(String) # 'banco' / 'mayor'
+    huella = Column(String) # Hash de (fecha, centavos, descripción normalizada, n° de ocurrencia)
+    fecha = Column(Date, index=True)
+    fecha_importacion = Column(DateTime, default=datetime.utcnow)
+
+class AliasConciliacion(Base):
+    __tablename__ = "alias_conciliacion"
+    __table_args__ = (UniqueConstraint("user_id", "patron_mayor", "patron_banco", name="uq_alias_usuario"),)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    patron_mayor = Column(String) # Descripción normalizada del mayor, sin números
+    patron_banco = Column(String) # Descripción normalizada del banco, sin números
+    confirmaciones = Column(Integer, default=0) # Veces que el usuario hizo este cruce a mano
+    aciertos = Column(Integer, default=0) # Veces que el alias lo resolvió solo (en períodos cerrados)
+    creado = Column(DateTime, default=datetime.utcnow)
+    ultimo_uso = Column(DateTime, default=datetime.utcnow)
+    propietario = relationship("User", back_populates="alias_conciliacion")
+
+class Factura(Base):
+    __tablename__ = "facturas"
+    __table_args__ = (UniqueConstraint("user_id", "hash_archivo", name="uq_factura_usuario_hash"),)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    hash_archivo = Column(String) # SHA-256 del PDF: un archivo ya procesado no se vuelve a extraer
+    nombre_archivo = Column(String)
+    tipo = Column(String) # Letra del comprobante (A, B, C, M, E)
+    punto_venta = Column(Integer)
+    numero = Column(Integer)
+    fecha = Column(Date, index=True)
+    cuit_emisor = Column(String, index=True)
+    cuit_receptor = Column(String)
+    neto = Column(Float)
+    iva = Column(Float)
+    total = Column(Float)
+    paginas = Column(Integer)
+    metodo = Column(String) # 'texto' (capa de texto del PDF) u 'ocr:<backend>'
+    estado = Column(String) # 'ok', 'incompleta', 'sin_texto' (escaneada sin OCR) o 'error'
+    error = Column(Text, nullable=True)
+    procesado = Column(DateTime, default=datetime.utcnow)
+    propietario = relationship("User", back_populates="facturas")
+    vinculos = relationship("VinculoFactura", back_populates="factura", cascade="all, delete-orphan")
+
+class VinculoFactura(Base):
+    __tablename__ = "vinculos_factura"
+    __table_args__ = (UniqueConstraint("factura_id", "origen", "contexto", "ref_id", name="uq_vinculo_factura_movimiento"),)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    factura_id = Column(Integer, ForeignKey("facturas.id"), index=True)
+    origen = Column(String) # 'movimiento_banco' (Conciliador v2) o 'extracto' (conciliación activa)
+    ref_id = Column(Integer) # MovimientoBanco.id o source_row_id del extracto
+    contexto = Column(String, nullable=True) # Extracto: 'cuenta|período' de la conciliación (source_row_id se reinicia en cada una)
+    # Copia del movimiento: los ids del extracto solo valen dentro de su conciliación
+    fecha_movimiento = Column(Date)
+    descripcion_movimiento = Column(Text)
+    importe = Column(Float) # Parte del pago aplicada a esta factura
+    confianza = Column(Integer) # 0-100
+    tipo = Column(String) # 'importe_cuit', 'combinado_cuit' o 'importe'
+    creado = Column(DateTime, default=datetime.utcnow)
+    propietario = relationship("User", back_populates="vinculos_factura")
+    factura = relationship("Factura", back_populates="vinculos")
+
+class ResumenPeriodo(Base):
+    # Resumen materializado de cada cierre (uno por usuario/cuenta/mes): el tablero de Inicio lee solo esta
+    # tabla, sin abrir las hojas de trabajo JSON. Se escribe en la misma transacción que la Conciliacion.
+    __tablename__ = "resumen_periodos"
+    __table_args__ = (UniqueConstraint("user_id", "cuenta", "periodo_anio", "periodo_mes", name="uq_resumen_periodo"),)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    conciliacion_id = Column(Integer, ForeignKey("conciliaciones.id"))
+    cuenta = Column(String)
+    periodo_anio = Column(Integer)
+    periodo_mes = Column(Integer)
+    fecha_cierre = Column(DateTime)
+    saldo_mayor = Column(Float) # Saldo contable ajustado
+    saldo_banco = Column(Float)
+    diferencia = Column(Float)
+    n_conciliados = Column(Integer)
+    importe_conciliado = Column(Float) # Suma en valor absoluto
+    # Pendientes que pasan al mes siguiente (importes con signo, como en la hoja de trabajo)
+    n_pend_mayor = Column(Integer)
+    importe_pend_mayor = Column(Float)
+    n_pend_banco = Column(Integer)
+    importe_pend_banco = Column(Float)
+    # Antigüedad de esos pendientes al fin del período (ambos lados, importes en valor absoluto)
+    n_pend_30 = Column(Integer)
+    n_pend_60 = Column(Integer)
+    n_pend_90 = Column(Integer)
+    n_pend_mas = Column(Integer)
+    importe_pend_30 = Column(Float)
+    importe_pend_60 = Column(Float)
+    importe_pend_90 = Column(Float)
+    importe_pend_mas = Column(Float)
+    propietario = relationship("User", back_populates="resumenes")
+
+class MovimientoArchivado(Base):
+    # Movimientos del Conciliador v2 de períodos viejos, movidos fuera de las tablas vivas (modules.mantenimiento):
+    # un bloque comprimido por conciliación y lado. Se leen con mantenimiento.leer_movimientos.
+    __tablename__ = "movimientos_archivados"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    conciliacion_id = Column(Integer, index=True) # ConciliacionV2.id de origen
+    lado = Column(String) # 'banco' o 'mayor'
+    periodo = Column(Date)
+    desde = Column(Date)
+    hasta = Column(Date)
+    filas = Column(Integer)
+    datos = Column(LargeBinary) # JSON (orient='split') comprimido con zlib
+    archivado = Column(DateTime, default=datetime.utcnow)
+
+class Mantenimiento(Base):
+    # Una fila por corrida de mantenimiento (limpieza, archivo, VACUUM/ANALYZE) con su informe de ganancias
+    __tablename__ = "mantenimientos"
+    id = Column(Integer, primary_key=True, index=True)
+    fecha = Column(DateTime, default=datetime.utcnow, index=True)
+    informe = Column(JSON)
+
+
+# --- MIGRACIONES LIVIANAS ---
+# create_all no modifica tablas existentes: las columnas nuevas de los modelos se agregan con ALTER TABLE
+# (nullable, sin restricciones) y los índices que cambiaron se recrean.
+def agregar_columnas_faltantes():
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for tabla in Base.metadata.sorted_tables:
+            if not inspector.has_table(tabla.name): continue
+            existentes = {c['name'] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    tipo = columna.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}'))
+
+def migrar_reglas_gasto():
+    """texto_a_buscar era único global: pasa a ser único por usuario."""
+    inspector = inspect(engine)
+    indices = {i['name']: i for i in inspector.get_indexes("reglas_gasto")}
+    unicos = [u['column_names'] for u in inspector.get_unique_constraints("reglas_gasto")]
+    unicos += [i['column_names'] for i in indices.values() if i.get('unique')]
+    with engine.begin() as conn:
+        if indices.get("ix_reglas_gasto_texto_a_buscar", {}).get("unique"):
+            conn.execute(text("DROP INDEX ix_reglas_gasto_texto_a_buscar"))
+            conn.execute(text("CREATE INDEX ix_reglas_gasto_texto_a_buscar ON reglas_gasto (texto_a_buscar)"))
+        if ['user_id', 'texto_a_buscar'] not in unicos:
+            conn.execute(text("CREATE UNIQUE INDEX uq_regla_usuario_texto ON reglas_gasto (user_id, texto_a_buscar)"))
+
+def migrar_formatos():
+    """formatos_archivo era único por (usuario, origen, huella), compartido entre módulos: se agrega el módulo a la
+    clave (deducido del mapeo guardado) y se recrea la tabla, porque SQLite no permite quitar una restricción."""
+    inspector = inspect(engine)
+    unicos = [u['column_names'] for u in inspector.get_unique_constraints("formatos_archivo")]
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE formatos_archivo SET modulo = CASE WHEN json_extract(mapeo, '$.concepto') IS NOT NULL "
+                          "THEN 'conciliador_v2' ELSE 'conciliacion' END WHERE modulo IS NULL"))
+        if ['user_id', 'origen', 'huella'] not in unicos: return
+        for indice in inspector.get_indexes("formatos_archivo"):
+            conn.execute(text(f"DROP INDEX {indice['name']}"))
+        conn.execute(text("ALTER TABLE formatos_archivo RENAME TO formatos_archivo_viejo"))
+        FormatoArchivo.__table__.create(conn)
+        columnas = ", ".join(c.name for c in FormatoArchivo.__table__.columns)
+        conn.execute(text(f"INSERT INTO formatos_archivo ({columnas}) SELECT {columnas} FROM formatos_archivo_viejo"))
+        conn.execute(text("DROP TABLE formatos_archivo_viejo"))
+
+def migrar_resumenes():
+    """Cierres anteriores a resumen_periodos: saldos y pendientes desde la hoja de trabajo (los conteos y la
+    antigüedad no se guardaban, quedan en NULL). Solo corre mientras la tabla está vacía."""
+    db = SessionLocal()
+    try:
+        if db.query(ResumenPeriodo.id).first() is not None: return
+        ultimos = {}
+        for c in db.query(Conciliacion).order_by(Conciliacion.fecha_cierre, Conciliacion.id).all():
+            ultimos[(c.user_id, c.cuenta or "Cuenta Principal", c.periodo_anio, c.periodo_mes)] = c
+        for (user_id, cuenta, anio, mes), c in ultimos.items():
+            hoja = {f.get("Concepto"): f.get("Importe") for f in (c.datos_hoja_trabajo or [])}
+            pend_m = hoja.get("(-) Partidas de Mayor no conciliadas")
+            diferencia = c.diferencia if c.diferencia is not None else hoja.get("DIFERENCIA DE CONCILIACIÓN")
+            db.add(ResumenPeriodo(
+                user_id=user_id, conciliacion_id=c.id, cuenta=cuenta, periodo_anio=anio, periodo_mes=mes,
+                fecha_cierre=c.fecha_cierre, saldo_mayor=c.saldo_mayor, saldo_banco=c.saldo_banco, diferencia=diferencia,
+                importe_pend_mayor=-pend_m if pend_m is not None else None,
+                importe_pend_banco=hoja.get("(+) Partidas de Banco no conciliadas"),
+            ))
+        db.commit()
+    finally:
+        db.close()
 
 # --- FUNCIÓN DE INICIALIZACIÓN (MODIFICADA) ---
+# app.py llama a init_db en cada corrida del script: el esquema y las migraciones se aplican una sola vez por proceso
+_migrado = False
+_lock_migracion = threading.Lock()
+
 def init_db():
-    # 1. Crear Tablas
-    Base.metadata.create_all(bind=engine)
+    global _migrado
+    # 1. Crear Tablas y migrar (una vez por proceso; si una migración falla se reintenta en la próxima corrida)
+    with _lock_migracion:
+        if not _migrado:
+            Base.metadata.create_all(bind=engine)
+            agregar_columnas_faltantes()
+            migrar_reglas_gasto()
+            migrar_formatos()
+            migrar_resumenes()
+            _migrado = True
     
     # 2. Verificar/Crear Usuario Admin automáticamente
     db = SessionLocal()
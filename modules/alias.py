@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import or_
+from models import AliasConciliacion
+from modules.texto import patron_descripcion
+
+# --- Alias aprendidos de los cruces manuales ---
+# Cada match manual 1 a 1 confirmado en un cierre deja un alias (patrón del mayor -> patrón del banco, sin
+# números). En la conciliación siguiente, una pasada extra sobre los pendientes los consulta en un dict en
+# memoria (O(1) por partida) y empareja mismo importe + patrón conocido antes de llegar al match manual.
+
+# Distancia máxima en días entre las partidas que empareja un alias
+ALIAS_DIAS = 60
+# Alias sin uso durante este tiempo se descartan; y nunca más de MAX_ALIAS por usuario (quedan los más usados)
+ALIAS_VIGENCIA_DIAS = 365
+MAX_ALIAS = 1000
+
+def cargar_alias(db, user_id):
+    """{patron_mayor: [(patron_banco, alias_id), ...]} con los alias del usuario."""
+    if not user_id: return {}
+    indice = {}
+    filas = db.query(AliasConciliacion.id, AliasConciliacion.patron_mayor, AliasConciliacion.patron_banco) \
+              .filter_by(user_id=user_id).order_by(AliasConciliacion.confirmaciones.desc()).all()
+    for alias_id, patron_m, patron_b in filas:
+        indice.setdefault(patron_m, []).append((patron_b, alias_id))
+    return indice
+
+def emparejar_por_alias(p_m, p_b, indice, dias_max=ALIAS_DIAS):
+    """Empareja pendientes por alias + mismo importe, eligiendo el movimiento del banco más cercano en fecha.
+    Devuelve (pos_m, pos_b, alias_ids) con posiciones en p_m / p_b."""
+    if not indice or p_m.empty or p_b.empty: return [], [], []
+    pat_m, pat_b = patron_descripcion(p_m['descripcion']).tolist(), patron_descripcion(p_b['descripcion']).tolist()
+    cent_m = np.round(p_m['neto'].to_numpy(dtype='float64') * 100).astype('int64').tolist()
+    cent_b = np.round(p_b['neto'].to_numpy(dtype='float64') * 100).astype('int64').tolist()
+    fechas_m, fechas_b = p_m['fecha'].tolist(), p_b['fecha'].tolist()
+
+    banco = {}
+    for j, (patron, cent, fecha) in enumerate(zip(pat_b, cent_b, fechas_b)):
+        if patron and not pd.isna(fecha): banco.setdefault((patron, cent), []).append(j)
+
+    usados, pos_m, pos_b, ids = set(), [], [], []
+    for i, (patron, cent, fecha) in enumerate(zip(pat_m, cent_m, fechas_m)):
+        if not patron or cent == 0 or pd.isna(fecha): continue
+        mejor, mejor_dist, mejor_alias = None, None, None
+        for patron_b, alias_id in indice.get(patron, ()):
+            for j in banco.get((patron_b, cent), ()):
+                if j in usados: continue
+                dist = abs((fechas_b[j] - fecha).days)
+                if dist <= dias_max and (mejor_dist is None or dist < mejor_dist):
+                    mejor, mejor_dist, mejor_alias = j, dist, alias_id
+        if mejor is not None:
+            usados.add(mejor)
+            pos_m.append(i)
+            pos_b.append(mejor)
+            ids.append(mejor_alias)
+    return pos_m, pos_b, ids
+
+def aprender_alias(db, user_id, pares, commit=True):
+    """Suma una confirmación por cada par (descripción mayor, descripción banco) de un match manual 1 a 1."""
+    if not user_id or not pares: return
+    desc_m, desc_b = zip(*pares)
+    pat_m = patron_descripcion(pd.Series(desc_m, dtype=object)).tolist()
+    pat_b = patron_descripcion(pd.Series(desc_b, dtype=object)).tolist()
+    ahora = datetime.utcnow()
+    for patron_m, patron_b in zip(pat_m, pat_b):
+        if not patron_m or not patron_b: continue
+        alias = db.query(AliasConciliacion).filter_by(user_id=user_id, patron_mayor=patron_m, patron_banco=patron_b).first()
+        if alias is None:
+            alias = AliasConciliacion(user_id=user_id, patron_mayor=patron_m, patron_banco=patron_b, confirmaciones=0, aciertos=0)
+            db.add(alias)
+        alias.confirmaciones = (alias.confirmaciones or 0) + 1
+        alias.ultimo_uso = ahora
+        db.flush()
+    if commit: db.commit()
+
+def registrar_aciertos(db, alias_ids, commit=True):
+    if not alias_ids: return
+    cuenta = pd.Series(alias_ids).value_counts()
+    ahora = datetime.utcnow()
+    for alias in db.query(AliasConciliacion).filter(AliasConciliacion.id.in_([int(i) for i in cuenta.index])):
+        alias.aciertos = (alias.aciertos or 0) + int(cuenta[alias.id])
+        alias.ultimo_uso = ahora
+    if commit: db.commit()
+
+def depurar_alias(db, user_id, vigencia_dias=ALIAS_VIGENCIA_DIAS, maximo=MAX_ALIAS, commit=True):
+    """Elimina los alias vencidos y, si sobran, los de menor uso. Devuelve la cantidad eliminada."""
+    if not user_id: return 0
+    limite = datetime.utcnow() - timedelta(days=vigencia_dias)
+    q = db.query(AliasConciliacion).filter(AliasConciliacion.user_id == user_id)
+    borrados = q.filter(or_(AliasConciliacion.ultimo_uso < limite, AliasConciliacion.ultimo_uso.is_(None))).delete(synchronize_session=False)
+    sobrantes = [a_id for (a_id,) in q.with_entities(AliasConciliacion.id)
+                 .order_by((AliasConciliacion.aciertos + AliasConciliacion.confirmaciones).desc(), AliasConciliacion.ultimo_uso.desc())
+                 .offset(maximo).all()]
+    if sobrantes:
+        borrados += db.query(AliasConciliacion).filter(AliasConciliacion.id.in_(sobrantes)).delete(synchronize_session=False)
+    if commit: db.commit()
+    return borrados
+
+def resumen_alias(db, user_id):
+    """Tabla para la vista de administración, con la tasa de resolución automática de cada alias."""
+    filas = db.query(AliasConciliacion).filter_by(user_id=user_id).all() if user_id else []
+    df = pd.DataFrame([{
+        'id': a.id, 'Patrón Mayor': a.patron_mayor, 'Patrón Banco': a.patron_banco,
+        'Confirmaciones': a.confirmaciones or 0, 'Aciertos': a.aciertos or 0, 'Último Uso': a.ultimo_uso,
+    } for a in filas], columns=['id', 'Patrón Mayor', 'Patrón Banco', 'Confirmaciones', 'Aciertos', 'Último Uso'])
+    total = df['Aciertos'] + df['Confirmaciones']
+    df['Tasa Automática'] = np.where(total > 0, df['Aciertos'] / total.where(total > 0, 1) * 100, 0.0)
+    return df.sort_values(['Aciertos', 'Confirmaciones'], ascending=False).reset_index(drop=True)
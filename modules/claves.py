@@ -0,0 +1,80 @@
+import re
+import numpy as np
+import pandas as pd
+from modules.texto import normalizar_descripcion
+
+# --- Claves fuertes en las descripciones ---
+# Los extractos argentinos traen identificadores que el mayor suele repetir en su detalle: número de cheque,
+# id de transferencia, id de DEBIN y CUIT de la contraparte. Se extraen con patrones compilados (sobre el texto
+# ya normalizado: mayúsculas, sin puntuación) a columnas tipadas; el motor las usa para un hash join
+# clave + importe antes del cruce por fechas.
+
+PREFIJO_NRO = r'(?:N(?:RO|UM|O)? )?'
+PATRONES_CLAVE = {
+    'cheque': re.compile(r'\b(?:E?CHEQUES?|E?CHEQ|CHQ|CH) ' + PREFIJO_NRO + r'0*(\d{3,})\b'),
+    # El id de DEBIN es alfanumérico pero lleva al menos un dígito: "DEBIN RECURRENTE" no es una clave
+    'debin': re.compile(r'\bDEBIN ' + PREFIJO_NRO + r'0*(?=[A-Z0-9]*\d)([A-Z0-9]{6,})\b'),
+    'transferencia': re.compile(r'\b(?:TRF|TRANSF|TRANSFERENCIA|TRANS) ' + PREFIJO_NRO + r'0*(\d{5,})\b'),
+    # CUIT/CUIL: prefijo válido + 8 dígitos + verificador, con o sin separadores (ya convertidos a espacios)
+    'cuit': re.compile(r'\b(20|23|24|27|30|33|34) ?(\d{8}) ?(\d)\b'),
+}
+# Orden de prioridad del cruce: primero las claves que identifican una única operación
+TIPOS_CLAVE = ['cheque', 'debin', 'transferencia', 'cuit']
+PESOS_CUIT = np.array([5, 4, 3, 2, 7, 6, 5, 4, 3, 2])
+
+def cuits_validos(cuits):
+    """Máscara de CUITs (texto de 11 dígitos) con dígito verificador correcto (módulo 11, como
+    facturas.cuit_valido), vectorizada sobre la columna."""
+    valores = cuits.to_numpy(dtype=object)
+    ok = np.zeros(len(valores), dtype=bool)
+    con_valor = np.flatnonzero(pd.notna(valores))
+    if len(con_valor) == 0: return ok
+    digitos = np.frombuffer(''.join(valores[con_valor]).encode('ascii'), dtype=np.uint8).reshape(-1, 11).astype('int64') - 48
+    verificador = 11 - (digitos[:, :10] @ PESOS_CUIT) % 11
+    verificador = np.where(verificador == 11, 0, np.where(verificador == 10, 9, verificador))
+    ok[con_valor] = verificador == digitos[:, 10]
+    return ok
+
+def extraer_claves(serie):
+    """DataFrame con una columna por tipo de clave (texto o None), alineado por posición con la serie."""
+    s = normalizar_descripcion(serie.reset_index(drop=True))
+    claves = {}
+    for tipo in TIPOS_CLAVE:
+        extraido = s.str.extract(PATRONES_CLAVE[tipo])
+        claves[tipo] = extraido[0].str.cat(extraido.iloc[:, 1:]) if extraido.shape[1] > 1 else extraido[0]
+    claves = pd.DataFrame(claves)
+    # Once dígitos con prefijo de CUIT pueden ser cualquier número (una cuenta, un id): solo cuentan los que verifican
+    claves.loc[~cuits_validos(claves['cuit']), 'cuit'] = None
+    # Un CUIT precedido por TRF no es un id de transferencia
+    claves.loc[claves['transferencia'] == claves['cuit'], 'transferencia'] = None
+    return claves.astype(object)
+
+def emparejar_por_clave(claves_m, claves_b, cent_m, cent_b, dias_m, dias_b, libres_m, libres_b):
+    """Hash join por (tipo, clave, centavos) entre filas libres, en orden de prioridad de tipos. Si una misma
+    clave e importe se repite, se empareja por orden de fecha (la n-ésima del mayor con la n-ésima del banco).
+    Devuelve (pos_m, pos_b, etiquetas) con etiquetas 'TIPO valor' para mostrar en los conciliados."""
+    libres_m, libres_b = libres_m.copy(), libres_b.copy()
+    res_m, res_b, etiquetas = [], [], []
+    for tipo in TIPOS_CLAVE:
+        lado_m = _filas_con_clave(claves_m[tipo].to_numpy(), cent_m, dias_m, libres_m)
+        lado_b = _filas_con_clave(claves_b[tipo].to_numpy(), cent_b, dias_b, libres_b)
+        if lado_m.empty or lado_b.empty: continue
+        pares = lado_m.merge(lado_b, on=['clave', 'cent', 'ocurrencia'], suffixes=('_m', '_b'))
+        if pares.empty: continue
+        pm, pb = pares['pos_m'].to_numpy(), pares['pos_b'].to_numpy()
+        libres_m[pm] = False
+        libres_b[pb] = False
+        res_m.append(pm)
+        res_b.append(pb)
+        etiquetas.append((tipo.upper() + ' ' + pares['clave']).to_numpy(dtype=object))
+    if not res_m:
+        vacio = np.empty(0, dtype='int64')
+        return vacio, vacio, np.empty(0, dtype=object)
+    return np.concatenate(res_m), np.concatenate(res_b), np.concatenate(etiquetas)
+
+def _filas_con_clave(clave, cent, dias, libres):
+    pos = np.flatnonzero(libres & pd.notna(clave))
+    df = pd.DataFrame({'pos': pos, 'clave': clave[pos], 'cent': cent[pos], 'dia': dias[pos]})
+    df = df.sort_values(['dia', 'pos'], kind='stable')
+    df['ocurrencia'] = df.groupby(['clave', 'cent']).cumcount()
+    return df[['pos', 'clave', 'cent', 'ocurrencia']]
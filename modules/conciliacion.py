@@ -1,83 +1,479 @@
 import streamlit as st
 import pandas as pd
 import io
-from datetime import timedelta, datetime
+import os
+import zlib
+from datetime import datetime
 # --- NUEVOS IMPORTS PARA LA BASE DE DATOS ---
-from models import SessionLocal, Conciliacion, User  
+from models import SessionLocal, Conciliacion, User, AliasConciliacion
 import json 
+from modules.formatos import (leer_con_formato, huella_archivo, detectar_opciones, buscar_formato, guardar_formato,
+                              registrar_uso, COLUMNA_ORIGEN)
+from modules.ingesta import leer as leer_partes
+from modules.esquema import COLUMNAS, esquema_vacio, proximo_id, a_esquema, normalizar_arrastre
+from modules.motor import (preparar_barrido, conciliar_con_barrido, previsualizar_tolerancias, conciliar, procesos_por_defecto,
+                           TOL_MAX)
+from modules.huellas import filtrar_nuevos, registrar_huellas
+from modules.reglas import clasificador, clasificar, cargar_reglas, guardar_categoria, version_reglas, SIN_CATEGORIA
+from modules.estado import iniciar_estado, ids_marcados, totales, MARCAS, SELECCION, PENDIENTE
+from modules.eventos import (accion_marcar, accion_ediciones, accion_cruce, deshacer, rehacer, ultimo, verificar,
+                             exportar, historial)
+from modules.paginado import paginar, ids_filtrados, filtro_vacio, ORDENES, TAM_PAGINA
+from modules.alias import (cargar_alias, emparejar_por_alias, aprender_alias, registrar_aciertos, depurar_alias,
+                           resumen_alias, ALIAS_VIGENCIA_DIAS)
+from modules.resumen import calcular_resumen, guardar_resumen
+from modules.multicuenta import unir_extractos, repartir, mayor_por_cuenta, resumen_cuentas
+from modules.puesta_al_dia import periodos_entre, tramos, resumen_cola
+
+CUENTA_DEFAULT = "Cuenta Principal"
+MODULO_FORMATO = 'conciliacion' # Clave de sus layouts guardados (mapeo fecha/descripcion/monto_1/monto_2)
+MESES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
 
 # --- 2. FUNCIONES DE PROCESAMIENTO (HELPERS) ---
 
-# --- FIX: Función movida aquí para que esté disponible globalmente ---
-def rename_duplicates(df):
-    """Renombra columnas duplicadas para evitar errores de pandas (ej. Fecha, Fecha_1)"""
-    if df.empty: return df
-    cols = pd.Series(df.columns)
-    for dup in cols[cols.duplicated()].unique():
-        cols[cols[cols == dup].index.values.tolist()] = [
-            f"{dup}_{i}" if i != 0 else dup for i in range(sum(cols == dup))
-        ]
-    df.columns = cols
-    return df
-
-def clean_num(value):
-    if pd.isna(value) or value == '': return 0.0
-    if isinstance(value, (int, float)): return float(value)
-    s = str(value).replace('$', '').replace(' ', '').strip()
-    if ',' in s and '.' in s:
-        if s.find('.') < s.find(','): s = s.replace('.', '').replace(',', '.')
-        else: s = s.replace(',', '')
-    elif ',' in s: s = s.replace(',', '.')
-    try: return float(s)
-    except: return 0.0
-
-def process_amounts(df, col_1, col_2=None):
-    val1 = df[col_1].apply(clean_num)
-    if col_2 and col_2 != "Ninguna":
-        val2 = df[col_2].apply(clean_num)
-        return val1 - val2
-    return val1
-
-def classify_movement(desc, keywords_dict):
-    if not isinstance(desc, str): return "Otros Pendientes"
-    desc_upper = desc.upper()
-    for categoria, keywords in keywords_dict.items():
-        if any(key.upper() in desc_upper for key in keywords):
-            return categoria
-    return "Otros Pendientes"
-
-def find_matches_v2(df_m, df_b, col_fm, col_mm, col_dm, col_fb, col_mb, col_db, days_tol):
-    df_m, df_b = df_m.copy(), df_b.copy()
-    df_m['matched'], df_b['matched'] = False, False
-    conciliados = []
+def elegibles_banco(df_b):
+    """Máscara de movimientos del banco que pueden matchearse: los gastos bancarios clasificados quedan fuera."""
+    gastos = clasificar(clasificador(st.session_state['user_id']), df_b['descripcion']) != SIN_CATEGORIA
+    return ~gastos.to_numpy()
+
+def kwargs_tolerancia(tol_importe):
+    """Tolerancia de importe de la UI ({'abs': $, 'pct': %}) -> parámetros del motor."""
+    tol_importe = tol_importe or {}
+    return {'tol_centavos': int(round(float(tol_importe.get('abs', 0.0)) * 100)), 'tol_pct': float(tol_importe.get('pct', 0.0))}
+
+def find_matches_v2(df_m, df_b, days_tol, elegibles_b=None, tol_importe=None):
+    """Cruce automático sobre el esquema canónico, resuelto en el motor con arrays e índices
+    (sin copias intermedias de los DataFrames). tol_importe: {'abs': $, 'pct': %} para la pasada
+    con tolerancia de importe sobre lo que el cruce exacto deja pendiente.
+    Los candidatos se arman una sola vez hasta la tolerancia máxima y el cruce sale de ese barrido, que se
+    devuelve para cambiar la "Tolerancia de días" después sin re-procesar. Desde motor.UMBRAL_PARALELO filas el
+    cruce va al modo paralelo por particiones de importe y no hay barrido (se resolvería en un solo núcleo):
+    cambiar la tolerancia vuelve a cruzar. Devuelve (p_m, p_b, matched, barrido o None)."""
+    if elegibles_b is None: elegibles_b = elegibles_banco(df_b)
+    procesos = procesos_por_defecto(len(df_m) + len(df_b))
+    if procesos > 1:
+        return (*conciliar(df_m, df_b, days_tol, elegibles_b, procesos=procesos, **kwargs_tolerancia(tol_importe)), None)
+    barrido = preparar_barrido(df_m, df_b, elegibles_b)
+    return (*conciliar_con_barrido(df_m, df_b, barrido, days_tol, **kwargs_tolerancia(tol_importe)), barrido)
+
+def aplicar_tolerancia(res, nueva_tol):
+    """Rehace el cruce automático de la conciliación activa con otra tolerancia de días: desde el barrido si lo
+    hay, si no (archivos grandes, modo paralelo) cruzando de nuevo la base. Descarta ajustes y cruces manuales."""
+    if res.get('barrido') is not None:
+        p_m, p_b, matched = conciliar_con_barrido(res['base']['m'], res['base']['b'], res['barrido'], nueva_tol,
+                                                  **kwargs_tolerancia(res.get('tol_importe')))
+    else:
+        p_m, p_b, matched, _ = find_matches_v2(res['base']['m'], res['base']['b'], nueva_tol, None, res.get('tol_importe'))
+    p_m, p_b = con_arrastres(p_m, p_b)
+    res['p_m'], res['p_b'], res['matched'], res['alias_usados'] = con_alias(p_m, p_b, matched, res.get('alias'))
+    res['tol'], res['alias_nuevos'] = nueva_tol, []
+    res['s_fin_m'] = res.get('s_fin_m_inicial', res['s_fin_m'])
+    iniciar_estado(res)
+
+def con_arrastres(p_m, p_b, arrastre_m=None, arrastre_b=None):
+    """Agrega los pendientes de períodos anteriores (ya en el esquema canónico) y las columnas de marcas.
+    Sin arrastres explícitos usa los de la sesión (conciliación de una sola cuenta)."""
+    if arrastre_m is None: arrastre_m = st.session_state['db_sistema']['partidas_arrastradas_m']
+    if arrastre_b is None: arrastre_b = st.session_state['db_sistema']['partidas_arrastradas_b']
+    if not arrastre_m.empty: p_m = pd.concat([arrastre_m, p_m], ignore_index=True)
+    if not arrastre_b.empty: p_b = pd.concat([arrastre_b, p_b], ignore_index=True)
+    p_m['Anular por Error'] = False
+    p_b['Ajustar en Libros'] = False
+    return p_m, p_b
+
+def con_alias(p_m, p_b, matched, indice):
+    """Pasada por alias aprendidos sobre los pendientes (incluye arrastres). Devuelve (p_m, p_b, matched, alias_ids)."""
+    pos_m, pos_b, ids = emparejar_por_alias(p_m, p_b, indice)
+    if not ids: return p_m, p_b, matched, []
+    sel_m, sel_b = p_m.iloc[pos_m], p_b.iloc[pos_b]
+    nuevos = pd.DataFrame({
+        'Fecha_Mayor': sel_m['fecha'].to_numpy(), 'Detalle_Mayor': sel_m['descripcion'].to_numpy(), 'Monto': sel_m['neto'].to_numpy(),
+        'Diferencia': 0.0, 'Fecha_Banco': sel_b['fecha'].to_numpy(), 'Detalle_Banco': sel_b['descripcion'].to_numpy(),
+        'Clave': 'ALIAS', 'id_mayor': sel_m['source_row_id'].to_numpy(), 'id_banco': sel_b['source_row_id'].to_numpy(),
+    })
+    return (p_m.drop(p_m.index[pos_m]).reset_index(drop=True), p_b.drop(p_b.index[pos_b]).reset_index(drop=True),
+            pd.concat([matched, nuevos], ignore_index=True), ids)
+
+def solo_nuevos(db, cuenta, lado, df):
+    """Filtra los movimientos ya importados en la cuenta (por huella). Devuelve (df_nuevos, huellas_nuevas, n_duplicados)."""
+    df = df[df['fecha'].notna()]
+    nuevos, huellas = filtrar_nuevos(db, st.session_state['user_id'], cuenta, lado, df['fecha'], df['neto'], df['descripcion'])
+    df_nuevos = df[nuevos].reset_index(drop=True)
+    huellas_nuevas = pd.DataFrame({'huella': huellas[nuevos].to_numpy(), 'fecha': df_nuevos['fecha'].to_numpy()})
+    return df_nuevos, huellas_nuevas, int((~nuevos).sum())
+
+def leer_entradas(inputs, op_m=None, op_b=None):
+    """Mayor (None sin mayor) y extracto crudos. Cada lado puede ser varios archivos y hojas: se leen todos
+    juntos en paralelo (modules.ingesta), con las opciones del formato guardado si se pasan. Devuelve
+    (df_m_orig, df_b_orig, informe)."""
+    archivos = inputs.get('archivos') or {'mayor': [(inputs['f_mayor_name'], inputs['f_mayor_data'])],
+                                          'banco': [(inputs['f_banco_name'], inputs['f_banco_data'])]}
+    lados = {'banco': archivos['banco']} if inputs['sin_mayor'] else {'mayor': archivos['mayor'], 'banco': archivos['banco']}
+    dfs, informe = leer_partes(lados, {'mayor': op_m, 'banco': op_b})
+    return dfs.get('mayor'), dfs['banco'], informe
+
+def opciones_de_lado(df, mapeo):
+    """Detecta formatos de fecha/números de un archivo ya mapeado (para la caché de layouts)."""
+    return detectar_opciones(df, mapeo['fecha'], [mapeo['descripcion']], [mapeo['monto_1'], mapeo['monto_2']])
+
+def usar_formato_guardado(db, fmt, df_orig, releido):
+    """Mapeo y opciones de un formato guardado. Si el archivo no respetó sus tipos (releido: se leyó completo),
+    las opciones se vuelven a detectar sobre lo leído y se guardan en lugar de las viejas."""
+    if not releido:
+        registrar_uso(db, fmt)
+        return fmt.mapeo, fmt.opciones_lectura
+    opciones = opciones_de_lado(df_orig, fmt.mapeo)
+    guardar_formato(db, st.session_state['user_id'], fmt.modulo, fmt.origen, fmt.huella, fmt.mapeo, opciones)
+    return fmt.mapeo, opciones
+
+def procesar_mapeo(inputs, df_m_orig, df_b_orig, map_m, map_b, op_m, op_b, tol, tol_importe=None):
+    """Proyecta ambos archivos al esquema canónico, corre el matcheo y deja la conciliación activa lista para 'reconcile'."""
+    if inputs.get('puesta_al_dia'):
+        return procesar_puesta_al_dia(inputs, df_m_orig, df_b_orig, map_m, map_b, op_m, op_b, tol, tol_importe)
+    if inputs.get('extractos'):
+        return procesar_multicuenta(inputs, df_m_orig, df_b_orig, map_m, map_b, op_m, op_b, tol, tol_importe)
+    sin_mayor = inputs['sin_mayor']
+    s_ini_m = st.session_state['db_sistema']['saldo_acumulado_m']
+    s_ini_b = st.session_state['db_sistema']['saldo_acumulado_b']
+    arrastre_m = st.session_state['db_sistema']['partidas_arrastradas_m']
+    arrastre_b = st.session_state['db_sistema']['partidas_arrastradas_b']
+
+    cuenta = inputs.get('cuenta') or CUENTA_DEFAULT
+    db = SessionLocal()
+
+    df_b, filas_inv_b = a_esquema(df_b_orig, map_b, op_b, inputs['f_banco_name'], primer_id=proximo_id(arrastre_b))
+    invalidas_b = df_b_orig.loc[filas_inv_b]
+    # Importación incremental: solo entran los movimientos que no se importaron en cierres anteriores
+    df_b, huellas_b, dup_b = solo_nuevos(db, cuenta, 'banco', df_b)
+    tot_b = df_b['neto'].sum()
+    dis_b = round(inputs['s_fin_b'] - (s_ini_b + tot_b), 2)
+
+    s_fin_m = 0.0 if sin_mayor else inputs['s_fin_m']
+
+    barrido, base, indice_alias = None, None, {}
+    if sin_mayor:
+        p_m = esquema_vacio()
+        p_b = df_b
+        matched = pd.DataFrame()
+        dis_m = 0
+        invalidas_m = pd.DataFrame()
+        huellas_m, dup_m = pd.DataFrame(columns=['huella', 'fecha']), 0
+    else:
+        df_m, filas_inv_m = a_esquema(df_m_orig, map_m, op_m, inputs['f_mayor_name'], primer_id=proximo_id(arrastre_m))
+        invalidas_m = df_m_orig.loc[filas_inv_m]
+        df_m, huellas_m, dup_m = solo_nuevos(db, cuenta, 'mayor', df_m)
+        tot_m = df_m['neto'].sum()
+        dis_m = round(s_fin_m - (s_ini_m + tot_m), 2)
+        p_m, p_b, matched, barrido = find_matches_v2(df_m, df_b, tol, None, tol_importe)
+        base = {'m': df_m, 'b': df_b}
+        indice_alias = cargar_alias(db, st.session_state['user_id'])
+    db.close()
+
+    p_m, p_b = con_arrastres(p_m, p_b)
+    p_m, p_b, matched, alias_usados = con_alias(p_m, p_b, matched, indice_alias)
     
-    # Identificar Gastos
-    df_b['CATEGORIA'] = df_b[col_db].apply(lambda x: classify_movement(x, st.session_state.keywords_gastos))
-    
-    for idx_m, row_m in df_m.iterrows():
-        monto_m, fecha_m, desc_m = row_m[col_mm], row_m[col_fm], row_m[col_dm]
-        if monto_m == 0: continue
-        
-        mask = (
-            (df_b[col_mb] == monto_m) & 
-            (df_b['matched'] == False) &
-            (df_b['CATEGORIA'] == "Otros Pendientes") & 
-            (df_b[col_fb] >= fecha_m - timedelta(days=days_tol)) &
-            (df_b[col_fb] <= fecha_m + timedelta(days=days_tol))
-        )
-        
-        possibles = df_b[mask]
-        if not possibles.empty:
-            possibles['diff_days'] = (possibles[col_fb] - fecha_m).dt.days.abs()
-            best_match_idx = possibles.sort_values(by='diff_days').index[0]
-            
-            df_m.at[idx_m, 'matched'], df_b.at[best_match_idx, 'matched'] = True, True
-            conciliados.append({
-                'Fecha_Mayor': fecha_m, 'Detalle_Mayor': desc_m, 'Monto': monto_m,
-                'Fecha_Banco': df_b.at[best_match_idx, col_fb], 'Detalle_Banco': df_b.at[best_match_idx, col_db]
-            })
-                
-    return df_m[df_m['matched'] == False], df_b[df_b['matched'] == False], pd.DataFrame(conciliados)
+    st.session_state['conciliacion_activa'] = {
+        'periodo': f"{inputs['sel_mes']} {inputs['sel_anio']}", 's_ini_m': s_ini_m, 's_fin_m': s_fin_m, 
+        's_ini_b': s_ini_b, 's_fin_b': inputs['s_fin_b'], 'dis_m': dis_m, 'dis_b': dis_b, 'matched': matched, 
+        'p_m': p_m, 'p_b': p_b,
+        'fechas_invalidas': {'mayor': invalidas_m, 'banco': invalidas_b},
+        'cuenta': cuenta, 'huellas_nuevas': {'mayor': huellas_m, 'banco': huellas_b},
+        'duplicados': {'mayor': dup_m, 'banco': dup_b},
+        'tol': tol, 'tol_importe': tol_importe, 'barrido': barrido, 'base': base, 's_fin_m_inicial': s_fin_m,
+        'alias': indice_alias, 'alias_usados': alias_usados, 'alias_nuevos': [],
+    }
+    iniciar_estado(st.session_state['conciliacion_activa'])
+    st.session_state.conciliacion_step = 'reconcile'
+    del st.session_state.temp_inputs
+
+def leer_extracto(db, extracto, map_b, op_b):
+    """Extracto adicional de la carga multi-cuenta: con su propio formato guardado si ese layout ya se mapeó,
+    si no con el mapeo del primer extracto. Devuelve (df_orig, mapeo, opciones)."""
+    fmt = buscar_formato(db, st.session_state['user_id'], MODULO_FORMATO, 'banco', huella_archivo(extracto['data'], extracto['name']))
+    if fmt is not None:
+        registrar_uso(db, fmt)
+        map_b, op_b = fmt.mapeo, fmt.opciones_lectura
+    df_orig, con_formato = leer_con_formato(extracto['data'], extracto['name'], op_b)
+    faltantes = [c for c in (map_b['fecha'], map_b['descripcion'], map_b['monto_1']) if c not in df_orig.columns]
+    if faltantes:
+        st.error(f"El extracto '{extracto['name']}' no tiene las columnas {', '.join(map(str, faltantes))}: "
+                 f"cargalo en una conciliación aparte para mapear su formato.")
+        st.stop()
+    # Leído completo porque no respetó los tipos guardados: sus formatos de fecha e importe se detectan de nuevo
+    if not con_formato: op_b = opciones_de_lado(df_orig, map_b)
+    return df_orig, map_b, op_b
+
+def procesar_multicuenta(inputs, df_m_orig, df_b_orig, map_m, map_b, op_m, op_b, tol, tol_importe=None):
+    """Varios extractos contra un mismo mayor (modules.multicuenta): un solo cruce y una conciliación activa
+    por cuenta. Los saldos y arrastres del banco son por cuenta (db_sistema['cuentas']); los arrastres del
+    mayor son compartidos y entran en la cuenta principal (el primer extracto). La principal sin cierre
+    multi-cuenta previo arranca con los arrastres del banco de la sesión, igual que sus saldos."""
+    sistema = st.session_state['db_sistema']
+    por_cuenta = sistema.setdefault('cuentas', {})
+    extractos, sin_mayor = inputs['extractos'], inputs['sin_mayor']
+    cuentas = [e['cuenta'] for e in extractos]
+    arrastre_m = sistema['partidas_arrastradas_m']
+    arrastres_b = {c: por_cuenta[c]['partidas_arrastradas_b'] if c in por_cuenta
+                   else sistema['partidas_arrastradas_b'] if i == 0 else esquema_vacio() for i, c in enumerate(cuentas)}
+    db = SessionLocal()
+
+    # Banco: ids consecutivos entre cuentas (y después de los arrastres de todas), para que el cruce conjunto no los mezcle
+    lados, primer_id = [], proximo_id(*arrastres_b.values())
+    for i, extracto in enumerate(extractos):
+        df_orig, mapeo, opciones = (df_b_orig, map_b, op_b) if i == 0 else leer_extracto(db, extracto, map_b, op_b)
+        df, filas_inv = a_esquema(df_orig, mapeo, opciones, extracto['name'], primer_id=primer_id)
+        primer_id += len(df_orig)
+        df, huellas, dup = solo_nuevos(db, extracto['cuenta'], 'banco', df)
+        lados.append({'df': df, 'invalidas': df_orig.loc[filas_inv], 'huellas': huellas, 'dup': dup})
+    df_b, cuentas_b = unir_extractos([(c, lado['df']) for c, lado in zip(cuentas, lados)])
+
+    indice_alias, tot_m = {}, 0.0
+    if sin_mayor:
+        p_m, p_b, matched = esquema_vacio(), df_b, pd.DataFrame()
+        invalidas_m, huellas_m, dup_m = pd.DataFrame(), pd.DataFrame(columns=['huella', 'fecha']), 0
+    else:
+        df_m, filas_inv_m = a_esquema(df_m_orig, map_m, op_m, inputs['f_mayor_name'], primer_id=proximo_id(arrastre_m))
+        invalidas_m = df_m_orig.loc[filas_inv_m]
+        # Las huellas del mayor compartido se registran bajo la cuenta principal
+        df_m, huellas_m, dup_m = solo_nuevos(db, cuentas[0], 'mayor', df_m)
+        tot_m = df_m['neto'].sum()
+        p_m, p_b, matched, _ = find_matches_v2(df_m, df_b, tol, None, tol_importe)
+        indice_alias = cargar_alias(db, st.session_state['user_id'])
+    db.close()
+
+    partes = repartir(p_m, p_b, matched, df_b, cuentas_b, cuentas)
+    netos_m = mayor_por_cuenta(p_m, partes, cuentas)
+    s_ini_m_total = sum(e['s_ini_m'] for e in extractos)
+    dis_m_total = 0 if sin_mayor else round(inputs['s_fin_m'] - (s_ini_m_total + tot_m), 2)
+    sesiones = {}
+    for i, (extracto, lado) in enumerate(zip(extractos, lados)):
+        cuenta, principal = extracto['cuenta'], i == 0
+        pm_c, pb_c, matched_c = partes[cuenta]
+        pm_c, pb_c = con_arrastres(pm_c, pb_c, arrastre_m if principal else esquema_vacio(), arrastres_b[cuenta])
+        pm_c, pb_c, matched_c, alias_usados = con_alias(pm_c, pb_c, matched_c, indice_alias if principal else {})
+        # Saldo del mayor atribuible a la cuenta: su saldo inicial más lo que reclamaron sus movimientos
+        s_fin_m = round(extracto['s_ini_m'] + netos_m[cuenta], 2)
+        res = {
+            'periodo': f"{inputs['sel_mes']} {inputs['sel_anio']}", 's_ini_m': extracto['s_ini_m'], 's_fin_m': s_fin_m,
+            's_ini_b': extracto['s_ini_b'], 's_fin_b': extracto['s_fin_b'], 'dis_m': dis_m_total if principal else 0,
+            'dis_b': round(extracto['s_fin_b'] - (extracto['s_ini_b'] + lado['df']['neto'].sum()), 2),
+            'matched': matched_c, 'p_m': pm_c, 'p_b': pb_c,
+            'fechas_invalidas': {'mayor': invalidas_m if principal else pd.DataFrame(), 'banco': lado['invalidas']},
+            'cuenta': cuenta, 'huellas_nuevas': {'mayor': huellas_m if principal else pd.DataFrame(columns=['huella', 'fecha']), 'banco': lado['huellas']},
+            'duplicados': {'mayor': dup_m if principal else 0, 'banco': lado['dup']},
+            'tol': tol, 'tol_importe': tol_importe, 'barrido': None, 'base': None, 's_fin_m_inicial': s_fin_m,
+            'alias': indice_alias if principal else {}, 'alias_usados': alias_usados, 'alias_nuevos': [],
+        }
+        iniciar_estado(res)
+        sesiones[cuenta] = res
+
+    st.session_state['multicuenta'] = {'principal': cuentas[0], 'sesiones': sesiones, 'cerradas': []}
+    st.session_state['conciliacion_activa'] = sesiones[cuentas[0]]
+    st.session_state.conciliacion_step = 'reconcile'
+    del st.session_state.temp_inputs
+
+def guardar_saldos_cuenta(sistema, cuenta, saldo_m, saldo_b, arrastre_b, solo_si_existe=False):
+    """Saldos y arrastres del banco con los que abre la cuenta en el próximo cierre multi-cuenta.
+    solo_si_existe: desde un cierre de una sola cuenta, actualiza la cuenta solo si ya pasó por multi-cuenta."""
+    por_cuenta = sistema.setdefault('cuentas', {})
+    if solo_si_existe and cuenta not in por_cuenta: return
+    por_cuenta[cuenta] = {'saldo_acumulado_m': saldo_m, 'saldo_acumulado_b': saldo_b, 'partidas_arrastradas_b': arrastre_b}
+
+def cuadro_cierre(res, tot):
+    """Hoja de trabajo del cierre a partir de los totales incrementales (no recorre los pendientes).
+    Devuelve (mayor_ajustado_real, m_ajustado_teorico, s_fin_b, dif_final, df_reconcile)."""
+    # Cruces con tolerancia de importe: la diferencia (banco - mayor) se ajusta en libros
+    mayor_ajustado_real = res['s_fin_m'] - tot['anulado_m'] + tot['ajustado_b'] + tot['tolerancia']
+    m_ajustado_teorico = mayor_ajustado_real - tot['pend_m'] + tot['pend_b']
+    s_fin_b = pd.to_numeric(res.get('s_fin_b'), errors='coerce')
+    if pd.isna(s_fin_b): s_fin_b = 0.0
+    dif_final = round(m_ajustado_teorico - s_fin_b, 2)
+    df_reconcile = pd.DataFrame([
+        {"Concepto": "Saldo Contable Ajustado (p/ Cierre)", "Importe": mayor_ajustado_real},
+        {"Concepto": "(-) Partidas de Mayor no conciliadas", "Importe": -tot['pend_m']},
+        {"Concepto": "(+) Partidas de Banco no conciliadas", "Importe": tot['pend_b']},
+        {"Concepto": "SALDO TEÓRICO CONCILIADO", "Importe": m_ajustado_teorico},
+        {"Concepto": "SALDO FINAL BANCARIO (Extracto)", "Importe": s_fin_b},
+        {"Concepto": "DIFERENCIA DE CONCILIACIÓN", "Importe": dif_final},
+    ])
+    return mayor_ajustado_real, m_ajustado_teorico, s_fin_b, dif_final, df_reconcile
+
+def arrastres_de(res):
+    """Pendientes que pasan al mes siguiente (esquema canónico): sin los anulados ni los ajustados en libros."""
+    p_m, p_b = res['p_m'], res['p_b']
+    pm_save = p_m.loc[p_m[PENDIENTE].to_numpy() & ~p_m['Anular por Error'].to_numpy(), COLUMNAS].reset_index(drop=True)
+    pb_save = p_b.loc[p_b[PENDIENTE].to_numpy() & ~p_b['Ajustar en Libros'].to_numpy(), COLUMNAS].reset_index(drop=True)
+    return pm_save, pb_save
+
+def registrar_cierre(db, res, anio, mes, mayor_ajustado_real, dif_final, df_reconcile, pm_save, pb_save):
+    """Agrega el cierre del período a la transacción de 'db' (sin commit): Conciliacion, resumen, huellas y alias."""
+    user_id, cuenta = st.session_state['user_id'], res.get('cuenta', CUENTA_DEFAULT)
+    nueva_conciliacion = Conciliacion(
+        user_id=user_id,
+        periodo_mes=mes,
+        periodo_anio=anio,
+        fecha_cierre=datetime.now(),
+        saldo_mayor=mayor_ajustado_real,
+        saldo_banco=res['s_fin_b'],
+        diferencia=dif_final,
+        cuenta=cuenta,
+        estado="CERRADO OK" if dif_final == 0 else "CERRADO CON DIF.",
+        datos_hoja_trabajo=df_reconcile.to_dict(orient='records'),
+        acciones=exportar(res)
+    )
+    db.add(nueva_conciliacion)
+    db.flush()
+    # Resumen materializado del período (tablero de Inicio), en la misma transacción
+    guardar_resumen(db, user_id, nueva_conciliacion, cuenta, calcular_resumen(anio, mes, res['matched'], pm_save, pb_save), commit=False)
+    # Huellas de lo importado en este período: una re-importación posterior solo trae lo nuevo
+    for lado, huellas in res.get('huellas_nuevas', {}).items():
+        registrar_huellas(db, user_id, cuenta, lado, huellas['huella'], huellas['fecha'], commit=False)
+    # Alias: aciertos de la pasada automática y cruces manuales 1 a 1 confirmados en este período
+    registrar_aciertos(db, res.get('alias_usados', []), commit=False)
+    aprender_alias(db, user_id, res.get('alias_nuevos', []), commit=False)
+    depurar_alias(db, user_id, commit=False)
+    return nueva_conciliacion
+
+def procesar_puesta_al_dia(inputs, df_m_orig, df_b_orig, map_m, map_b, op_m, op_b, tol, tol_importe=None):
+    """Varios meses atrasados de una cuenta (modules.puesta_al_dia): los archivos se proyectan y se filtran por
+    huella una sola vez, se parten por mes y avanzar_puesta_al_dia concilia la cola en orden."""
+    sistema = st.session_state['db_sistema']
+    cuenta = inputs.get('cuenta') or CUENTA_DEFAULT
+    db = SessionLocal()
+    df_b, filas_inv_b = a_esquema(df_b_orig, map_b, op_b, inputs['f_banco_name'], primer_id=proximo_id(sistema['partidas_arrastradas_b']))
+    df_b, huellas_b, dup_b = solo_nuevos(db, cuenta, 'banco', df_b)
+    df_m, filas_inv_m = a_esquema(df_m_orig, map_m, op_m, inputs['f_mayor_name'], primer_id=proximo_id(sistema['partidas_arrastradas_m']))
+    df_m, huellas_m, dup_m = solo_nuevos(db, cuenta, 'mayor', df_m)
+    indice_alias = cargar_alias(db, st.session_state['user_id'])
+    db.close()
+
+    periodos = [(p['anio'], p['mes']) for p in inputs['puesta_al_dia']]
+    saldos = {(p['anio'], p['mes']): {'s_fin_m': p['s_fin_m'], 's_fin_b': p['s_fin_b']} for p in inputs['puesta_al_dia']}
+    cola, fuera_m, fuera_b = tramos(df_m, huellas_m, df_b, huellas_b, periodos, saldos, MESES)
+    st.session_state['puesta_al_dia'] = {
+        'cola': cola, 'cerrados': [], 'detenido': None, 'cuenta': cuenta, 'tol': tol, 'tol_importe': tol_importe,
+        'alias': indice_alias, 'posteriores': {'mayor': fuera_m, 'banco': fuera_b}, 'duplicados': {'mayor': dup_m, 'banco': dup_b},
+        'fechas_invalidas': {'mayor': df_m_orig.loc[filas_inv_m], 'banco': df_b_orig.loc[filas_inv_b]},
+    }
+    del st.session_state.temp_inputs
+    return avanzar_puesta_al_dia()
+
+def sesion_de_tramo(tramo, puesta, s_ini_m, s_ini_b, arrastre_m, arrastre_b):
+    """Conciliación activa de un mes de la puesta al día: el mismo cruce, arrastres y alias que procesar_mapeo.
+    Sin saldo final del mayor, se calcula de sus movimientos. El del extracto no se calcula nunca: es contra lo
+    que se controla el mes (calcularlo deja la diferencia en cero por construcción); si falta, cuenta como 0."""
+    df_m, df_b = tramo['m'], tramo['b']
+    tot_m, tot_b = df_m['neto'].sum(), df_b['neto'].sum()
+    s_fin_m = round(s_ini_m + tot_m, 2) if tramo['s_fin_m'] is None else tramo['s_fin_m']
+    s_fin_b = 0.0 if tramo['s_fin_b'] is None else tramo['s_fin_b']
+    p_m, p_b, matched, barrido = find_matches_v2(df_m, df_b, puesta['tol'], None, puesta['tol_importe'])
+    p_m, p_b = con_arrastres(p_m, p_b, arrastre_m, arrastre_b)
+    p_m, p_b, matched, alias_usados = con_alias(p_m, p_b, matched, puesta['alias'])
+    res = {
+        'periodo': tramo['periodo'], 's_ini_m': s_ini_m, 's_fin_m': s_fin_m, 's_ini_b': s_ini_b, 's_fin_b': s_fin_b,
+        'dis_m': round(s_fin_m - (s_ini_m + tot_m), 2), 'dis_b': round(s_fin_b - (s_ini_b + tot_b), 2),
+        'matched': matched, 'p_m': p_m, 'p_b': p_b,
+        'fechas_invalidas': {'mayor': pd.DataFrame(), 'banco': pd.DataFrame()},
+        'cuenta': puesta['cuenta'], 'huellas_nuevas': tramo['huellas'], 'duplicados': {'mayor': 0, 'banco': 0},
+        'tol': puesta['tol'], 'tol_importe': puesta['tol_importe'], 'barrido': barrido, 'base': {'m': df_m, 'b': df_b},
+        's_fin_m_inicial': s_fin_m, 'alias': puesta['alias'], 'alias_usados': alias_usados, 'alias_nuevos': [],
+    }
+    return iniciar_estado(res)
+
+def avanzar_puesta_al_dia():
+    """Concilia en orden los meses en espera, arrastrando saldos y pendientes en memoria. Los que cierran con
+    diferencia cero contra el saldo del extracto se guardan todos en una sola transacción; el primero con
+    diferencia (o sin saldo del extracto cargado) queda como conciliación activa. Sin meses en espera, la puesta
+    al día termina. Devuelve la cantidad de meses cerrados en lote."""
+    puesta, sistema = st.session_state['puesta_al_dia'], st.session_state['db_sistema']
+    s_m, s_b = sistema['saldo_acumulado_m'], sistema['saldo_acumulado_b']
+    arr_m, arr_b = sistema['partidas_arrastradas_m'], sistema['partidas_arrastradas_b']
+    listos, detenido = [], None
+    for tramo in puesta['cola']:
+        res = sesion_de_tramo(tramo, puesta, s_m, s_b, arr_m, arr_b)
+        mayor_ajustado_real, _, s_fin_b, dif_final, df_reconcile = cuadro_cierre(res, totales(res))
+        if dif_final != 0 or tramo['s_fin_b'] is None:
+            detenido = res
+            break
+        arr_m, arr_b = arrastres_de(res)
+        listos.append((res, tramo, mayor_ajustado_real, dif_final, df_reconcile, arr_m, arr_b))
+        s_m, s_b = mayor_ajustado_real, s_fin_b
+
+    if listos:
+        db = SessionLocal()
+        try:
+            for res, tramo, mayor_ajustado_real, dif_final, df_reconcile, pm_save, pb_save in listos:
+                registrar_cierre(db, res, tramo['anio'], tramo['mes'], mayor_ajustado_real, dif_final, df_reconcile, pm_save, pb_save)
+            db.commit()
+        finally:
+            db.close()
+        ultimo_tramo = listos[-1][1]
+        sistema.update({'saldo_acumulado_m': s_m, 'saldo_acumulado_b': s_b, 'partidas_arrastradas_m': arr_m,
+                        'partidas_arrastradas_b': arr_b, 'last_closed_period': (ultimo_tramo['mes'] - 1, ultimo_tramo['anio'])})
+        guardar_saldos_cuenta(sistema, puesta['cuenta'], s_m, s_b, arr_b, solo_si_existe=True)
+        puesta['cerrados'] += [res['periodo'] for res, *_ in listos]
+    puesta['cola'] = puesta['cola'][len(listos) + (detenido is not None):]
+
+    if detenido is not None:
+        puesta['detenido'] = detenido['periodo']
+        st.session_state['conciliacion_activa'] = detenido
+        st.session_state.conciliacion_step = 'reconcile'
+    else:
+        st.session_state.pop('puesta_al_dia')
+        st.session_state['conciliacion_activa'] = None
+        st.session_state.conciliacion_step = 'upload'
+    return len(listos)
+
+def _idx(opciones, valor, default=0):
+    """Índice de 'valor' en las opciones de un selectbox (para preseleccionar el mapeo guardado)."""
+    opciones = [str(o) for o in opciones]
+    return opciones.index(str(valor)) if valor is not None and str(valor) in opciones else default
+
+# Editores del paso de conciliación: key base -> (lado, columna editable)
+EDITORES = {'editor_pm': ('m', MARCAS['m']), 'editor_pb': ('b', MARCAS['b']),
+            'editor_manual_m': ('m', SELECCION), 'editor_manual_b': ('b', SELECCION)}
+
+def filtros_vista(clave):
+    """Controles de filtro y orden de un editor de pendientes; devuelve (filtro, orden) para modules.paginado."""
+    c1, c2 = st.columns([2, 1])
+    texto = c1.text_input("Buscar en descripción", key=f"{clave}_texto")
+    orden = c2.selectbox("Ordenar por", list(ORDENES), key=f"{clave}_orden")
+    c3, c4, c5 = st.columns(3)
+    imp_min = c3.number_input("Importe desde", min_value=0.0, value=None, step=100.0, key=f"{clave}_imp_min")
+    imp_max = c4.number_input("Importe hasta", min_value=0.0, value=None, step=100.0, key=f"{clave}_imp_max")
+    rango = c5.date_input("Fechas", value=[], format="DD/MM/YYYY", key=f"{clave}_fechas")
+    filtro = filtro_vacio()
+    filtro.update(texto=texto, importe_min=imp_min, importe_max=imp_max,
+                  desde=rango[0] if len(rango) > 0 else None, hasta=rango[1] if len(rango) > 1 else None)
+    return filtro, orden
+
+def editor_paginado(res, clave, lado, columnas, column_config, filtro, orden):
+    """Dibuja solo la página visible de los pendientes filtrados. La key del editor identifica la revisión y
+    las filas dibujadas, y se guarda con sus ids para traducir las ediciones (por posición) a ids."""
+    clave_pagina = f"{clave}_pagina"
+    pag = paginar(res['p_' + lado], filtro, orden, st.session_state.get(clave_pagina, 1))
+    st.session_state[clave_pagina] = pag['numero']
+    vista = pag['vista'][columnas]
+    ids = vista.index.to_numpy()
+    key = f"{clave}_{res['rev']}_{pag['numero']}_{zlib.crc32(ids.tobytes())}"
+    res.setdefault('vistas', {})[clave] = (key, ids)
+    st.data_editor(vista, key=key, use_container_width=True, hide_index=True,
+                   disabled=['fecha', 'descripcion', 'neto'], column_config=column_config)
+    if pag['paginas'] > 1:
+        c_pag, c_info = st.columns([1, 3])
+        c_pag.number_input("Página", min_value=1, max_value=pag['paginas'], step=1, key=clave_pagina)
+        inicio = (pag['numero'] - 1) * TAM_PAGINA
+        c_info.caption(f"Filas {inicio + 1:,}–{inicio + len(vista):,} de {pag['total']:,} (página {pag['numero']} de {pag['paginas']})")
+    else:
+        st.caption(f"{pag['total']:,} filas")
+    return pag
+
+# Etiquetas de las columnas canónicas en los editores
+VISTA_COLUMNAS = {
+    "fecha": st.column_config.DateColumn("Fecha", format="DD/MM/YYYY"),
+    "descripcion": st.column_config.TextColumn("Descripción"),
+    "neto": st.column_config.NumberColumn("Importe", format="$ %.2f"),
+}
 
 def style_summary(row):
     concepto_upper = str(row['Concepto']).upper()
@@ -110,23 +506,17 @@ def render():
             'saldo_acumulado_b': 0.0,   # Saldo de arrastre Banco
             'fecha_cierre': None,       # Última fecha real de operación
             'historial': [],            # Lista de conciliaciones cerradas con detalle
-            'partidas_arrastradas_m': pd.DataFrame(), # Pendientes del Mayor de períodos anteriores
-            'partidas_arrastradas_b': pd.DataFrame(),  # Pendientes del Banco de períodos anteriores
+            'partidas_arrastradas_m': esquema_vacio(), # Pendientes del Mayor de períodos anteriores
+            'partidas_arrastradas_b': esquema_vacio(),  # Pendientes del Banco de períodos anteriores
             'last_closed_period': None # Tupla (month_idx, year)
         }
 
     # Patch para estados de sesión antiguos
     if 'last_closed_period' not in st.session_state['db_sistema']:
         st.session_state['db_sistema']['last_closed_period'] = None
-
-    if 'keywords_gastos' not in st.session_state:
-        st.session_state['keywords_gastos'] = {
-            'Mantenimiento': ['MANT', 'CUENTA', 'PAQUETE', 'COMISION SERV'],
-            'Impuestos/Tasas': ['IMPUESTO', 'LEY 25413', 'PERCEPCION', 'RETENCION', 'SELLOS', 'SIRCREB'],
-            'IVA': ['IVA VENTAS', 'IVA DEBITO', 'IVA 21'],
-            'Comisiones Bancarias': ['COMISION', 'CARGO', 'GASTO EMISION'],
-            'Intereses': ['INTERES', 'INT. PAGO']
-        }
+    for k in ('partidas_arrastradas_m', 'partidas_arrastradas_b'):
+        if 'source_row_id' not in st.session_state['db_sistema'][k].columns:
+            st.session_state['db_sistema'][k] = normalizar_arrastre(st.session_state['db_sistema'][k])
 
     if 'conciliacion_activa' not in st.session_state:
         st.session_state['conciliacion_activa'] = None
@@ -169,18 +559,52 @@ def render():
                     st.session_state['db_sistema']['inicializado'] = False
                     st.session_state['db_sistema']['historial'] = []
                     # Limpiamos también los arrastres para reiniciar limpio
-                    st.session_state['db_sistema']['partidas_arrastradas_m'] = pd.DataFrame()
-                    st.session_state['db_sistema']['partidas_arrastradas_b'] = pd.DataFrame()
+                    st.session_state['db_sistema']['partidas_arrastradas_m'] = esquema_vacio()
+                    st.session_state['db_sistema']['partidas_arrastradas_b'] = esquema_vacio()
                     st.rerun()
 
         with c_conf2:
             st.subheader("2. Diccionario de Gastos")
-            cat = st.selectbox("Categoría", list(st.session_state.keywords_gastos.keys()))
-            current_keys = ", ".join(st.session_state.keywords_gastos[cat])
+            db = SessionLocal()
+            reglas = cargar_reglas(db, st.session_state['user_id'])
+            cat = st.selectbox("Categoría", list(reglas.keys()))
+            current_keys = ", ".join(reglas[cat])
             new_keys = st.text_area("Palabras clave", value=current_keys, height=100)
+            st.caption(f"Versión del diccionario: {version_reglas(db, st.session_state['user_id'])} (compartido por todas tus sesiones)")
             if st.button("Actualizar Diccionario"):
-                st.session_state.keywords_gastos[cat] = [k.strip() for k in new_keys.split(",")]
+                guardar_categoria(db, st.session_state['user_id'], cat, new_keys.split(","))
                 st.toast("Diccionario actualizado")
+            db.close()
+
+        st.divider()
+        st.subheader("3. Alias Aprendidos")
+        st.caption(f"Cada match manual 1 a 1 de un período cerrado enseña un alias (patrón del mayor → patrón del banco). "
+                   f"Los alias sin uso por {ALIAS_VIGENCIA_DIAS} días se depuran al cerrar.")
+        db = SessionLocal()
+        df_alias = resumen_alias(db, st.session_state['user_id'])
+        if df_alias.empty:
+            st.info("Todavía no hay alias aprendidos.")
+        else:
+            c_al1, c_al2, c_al3 = st.columns(3)
+            total_aciertos, total_conf = int(df_alias['Aciertos'].sum()), int(df_alias['Confirmaciones'].sum())
+            c_al1.metric("Alias", len(df_alias))
+            c_al2.metric("Cruces resueltos por alias", total_aciertos)
+            c_al3.metric("Tasa automática", f"{total_aciertos / max(total_aciertos + total_conf, 1):.0%}")
+            st.dataframe(df_alias, use_container_width=True, hide_index=True, column_config={
+                'id': None, 'Tasa Automática': st.column_config.ProgressColumn("Tasa Automática", min_value=0, max_value=100, format="%d%%"),
+                'Último Uso': st.column_config.DatetimeColumn("Último Uso", format="DD/MM/YYYY"),
+            })
+            opciones_alias = {f"{r['Patrón Mayor']} → {r['Patrón Banco']}": r['id'] for _, r in df_alias.iterrows()}
+            a_borrar = st.multiselect("Eliminar alias", list(opciones_alias.keys()), key="alias_borrar")
+            c_al4, c_al5, _ = st.columns([1, 1, 3])
+            if c_al4.button("🗑️ Eliminar Seleccionados", disabled=not a_borrar):
+                db.query(AliasConciliacion).filter(AliasConciliacion.user_id == st.session_state['user_id'],
+                                                   AliasConciliacion.id.in_([opciones_alias[a] for a in a_borrar])).delete(synchronize_session=False)
+                db.commit()
+                st.rerun()
+            if c_al5.button("🧹 Depurar Vencidos"):
+                st.toast(f"{depurar_alias(db, st.session_state['user_id'])} alias eliminados")
+        db.close()
 
     # ---------------------------------------------------------
     # PESTAÑA 1: CONCILIACIÓN ACTIVA
@@ -197,7 +621,6 @@ def render():
         if st.session_state.conciliacion_step == 'upload':
             s_ini_m = st.session_state['db_sistema']['saldo_acumulado_m']
             s_ini_b = st.session_state['db_sistema']['saldo_acumulado_b']
-            meses = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
             anios = list(range(datetime.now().year - 2, datetime.now().year + 5))
 
             with st.container(border=True):
@@ -207,42 +630,121 @@ def render():
                     last_month_idx, last_year = st.session_state['db_sistema']['last_closed_period']
                     next_month_idx = (last_month_idx + 1) % 12
                     next_year = last_year if next_month_idx > last_month_idx else last_year + 1
-                    st.info(f"El último período cerrado fue {meses[last_month_idx]} {last_year}. Solo puede conciliar el período siguiente.")
+                    st.info(f"El último período cerrado fue {MESES[last_month_idx]} {last_year}. Solo puede conciliar el período siguiente.")
                 else:
                     next_month_idx = datetime.now().month - 1
                     next_year = datetime.now().year
 
                 cp1, cp2 = st.columns(2)
-                sel_mes = cp1.selectbox("Mes a Conciliar", meses, index=next_month_idx, disabled=periodo_bloqueado, key="sel_mes")
+                sel_mes = cp1.selectbox("Mes a Conciliar", MESES, index=next_month_idx, disabled=periodo_bloqueado, key="sel_mes")
                 sel_anio = cp2.selectbox("Año", anios, index=anios.index(next_year), disabled=periodo_bloqueado, key="sel_anio")
-                
+                puesta = st.checkbox("⏩ Ponerse al día (varios meses de una vez)", key="puesta_check", disabled=st.session_state.get('multi_check', False),
+                                     help="Un mayor y un extracto que cubren varios meses: se parten por mes, se concilian en orden y los meses "
+                                          "que cierran con diferencia cero se guardan juntos. La corrida se detiene en el primero con diferencia.")
+                periodos = []
+                if puesta:
+                    # Por defecto hasta el último mes completo
+                    ultimo_mes = (datetime.now().year, datetime.now().month - 1) if datetime.now().month > 1 else (datetime.now().year - 1, 12)
+                    ch1, ch2 = st.columns(2)
+                    hasta_mes = ch1.selectbox("Hasta Mes", MESES, index=ultimo_mes[1] - 1, key="hasta_mes")
+                    hasta_anio = ch2.selectbox("Hasta Año", anios, index=anios.index(ultimo_mes[0]), key="hasta_anio")
+                    periodos = periodos_entre((int(sel_anio), MESES.index(sel_mes) + 1), (int(hasta_anio), MESES.index(hasta_mes) + 1))
+                    if not periodos: st.warning("El último mes tiene que ser igual o posterior al primero.")
+
                 st.divider()
                 st.subheader("📊 2. Control de Saldos")
-                c1, c2, c3, c4 = st.columns(4)
-                c1.number_input("Saldo Inicial Mayor (Auto)", value=s_ini_m, disabled=True, format="%.2f")
-                c2.number_input("Saldo Final Mayor (Libros)", value=0.0, format="%.2f", key="s_fin_m_in")
-                c3.number_input("Saldo Inicial Banco (Auto)", value=s_ini_b, disabled=True, format="%.2f")
-                c4.number_input("Saldo Final Banco (Extracto)", value=0.0, format="%.2f", key="s_fin_b_in")
+                if puesta:
+                    c1, c2 = st.columns(2)
+                    c1.number_input("Saldo Inicial Mayor (Auto)", value=s_ini_m, disabled=True, format="%.2f")
+                    c2.number_input("Saldo Inicial Banco (Auto)", value=s_ini_b, disabled=True, format="%.2f")
+                    st.caption("Saldos finales de cada mes. El del extracto es obligatorio: cada mes se controla contra él. "
+                               "El del mayor vacío se calcula de los movimientos del mes.")
+                    tabla_saldos = st.data_editor(pd.DataFrame({
+                        'Período': [f"{MESES[m - 1]} {a}" for a, m in periodos],
+                        'Saldo Final Mayor': pd.Series([None] * len(periodos), dtype='float64'),
+                        'Saldo Final Banco': pd.Series([None] * len(periodos), dtype='float64'),
+                    }), key="tabla_saldos", hide_index=True, use_container_width=True, disabled=['Período'],
+                        column_config={c: st.column_config.NumberColumn(c, format="%.2f") for c in ['Saldo Final Mayor', 'Saldo Final Banco']})
+                else:
+                    c1, c2, c3, c4 = st.columns(4)
+                    c1.number_input("Saldo Inicial Mayor (Auto)", value=s_ini_m, disabled=True, format="%.2f")
+                    c2.number_input("Saldo Final Mayor (Libros)", value=0.0, format="%.2f", key="s_fin_m_in")
+                    c3.number_input("Saldo Inicial Banco (Auto)", value=s_ini_b, disabled=True, format="%.2f")
+                    c4.number_input("Saldo Final Banco (Extracto)", value=0.0, format="%.2f", key="s_fin_b_in")
 
             st.subheader("📂 3. Carga de Archivos")
             col_u1, col_u2 = st.columns(2)
             with col_u1:
-                f_mayor = st.file_uploader("Cargar Mayor Contable", type=['xlsx', 'csv'], key="up_m")
+                f_mayores = st.file_uploader("Cargar Mayor Contable", type=['xlsx', 'csv'], accept_multiple_files=True, key="up_m",
+                                             help="Uno o varios archivos (o un libro con una hoja por mes) con el mismo formato.")
+                f_mayor = f_mayores[0] if f_mayores else None
                 sin_mayor = st.checkbox("Comenzar sin Mayor Contable", key="sin_mayor_check")
             with col_u2:
-                f_banco = st.file_uploader("Cargar Extracto Bancario", type=['xlsx', 'csv'], key="up_b")
-
-            if st.button("🚀 Continuar a Mapeo de Columnas", use_container_width=True, type="primary", disabled=(not f_banco or (not f_mayor and not sin_mayor))):
+                multi = st.checkbox("Varios extractos contra este mayor", key="multi_check", disabled=puesta,
+                                    help="Un mismo mayor contra varias cuentas bancarias: un solo cruce y un cierre por cuenta.")
+                if multi:
+                    f_bancos = st.file_uploader("Cargar Extractos Bancarios", type=['xlsx', 'csv'], accept_multiple_files=True, key="up_bs")
+                    f_banco = f_bancos[0] if f_bancos else None
+                else:
+                    f_bancos_cuenta = st.file_uploader("Cargar Extracto Bancario", type=['xlsx', 'csv'], accept_multiple_files=True, key="up_b",
+                                                       help="Uno o varios archivos (o un libro con una hoja por mes) de la misma cuenta.")
+                    f_banco = f_bancos_cuenta[0] if f_bancos_cuenta else None
+                    st.text_input("Cuenta Bancaria", value=CUENTA_DEFAULT, key="cuenta_in", help="Los movimientos ya importados en esta cuenta se omiten al volver a subir un extracto.")
+
+            if multi and f_bancos:
+                # Saldos por cuenta: los de su último cierre multi-cuenta; la primera (principal) arranca con los de la sesión
+                st.markdown("##### 🏦 Cuentas")
+                st.caption("La primera cuenta es la principal: se queda con las partidas del mayor que ningún extracto reclamó. "
+                           "El Saldo Final Mayor de arriba es el total del mayor compartido.")
+                por_cuenta = st.session_state['db_sistema'].get('cuentas', {})
+                filas_cuentas = []
+                for i, f in enumerate(f_bancos):
+                    cuenta = os.path.splitext(f.name)[0]
+                    previo = por_cuenta.get(cuenta, {})
+                    filas_cuentas.append({
+                        'Archivo': f.name, 'Cuenta': cuenta,
+                        'Saldo Inicial Mayor': previo.get('saldo_acumulado_m', s_ini_m if i == 0 else 0.0),
+                        'Saldo Inicial Banco': previo.get('saldo_acumulado_b', s_ini_b if i == 0 else 0.0),
+                        'Saldo Final Banco': 0.0,
+                    })
+                tabla_cuentas = st.data_editor(pd.DataFrame(filas_cuentas), key="tabla_cuentas", hide_index=True, use_container_width=True,
+                                               disabled=['Archivo'], column_config={c: st.column_config.NumberColumn(c, format="%.2f") for c in
+                                                                                    ['Saldo Inicial Mayor', 'Saldo Inicial Banco', 'Saldo Final Banco']})
+
+            if st.button("🚀 Continuar a Mapeo de Columnas", use_container_width=True, type="primary", disabled=(not f_banco or (not f_mayor and not sin_mayor) or (puesta and (sin_mayor or not periodos)))):
+                extractos, meses_puesta = None, None
+                if multi:
+                    nombres = tabla_cuentas['Cuenta'].fillna('').astype(str).str.strip()
+                    if (nombres == '').any() or nombres.duplicated().any():
+                        st.error("Cada extracto necesita un nombre de cuenta distinto.")
+                        st.stop()
+                    extractos = [{'cuenta': c, 'data': f.getvalue(), 'name': f.name, 's_ini_m': float(fila['Saldo Inicial Mayor']),
+                                  's_ini_b': float(fila['Saldo Inicial Banco']), 's_fin_b': float(fila['Saldo Final Banco'])}
+                                 for f, c, (_, fila) in zip(f_bancos, nombres, tabla_cuentas.iterrows())]
+                if puesta:
+                    sin_saldo = [p for p, v in zip(tabla_saldos['Período'], tabla_saldos['Saldo Final Banco']) if pd.isna(v)]
+                    if sin_saldo:
+                        st.error(f"Falta el Saldo Final Banco de {', '.join(sin_saldo)}: sin él el mes no se puede controlar contra el extracto.")
+                        st.stop()
+                    meses_puesta = [{'anio': a, 'mes': m, 's_fin_m': None if pd.isna(f['Saldo Final Mayor']) else float(f['Saldo Final Mayor']),
+                                     's_fin_b': None if pd.isna(f['Saldo Final Banco']) else float(f['Saldo Final Banco'])}
+                                    for (a, m), (_, f) in zip(periodos, tabla_saldos.iterrows())]
                 st.session_state.temp_inputs = {
-                    "s_fin_m": st.session_state.s_fin_m_in,
-                    "s_fin_b": st.session_state.s_fin_b_in,
+                    "s_fin_m": st.session_state.get('s_fin_m_in', 0.0),
+                    "s_fin_b": st.session_state.get('s_fin_b_in', 0.0),
                     "sel_mes": st.session_state.sel_mes,
                     "sel_anio": st.session_state.sel_anio,
                     "sin_mayor": st.session_state.sin_mayor_check,
+                    "cuenta": extractos[0]['cuenta'] if extractos else st.session_state.cuenta_in,
                     "f_banco_data": f_banco.getvalue(),
                     "f_banco_name": f_banco.name,
                     "f_mayor_data": f_mayor.getvalue() if f_mayor else None,
                     "f_mayor_name": f_mayor.name if f_mayor else None,
+                    "extractos": extractos,
+                    "puesta_al_dia": meses_puesta,
+                    # Todos los archivos de cada lado (en multi-cuenta cada extracto es una cuenta: el banco es solo el primero)
+                    "archivos": {'mayor': [(f.name, f.getvalue()) for f in f_mayores],
+                                 'banco': [(f_banco.name, f_banco.getvalue())] if multi else [(f.name, f.getvalue()) for f in f_bancos_cuenta]},
                 }
                 st.session_state.conciliacion_step = 'map_columns'
                 st.rerun()
@@ -251,250 +753,250 @@ def render():
         elif st.session_state.conciliacion_step == 'map_columns':
             inputs = st.session_state.temp_inputs
             sin_mayor = inputs['sin_mayor']
-            s_ini_m = st.session_state['db_sistema']['saldo_acumulado_m']
-            s_ini_b = st.session_state['db_sistema']['saldo_acumulado_b']
-
 
             st.info(f"Preparando conciliación para **{inputs['sel_mes']} {inputs['sel_anio']}**.")
-
-            f_banco = io.BytesIO(inputs['f_banco_data'])
-            df_b_orig = pd.read_excel(f_banco) if inputs['f_banco_name'].endswith('xlsx') else pd.read_csv(f_banco)
-
+            if inputs.get('puesta_al_dia'):
+                ultimo_mes = inputs['puesta_al_dia'][-1]
+                st.caption(f"Puesta al día: {len(inputs['puesta_al_dia'])} meses, hasta **{MESES[ultimo_mes['mes'] - 1]} {ultimo_mes['anio']}**.")
+            if inputs.get('extractos'):
+                st.caption(f"{len(inputs['extractos'])} extractos: el mapeo del banco es el de **{inputs['f_banco_name']}**; "
+                           f"los demás usan su formato guardado o este mismo mapeo.")
+
+            # --- CACHÉ DE FORMATOS: si el layout ya fue mapeado, se reutiliza el mapeo ---
+            db = SessionLocal()
+            user_id = st.session_state['user_id']
+            huella_b = huella_archivo(inputs['f_banco_data'], inputs['f_banco_name'])
+            fmt_b = buscar_formato(db, user_id, MODULO_FORMATO, 'banco', huella_b)
+            huella_m, fmt_m = None, None
             if not sin_mayor:
-                f_mayor = io.BytesIO(inputs['f_mayor_data'])
-                df_m_orig = pd.read_excel(f_mayor) if inputs['f_mayor_name'].endswith('xlsx') else pd.read_csv(f_mayor)
-            else:
-                df_m_orig = pd.DataFrame({
-                    'Fecha': pd.Series(dtype='datetime64[ns]'), 
-                    'Descripción': pd.Series(dtype='str'), 
-                    'NETO': pd.Series(dtype='float64')
-                })
+                huella_m = huella_archivo(inputs['f_mayor_data'], inputs['f_mayor_name'])
+                fmt_m = buscar_formato(db, user_id, MODULO_FORMATO, 'mayor', huella_m)
+
+            formato_conocido = fmt_b is not None and (sin_mayor or fmt_m is not None)
+            editar_mapeo = False
+            if formato_conocido:
+                st.success("⚡ Formato de archivo reconocido: se reutiliza el mapeo guardado.")
+                editar_mapeo = st.checkbox("Editar mapeo (leer todas las columnas)", key="editar_mapeo")
+
+            # Todos los archivos/hojas de ambos lados en una sola lectura concurrente (con formato guardado: solo las columnas mapeadas)
+            usar_formato = formato_conocido and not editar_mapeo
+            df_m_orig, df_b_orig, informe = leer_entradas(inputs, fmt_m.opciones_lectura if usar_formato and fmt_m else None,
+                                                          fmt_b.opciones_lectura if usar_formato else None)
+            if informe['archivos'] > 1 or sum(informe['partes'].values()) > len(informe['partes']):
+                st.caption(f"📥 {informe['archivos']} archivos ({', '.join(f'{n} partes del {lado}' for lado, n in informe['partes'].items())}) "
+                           f"leídos en {informe['segundos']:,.2f} s con {informe['hilos']} hilos (suma de tareas: {informe['suma_tareas']:,.2f} s).")
+            for lado, omitidas in informe['omitidas'].items():
+                if omitidas:
+                    st.warning(f"Se omitieron {len(omitidas)} partes del {lado} con otros encabezados que la primera: {', '.join(omitidas)}.")
+
+            if usar_formato and st.button("⚡ Procesar con Formato Guardado", use_container_width=True, type="primary"):
+                map_b, op_b = usar_formato_guardado(db, fmt_b, df_b_orig, informe['releidos'].get('banco'))
+                map_m, op_m = None, None
+                if not sin_mayor:
+                    map_m, op_m = usar_formato_guardado(db, fmt_m, df_m_orig, informe['releidos'].get('mayor'))
+                db.close()
+                procesar_mapeo(inputs, df_m_orig, df_b_orig, map_m, map_b, op_m, op_b, st.session_state.get('tol', 3),
+                               {'abs': st.session_state.get('tol_abs', 0.0), 'pct': st.session_state.get('tol_pct', 0.0)})
+                st.rerun()
+
+            prev_m = fmt_m.mapeo if fmt_m else {}
+            prev_b = fmt_b.mapeo if fmt_b else {}
 
             with st.form("form_map_columns"):
-                with st.expander("⚙️ Verificar Columnas", expanded=True):
+                with st.expander("⚙️ Verificar Columnas", expanded=not formato_conocido or editar_mapeo):
                     m1, m2 = st.columns(2)
                     if not sin_mayor:
                         with m1:
                             st.write("**Mayor Contable**")
-                            c_f_m = st.selectbox("Columna Fecha", df_m_orig.columns, key="fm")
-                            c_d_m = st.selectbox("Columna Descripción", df_m_orig.columns, key="dm")
-                            c_m1_m = st.selectbox("Columna Debe/Ingresos", df_m_orig.columns, key="m1m")
-                            c_m2_m = st.selectbox("Columna Haber/Egresos", ["Ninguna"] + list(df_m_orig.columns), key="m2m")
+                            cols_m = [c for c in df_m_orig.columns if c != COLUMNA_ORIGEN]
+                            c_f_m = st.selectbox("Columna Fecha", cols_m, index=_idx(cols_m, prev_m.get('fecha')), key="fm")
+                            c_d_m = st.selectbox("Columna Descripción", cols_m, index=_idx(cols_m, prev_m.get('descripcion')), key="dm")
+                            c_m1_m = st.selectbox("Columna Debe/Ingresos", cols_m, index=_idx(cols_m, prev_m.get('monto_1')), key="m1m")
+                            c_m2_m = st.selectbox("Columna Haber/Egresos", ["Ninguna"] + cols_m, index=_idx(["Ninguna"] + cols_m, prev_m.get('monto_2')), key="m2m")
                     with m2:
                         st.write("**Extracto Bancario**")
-                        c_f_b = st.selectbox("Columna Fecha", df_b_orig.columns, key="fb")
-                        c_d_b = st.selectbox("Columna Descripción", df_b_orig.columns, key="db")
-                        c_m1_b = st.selectbox("Columna Ingresos/Créditos", df_b_orig.columns, key="m1b")
-                        c_m2_b = st.selectbox("Columna Egresos/Débitos", ["Ninguna"] + list(df_b_orig.columns), key="m2b")
+                        cols_b = [c for c in df_b_orig.columns if c != COLUMNA_ORIGEN]
+                        c_f_b = st.selectbox("Columna Fecha", cols_b, index=_idx(cols_b, prev_b.get('fecha')), key="fb")
+                        c_d_b = st.selectbox("Columna Descripción", cols_b, index=_idx(cols_b, prev_b.get('descripcion')), key="db")
+                        c_m1_b = st.selectbox("Columna Ingresos/Créditos", cols_b, index=_idx(cols_b, prev_b.get('monto_1')), key="m1b")
+                        c_m2_b = st.selectbox("Columna Egresos/Débitos", ["Ninguna"] + cols_b, index=_idx(["Ninguna"] + cols_b, prev_b.get('monto_2')), key="m2b")
                     st.divider()
                     tol = st.slider("Tolerancia de días para coincidencias", 0, 15, 3, key="tol")
+                    t_imp1, t_imp2 = st.columns(2)
+                    tol_abs = t_imp1.number_input("Tolerancia de importe ($)", min_value=0.0, value=0.0, step=1.0, format="%.2f", key="tol_abs",
+                                                  help="Diferencia máxima admitida (retenciones, comisiones, redondeos). 0 = solo importes exactos.")
+                    tol_pct = t_imp2.number_input("Tolerancia de importe (%)", min_value=0.0, max_value=100.0, value=0.0, step=0.1, format="%.2f", key="tol_pct",
+                                                  help="Alternativa relativa al importe; se usa la mayor de las dos.")
 
                 submitted = st.form_submit_button("✅ Confirmar Mapeo y Procesar", use_container_width=True, type="primary")
                 if submitted:
-                    df_b = df_b_orig.copy()
-                    df_b[c_f_b] = pd.to_datetime(df_b[c_f_b], errors='coerce')
-                    df_b['NETO'] = process_amounts(df_b, c_m1_b, c_m2_b)
-                    tot_b = df_b['NETO'].sum()
-                    dis_b = round(inputs['s_fin_b'] - (s_ini_b + tot_b), 2)
-
-                    s_fin_m = 0.0 if sin_mayor else inputs['s_fin_m']
-
-                    if sin_mayor:
-                        p_m = df_m_orig.copy()
-                        p_b = df_b.copy()
-                        matched = pd.DataFrame()
-                        dis_m = 0
-                        c_f_m, c_d_m = 'Fecha', 'Descripción' # Dummy columns
-                    else:
-                        df_m = df_m_orig.copy()
-                        df_m[c_f_m] = pd.to_datetime(df_m[c_f_m], errors='coerce')
-                        df_m['NETO'] = process_amounts(df_m, c_m1_m, c_m2_m)
-                        tot_m = df_m['NETO'].sum()
-                        dis_m = round(s_fin_m - (s_ini_m + tot_m), 2)
-                        p_m, p_b, matched = find_matches_v2(df_m.dropna(subset=[c_f_m]), df_b.dropna(subset=[c_f_b]), c_f_m, 'NETO', c_d_m, c_f_b, 'NETO', c_d_b, tol)
-
-                    p_m = p_m.reset_index(drop=True)
-                    p_b = p_b.reset_index(drop=True)
-
-                    # --- FIX ERROR PANDAS: LIMPIAR DUPLICADOS ANTES DE CONCAT ---
-                    p_m = rename_duplicates(p_m)
-                    p_b = rename_duplicates(p_b)
-                    
-                    # 1. Recuperar pendientes del MAYOR (independientemente de sin_mayor)
-                    if not st.session_state['db_sistema']['partidas_arrastradas_m'].empty:
-                        arrastre_m = st.session_state['db_sistema']['partidas_arrastradas_m'].copy()
-                        arrastre_m = rename_duplicates(arrastre_m)
-
-                        # --- FIX CRITICO: NORMALIZAR COLUMNAS (Lógica replicada de BANCO) ---
-                        target_f, target_d = c_f_m, c_d_m
-                        if target_f not in p_m.columns:
-                            matches = [c for c in p_m.columns if str(c).startswith(str(c_f_m))]
-                            if matches: target_f = matches[0]
-                        if target_d not in p_m.columns:
-                            matches = [c for c in p_m.columns if str(c).startswith(str(c_d_m))]
-                            if matches: target_d = matches[0]
-
-                        if '_saved_fecha' in arrastre_m.columns and not sin_mayor:
-                            arrastre_m = arrastre_m.rename(columns={'_saved_fecha': target_f, '_saved_desc': target_d})
-                        
-                        p_m = pd.concat([arrastre_m, p_m], ignore_index=True)
-
-                    # 2. Recuperar pendientes del BANCO
-                    if not st.session_state['db_sistema']['partidas_arrastradas_b'].empty:
-                        arrastre_b = st.session_state['db_sistema']['partidas_arrastradas_b'].copy()
-                        arrastre_b = rename_duplicates(arrastre_b)
-
-                        # --- FIX CRITICO: NORMALIZAR COLUMNAS BANCO ---
-                        target_f, target_d = c_f_b, c_d_b
-                        if target_f not in p_b.columns:
-                            matches = [c for c in p_b.columns if str(c).startswith(str(c_f_b))]
-                            if matches: target_f = matches[0]
-                        if target_d not in p_b.columns:
-                            matches = [c for c in p_b.columns if str(c).startswith(str(c_d_b))]
-                            if matches: target_d = matches[0]
-
-                        if '_saved_fecha' in arrastre_b.columns:
-                            arrastre_b = arrastre_b.rename(columns={'_saved_fecha': target_f, '_saved_desc': target_d})
-                            
-                        p_b = pd.concat([arrastre_b, p_b], ignore_index=True)
-                    
-                    p_m['Anular por Error'] = False
-                    p_b['Ajustar en Libros'] = False
-                    
-                    st.session_state['conciliacion_activa'] = {
-                        'periodo': f"{inputs['sel_mes']} {inputs['sel_anio']}", 's_ini_m': s_ini_m, 's_fin_m': s_fin_m, 
-                        's_ini_b': s_ini_b, 's_fin_b': inputs['s_fin_b'], 'dis_m': dis_m, 'dis_b': dis_b, 'matched': matched, 
-                        'p_m': p_m, 'p_b': p_b,
-                        'column_map': {'c_f_m': c_f_m, 'c_d_m': c_d_m, 
-                                       'c_f_b': c_f_b, 'c_d_b': c_d_b}
-                    }
-                    st.session_state.conciliacion_step = 'reconcile'
-                    del st.session_state.temp_inputs
+                    map_b = {'fecha': c_f_b, 'descripcion': c_d_b, 'monto_1': c_m1_b, 'monto_2': c_m2_b}
+                    op_b = opciones_de_lado(df_b_orig, map_b)
+                    guardar_formato(db, user_id, MODULO_FORMATO, 'banco', huella_b, map_b, op_b)
+                    map_m, op_m = None, None
+                    if not sin_mayor:
+                        map_m = {'fecha': c_f_m, 'descripcion': c_d_m, 'monto_1': c_m1_m, 'monto_2': c_m2_m}
+                        op_m = opciones_de_lado(df_m_orig, map_m)
+                        guardar_formato(db, user_id, MODULO_FORMATO, 'mayor', huella_m, map_m, op_m)
+                    db.close()
+                    procesar_mapeo(inputs, df_m_orig, df_b_orig, map_m, map_b, op_m, op_b, tol, {'abs': tol_abs, 'pct': tol_pct})
                     st.rerun()
+            db.close()
 
         # ----- PASO 3: RECONCILIACIÓN -------------------------------------------------------------
         elif st.session_state.conciliacion_step == 'reconcile':
             res = st.session_state.get('conciliacion_activa')
-            meses = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
 
             if not res: 
                 st.session_state.conciliacion_step = 'upload'
                 st.rerun()
+            if 'eventos' not in res: iniciar_estado(res)
+
+            multi = st.session_state.get('multicuenta')
+            if multi:
+                with st.expander(f"🏦 Cuentas ({len(multi['sesiones'])} abiertas, {len(multi['cerradas'])} cerradas)", expanded=True):
+                    st.dataframe(resumen_cuentas(multi['sesiones'], multi['cerradas']), use_container_width=True, hide_index=True)
+                    abiertas = list(multi['sesiones'])
+                    elegida = st.selectbox("Cuenta a conciliar", abiertas, index=abiertas.index(res['cuenta']) if res['cuenta'] in abiertas else 0)
+                    if multi['sesiones'][elegida] is not res:
+                        st.session_state['conciliacion_activa'] = multi['sesiones'][elegida]
+                        st.rerun()
 
-            cmap = res['column_map']
-            st.info(f"Trabajando sobre el período: **{res['periodo']}**")
+            puesta = st.session_state.get('puesta_al_dia')
+            if puesta:
+                with st.expander(f"⏩ Puesta al día: {len(puesta['cerrados'])} meses cerrados, {len(puesta['cola'])} en espera", expanded=True):
+                    st.caption(f"**{res['periodo']}** no cierra en cero: concilialo a mano. Al cerrarlo, los meses en espera se "
+                               f"concilian y se cierran solos hasta el próximo con diferencia.")
+                    st.dataframe(resumen_cola(puesta), use_container_width=True, hide_index=True)
+                    avisos = [f"{n} movimientos del {lado} ya importados se omitieron" for lado, n in puesta['duplicados'].items() if n]
+                    avisos += [f"{n} movimientos del {lado} posteriores al último mes quedaron fuera" for lado, n in puesta['posteriores'].items() if n]
+                    avisos += [f"{len(df)} filas del {lado} con fecha no reconocida quedaron fuera" for lado, df in puesta['fechas_invalidas'].items() if len(df)]
+                    if avisos: st.caption("; ".join(avisos) + ".")
+
+            st.info(f"Trabajando sobre el período: **{res['periodo']}**" + (f" — cuenta **{res['cuenta']}**" if multi else ""))
+
+            duplicados = res.get('duplicados', {})
+            if sum(duplicados.values()):
+                st.info(f"♻️ Se omitieron {duplicados.get('mayor', 0)} movimientos del mayor y {duplicados.get('banco', 0)} del banco ya importados en cierres anteriores de **{res.get('cuenta', CUENTA_DEFAULT)}**.")
+
+            invalidas = res.get('fechas_invalidas', {})
+            n_invalidas = sum(len(v) for v in invalidas.values())
+            if n_invalidas:
+                with st.expander(f"⚠️ {n_invalidas} filas con fecha no reconocida (excluidas del cruce)"):
+                    for lado, df_inv in invalidas.items():
+                        if not df_inv.empty:
+                            st.write(f"**{lado.capitalize()}**")
+                            st.dataframe(df_inv, use_container_width=True)
+
+            if res.get('barrido') is not None:
+                with st.expander(f"🎚️ Tolerancia de Días (actual: {res['tol']})"):
+                    if 'preview_tol' not in res: res['preview_tol'] = previsualizar_tolerancias(res['barrido'])
+                    preview = res['preview_tol']
+                    c_tol1, c_tol2 = st.columns([2, 1])
+                    c_tol1.bar_chart(preview, x='Tolerancia (días)', y='Conciliados', height=220)
+                    with c_tol2:
+                        nueva_tol = st.slider("Nueva tolerancia", 0, res['barrido']['tol_max'], min(res['tol'], res['barrido']['tol_max']), key="tol_barrido")
+                        n_actual = int(preview.loc[preview['Tolerancia (días)'] == res['tol'], 'Conciliados'].sum())
+                        n_nuevo = int(preview.loc[preview['Tolerancia (días)'] == nueva_tol, 'Conciliados'].sum())
+                        st.metric("Conciliados automáticos", n_nuevo, delta=n_nuevo - n_actual)
+                        st.caption("Aplicar recalcula el cruce automático y descarta los ajustes y cruces manuales de este período.")
+                        if st.button("Aplicar Tolerancia", disabled=(nueva_tol == res['tol'])):
+                            aplicar_tolerancia(res, nueva_tol)
+                            st.rerun()
+            elif res.get('base') is not None:
+                # Archivos grandes (modo paralelo): sin barrido precalculado, aplicar vuelve a cruzar
+                with st.expander(f"🎚️ Tolerancia de Días (actual: {res['tol']})"):
+                    nueva_tol = st.slider("Nueva tolerancia", 0, TOL_MAX, min(res['tol'], TOL_MAX), key="tol_barrido")
+                    st.caption("Archivo grande: el cruce corre en paralelo y no hay vista previa por tolerancia. Aplicar vuelve a "
+                               "cruzar y descarta los ajustes y cruces manuales de este período.")
+                    if st.button("Aplicar Tolerancia", disabled=(nueva_tol == res['tol'])):
+                        aplicar_tolerancia(res, nueva_tol)
+                        st.rerun()
+
+            # Ediciones de los editores dibujados en la corrida anterior: se aplican antes de volver a dibujarlos
+            dibujados = dict(res.get('vistas', {}))
+            for clave, (lado, columna) in EDITORES.items():
+                if clave not in dibujados: continue
+                key, ids_vista = dibujados[clave]
+                estado_editor = st.session_state.get(key)
+                if estado_editor:
+                    accion_ediciones(res, lado, columna, ids_vista, estado_editor.get('edited_rows'))
+
+            # Deshacer / rehacer: cada acción manual es un evento (modules.eventos)
+            prox_deshacer, prox_rehacer = ultimo(res, 'pila'), ultimo(res, 'rehacer')
+            c_undo, c_redo, c_ult = st.columns([1, 1, 4])
+            if c_undo.button("↩️ Deshacer", disabled=prox_deshacer is None, key="btn_deshacer",
+                             help=prox_deshacer['descripcion'] if prox_deshacer else None):
+                deshacer(res)
+                st.rerun()
+            if c_redo.button("↪️ Rehacer", disabled=prox_rehacer is None, key="btn_rehacer",
+                             help=prox_rehacer['descripcion'] if prox_rehacer else None):
+                rehacer(res)
+                st.rerun()
+            if prox_deshacer: c_ult.caption(f"Última acción: {prox_deshacer['descripcion']}")
+            tot = totales(res)
 
             with st.expander("🔎 Ver y Ajustar Partidas Pendientes", expanded=True):
                 tabs = st.tabs(["✅ Conciliados", "📋 Pendientes Mayor", "🏦 Pendientes Banco", "🤝 Match Manual"])
                 
                 with tabs[0]:
                     st.info("Movimientos que el sistema encontró o que fueron ajustados manualmente.")
-                    st.dataframe(res['matched'], use_container_width=True, height=250)
+                    st.dataframe(res['matched'], use_container_width=True, height=250, column_config={
+                        'id_mayor': None, 'id_banco': None,
+                        'Diferencia': st.column_config.NumberColumn("Diferencia", format="$ %.2f", help="Banco - Mayor en cruces con tolerancia de importe."),
+                        'Confianza': st.column_config.ProgressColumn("Confianza", min_value=0, max_value=100, format="%d%%", help="Similitud entre las descripciones del mayor y del banco (100 si coincidió una clave)."),
+                        'Clave': st.column_config.TextColumn("Clave", help="Cheque, DEBIN, transferencia o CUIT que coincidió en ambas descripciones."),
+                    })
                 
                 with tabs[1]:
                     st.info("Partidas en el Mayor Contable que no se encontraron en el Extracto Bancario.")
-                    if not res['p_m'].empty:
+                    if tot['n_pend_m']:
+                        filtro_pm, orden_pm = filtros_vista('editor_pm')
                         b_col1, b_col2, _ = st.columns([1,1,4])
-                        if b_col1.button("Marcar Todos p/ Anular", key="btn_anular_all"):
-                            res['p_m']['Anular por Error'] = True
+                        if b_col1.button("Marcar Todos p/ Anular", key="btn_anular_all", help="Marca todas las filas que cumplen el filtro, en todas las páginas."):
+                            accion_marcar(res, 'm', MARCAS['m'], ids_filtrados(res['p_m'], filtro_pm), True)
                             st.rerun()
                         if b_col2.button("Desmarcar Todos", key="btn_desanular_all"):
-                            res['p_m']['Anular por Error'] = False
+                            accion_marcar(res, 'm', MARCAS['m'], ids_filtrados(res['p_m'], filtro_pm), False)
                             st.rerun()
 
-                        try:
-                            # --- FIX DEFINITIVO DE VISUALIZACIÓN MAYOR ---
-                            # Estrategia: 1. Buscar nombre exacto. 2. Buscar nombre parecido. 3. Usar columnas por defecto si todo falla.
-                            
-                            c_f_m_final = cmap['c_f_m']
-                            if c_f_m_final not in res['p_m'].columns:
-                                matches = [c for c in res['p_m'].columns if str(c).startswith(str(cmap['c_f_m']))]
-                                if matches: c_f_m_final = matches[0]
-                            
-                            c_d_m_final = cmap['c_d_m']
-                            if c_d_m_final not in res['p_m'].columns:
-                                matches = [c for c in res['p_m'].columns if str(c).startswith(str(cmap['c_d_m']))]
-                                if matches: c_d_m_final = matches[0]
-
-                            cols_to_show_m = [c_f_m_final, c_d_m_final, 'NETO', 'Anular por Error']
-                            
-                            # Filtro estricto: Solo columnas que realmente existen
-                            cols_to_show_m = [c for c in cols_to_show_m if c in res['p_m'].columns]
-                            
-                            # FALLBACK DE SEGURIDAD: Si nos quedamos sin fecha/descripción, agregamos las primeras columnas
-                            if len(cols_to_show_m) <= 2: 
-                                safe_cols = [res['p_m'].columns[0]]
-                                if len(res['p_m'].columns) > 1: safe_cols.append(res['p_m'].columns[1])
-                                cols_to_show_m = safe_cols + cols_to_show_m
-                                cols_to_show_m = list(dict.fromkeys(cols_to_show_m)) # Quitar duplicados
-
-                            edited_pm = st.data_editor(res['p_m'][cols_to_show_m], key='editor_pm', use_container_width=True,
-                                                       column_config={"Anular por Error": st.column_config.CheckboxColumn(help="Marcar si esta partida fue un error en los libros y debe ser revertida.")})
-                            res['p_m']['Anular por Error'] = edited_pm['Anular por Error']
-                        except Exception as e:
-                            st.warning(f"No hay partidas pendientes del mayor para mostrar o hubo un error de columnas.")
+                        editor_paginado(res, 'editor_pm', 'm', ['fecha', 'descripcion', 'neto', 'Anular por Error'],
+                                        {**VISTA_COLUMNAS, "Anular por Error": st.column_config.CheckboxColumn(help="Marcar si esta partida fue un error en los libros y debe ser revertida.")},
+                                        filtro_pm, orden_pm)
 
                 with tabs[2]:
                     st.info("Movimientos en el Extracto Bancario no encontrados en el Mayor. Marque los que ya ha contabilizado y confirme.")
-                    if not res['p_b'].empty:
+                    if tot['n_pend_b']:
+                        filtro_pb, orden_pb = filtros_vista('editor_pb')
                         b_col3, b_col4, _ = st.columns([1,1,4])
-                        if b_col3.button("Marcar Todos p/ Ajustar", key="btn_ajustar_all"):
-                            res['p_b']['Ajustar en Libros'] = True
+                        if b_col3.button("Marcar Todos p/ Ajustar", key="btn_ajustar_all", help="Marca todas las filas que cumplen el filtro, en todas las páginas."):
+                            accion_marcar(res, 'b', MARCAS['b'], ids_filtrados(res['p_b'], filtro_pb), True)
                             st.rerun()
                         if b_col4.button("Desmarcar Todos", key="btn_desajustar_all"):
-                            res['p_b']['Ajustar en Libros'] = False
+                            accion_marcar(res, 'b', MARCAS['b'], ids_filtrados(res['p_b'], filtro_pb), False)
                             st.rerun()
 
-                        try:
-                            # --- FIX DEFINITIVO DE VISUALIZACIÓN BANCO ---
-                            c_f_b_final = cmap['c_f_b']
-                            if c_f_b_final not in res['p_b'].columns:
-                                matches = [c for c in res['p_b'].columns if str(c).startswith(str(cmap['c_f_b']))]
-                                if matches: c_f_b_final = matches[0]
-                            
-                            c_d_b_final = cmap['c_d_b']
-                            if c_d_b_final not in res['p_b'].columns:
-                                matches = [c for c in res['p_b'].columns if str(c).startswith(str(cmap['c_d_b']))]
-                                if matches: c_d_b_final = matches[0]
-
-                            cols_to_show_b = [c_f_b_final, c_d_b_final, 'NETO', 'Ajustar en Libros']
-                            
-                            # Filtro estricto
-                            cols_to_show_b = [c for c in cols_to_show_b if c in res['p_b'].columns]
-                            
-                            # FALLBACK DE SEGURIDAD
-                            if len(cols_to_show_b) <= 2: 
-                                safe_cols = [res['p_b'].columns[0]]
-                                if len(res['p_b'].columns) > 1: safe_cols.append(res['p_b'].columns[1])
-                                cols_to_show_b = safe_cols + cols_to_show_b
-                                cols_to_show_b = list(dict.fromkeys(cols_to_show_b))
-
-                            edited_pb = st.data_editor(res['p_b'][cols_to_show_b], key='editor_pb', use_container_width=True,
-                                                       column_config={"Ajustar en Libros": st.column_config.CheckboxColumn(help="Marcar si ya contabilizaste esta partida en tus libros.")})
-                            res['p_b']['Ajustar en Libros'] = edited_pb['Ajustar en Libros']
-                        except Exception as e:
-                            st.warning(f"No hay partidas pendientes del banco para mostrar.")
+                        editor_paginado(res, 'editor_pb', 'b', ['fecha', 'descripcion', 'neto', 'Ajustar en Libros'],
+                                        {**VISTA_COLUMNAS, "Ajustar en Libros": st.column_config.CheckboxColumn(help="Marcar si ya contabilizaste esta partida en tus libros.")},
+                                        filtro_pb, orden_pb)
                         
                         if st.button("Confirmar Ajustes Realizados", key="btn_confirmar_ajustes", type="primary"):
-                            p_b_ajustados_mask = res['p_b']['Ajustar en Libros'].fillna(False).astype(bool)
-                            p_b_ajustados = res['p_b'][p_b_ajustados_mask]
+                            p_b_ajustados = res['p_b'].loc[ids_marcados(res, 'b', MARCAS['b'])]
                             
                             if not p_b_ajustados.empty:
-                                total_ajustado = p_b_ajustados['NETO'].sum()
-                                res['s_fin_m'] += total_ajustado
-
-                                new_matches = []
-                                for _, row in p_b_ajustados.iterrows():
-                                    new_matches.append({
-                                        'Fecha_Mayor': row[cmap['c_f_b']], 
-                                        'Detalle_Mayor': "AJUSTE CONTABILIZADO", 
-                                        'Monto': row['NETO'], 
-                                        'Fecha_Banco': row[cmap['c_f_b']], 
-                                        'Detalle_Banco': row[cmap['c_d_b']]
-                                    })
+                                total_ajustado = p_b_ajustados['neto'].sum()
+
+                                new_matches = pd.DataFrame({
+                                    'Fecha_Mayor': p_b_ajustados['fecha'], 
+                                    'Detalle_Mayor': "AJUSTE CONTABILIZADO", 
+                                    'Monto': p_b_ajustados['neto'], 
+                                    'Fecha_Banco': p_b_ajustados['fecha'], 
+                                    'Detalle_Banco': p_b_ajustados['descripcion'],
+                                    'id_banco': p_b_ajustados['source_row_id']
+                                }).reset_index(drop=True)
                                 
-                                res['matched'] = pd.concat([res.get('matched', pd.DataFrame()), pd.DataFrame(new_matches)], ignore_index=True)
-                                res['p_b'] = res['p_b'][~p_b_ajustados_mask].reset_index(drop=True)
+                                accion_cruce(res, 'ajuste', [], p_b_ajustados.index, new_matches, importe=total_ajustado,
+                                             descripcion=f"Ajustes contabilizados ({len(new_matches)} partidas, ${total_ajustado:,.2f})")
                                 
                                 st.success(f"{len(new_matches)} partidas movidas a conciliados. Saldo de mayor actualizado en ${total_ajustado:,.2f}.")
                                 st.rerun()
@@ -503,98 +1005,42 @@ def render():
                     st.markdown("##### 🤝 Cruce Manual de Partidas")
                     st.info("Selecciona partidas del Mayor (Izquierda) y del Banco (Derecha). Si la suma de ambas selecciones coincide, podrás confirmar el match.")
 
-                    # --- NOTA: rename_duplicates ahora es global ---
-                    # res['p_m'] = rename_duplicates(res['p_m']) # Ya se hizo arriba
-                    # res['p_b'] = rename_duplicates(res['p_b']) # Ya se hizo arriba
-
-                    if 'Select_Match' not in res['p_m'].columns: res['p_m']['Select_Match'] = False
-                    if 'Select_Match' not in res['p_b'].columns: res['p_b']['Select_Match'] = False
-
-                    idx_disp_m = res['p_m'][res['p_m']['Anular por Error'].fillna(False) == False].index
-                    idx_disp_b = res['p_b'][res['p_b']['Ajustar en Libros'].fillna(False) == False].index
+                    cols_view = ['Select_Match', 'fecha', 'descripcion', 'neto']
+                    config_view = {**VISTA_COLUMNAS, "Select_Match": st.column_config.CheckboxColumn("Seleccionar", width="small")}
 
                     col_izq, col_cen, col_der = st.columns([0.48, 0.04, 0.48])
 
                     with col_izq:
-                        st.write(f"**📖 Pendientes Mayor ({len(idx_disp_m)})**")
+                        st.write("**📖 Pendientes Mayor**")
+                        filtro_m, orden_m = filtros_vista('editor_manual_m')
+                        filtro_m['excluir'] = MARCAS['m']
                         c_btn_m1, c_btn_m2 = st.columns(2)
                         if c_btn_m1.button("✅ Todos", key="sel_all_m"):
-                            res['p_m'].loc[idx_disp_m, 'Select_Match'] = True
+                            accion_marcar(res, 'm', SELECCION, ids_filtrados(res['p_m'], filtro_m), True)
                             st.rerun()
                         if c_btn_m2.button("⬜ Ninguno", key="desel_all_m"):
-                            res['p_m'].loc[idx_disp_m, 'Select_Match'] = False
+                            accion_marcar(res, 'm', SELECCION, res['p_m'].index, False)
                             st.rerun()
 
-                        # --- FIX VISUALIZACIÓN: CONSTRUCCION SEGURA DE COLUMNAS ---
-                        cols_view_m = ['Select_Match']
-                        
-                        col_f_m = cmap['c_f_m']
-                        if col_f_m not in res['p_m'].columns:
-                            possibles = [c for c in res['p_m'].columns if str(c).startswith(str(col_f_m))]
-                            if possibles: col_f_m = possibles[0]
-                        if col_f_m in res['p_m'].columns: cols_view_m.append(col_f_m)
-
-                        col_d_m = cmap['c_d_m']
-                        if col_d_m not in res['p_m'].columns:
-                            possibles = [c for c in res['p_m'].columns if str(c).startswith(str(col_d_m))]
-                            if possibles: col_d_m = possibles[0]
-                        
-                        if col_d_m in res['p_m'].columns and col_d_m not in cols_view_m:
-                            cols_view_m.append(col_d_m)
-
-                        cols_view_m.append('NETO')
-                        # -----------------------------------------------------------
-
-                        edited_m = st.data_editor(
-                            res['p_m'].loc[idx_disp_m, cols_view_m],
-                            key="editor_manual_m", hide_index=True, use_container_width=True,
-                            column_config={"Select_Match": st.column_config.CheckboxColumn("Seleccionar", width="small"), "NETO": st.column_config.NumberColumn("Importe", format="$ %.2f")}
-                        )
-                        if not edited_m.empty: res['p_m'].update(edited_m['Select_Match'])
+                        editor_paginado(res, 'editor_manual_m', 'm', cols_view, config_view, filtro_m, orden_m)
 
                     with col_der:
-                        st.write(f"**🏦 Pendientes Banco ({len(idx_disp_b)})**")
+                        st.write("**🏦 Pendientes Banco**")
+                        filtro_b, orden_b = filtros_vista('editor_manual_b')
+                        filtro_b['excluir'] = MARCAS['b']
                         c_btn_b1, c_btn_b2 = st.columns(2)
                         if c_btn_b1.button("✅ Todos", key="sel_all_b"):
-                            res['p_b'].loc[idx_disp_b, 'Select_Match'] = True
+                            accion_marcar(res, 'b', SELECCION, ids_filtrados(res['p_b'], filtro_b), True)
                             st.rerun()
                         if c_btn_b2.button("⬜ Ninguno", key="desel_all_b"):
-                            res['p_b'].loc[idx_disp_b, 'Select_Match'] = False
+                            accion_marcar(res, 'b', SELECCION, res['p_b'].index, False)
                             st.rerun()
 
-                        # --- FIX VISUALIZACIÓN BANCO ---
-                        cols_view_b = ['Select_Match']
-                        
-                        col_f_b = cmap['c_f_b']
-                        if col_f_b not in res['p_b'].columns:
-                            possibles = [c for c in res['p_b'].columns if str(c).startswith(str(col_f_b))]
-                            if possibles: col_f_b = possibles[0]
-                        if col_f_b in res['p_b'].columns: cols_view_b.append(col_f_b)
-
-                        col_d_b = cmap['c_d_b']
-                        if col_d_b not in res['p_b'].columns:
-                            possibles = [c for c in res['p_b'].columns if str(c).startswith(str(col_d_b))]
-                            if possibles: col_d_b = possibles[0]
-
-                        if col_d_b in res['p_b'].columns and col_d_b not in cols_view_b:
-                            cols_view_b.append(col_d_b)
-                        
-                        cols_view_b.append('NETO')
-                        # -------------------------------
-                        
-                        edited_b = st.data_editor(
-                            res['p_b'].loc[idx_disp_b, cols_view_b],
-                            key="editor_manual_b", hide_index=True, use_container_width=True,
-                            column_config={"Select_Match": st.column_config.CheckboxColumn("Seleccionar", width="small"), "NETO": st.column_config.NumberColumn("Importe", format="$ %.2f")}
-                        )
-                        if not edited_b.empty: res['p_b'].update(edited_b['Select_Match'])
+                        editor_paginado(res, 'editor_manual_b', 'b', cols_view, config_view, filtro_b, orden_b)
 
                     st.divider()
-                    sel_m = res['p_m'].loc[res['p_m']['Select_Match'] == True]
-                    sel_b = res['p_b'].loc[res['p_b']['Select_Match'] == True]
-
-                    sum_m = sel_m['NETO'].sum()
-                    sum_b = sel_b['NETO'].sum()
+                    sum_m, sum_b = tot['sel_m'], tot['sel_b']
+                    n_sel_m, n_sel_b = tot['n_sel_m'], tot['n_sel_b']
                     diff_match = round(sum_m - sum_b, 2)
 
                     c_res1, c_res2, c_res3, c_res4 = st.columns([1, 1, 1, 1.5])
@@ -605,69 +1051,61 @@ def render():
 
                     with c_res4:
                         st.write("### Acciones")
-                        valid_match = (abs(diff_match) < 0.01) and (len(sel_m) > 0 or len(sel_b) > 0)
+                        valid_match = (abs(diff_match) < 0.01) and (n_sel_m > 0 or n_sel_b > 0)
                         
                         if st.button("🔗 CONFIRMAR MATCH", type="primary", disabled=not valid_match, use_container_width=True):
+                            sel_m = res['p_m'].loc[ids_marcados(res, 'm', SELECCION)]
+                            sel_b = res['p_b'].loc[ids_marcados(res, 'b', SELECCION)]
                             new_matches = []
                             match_id = datetime.now().strftime("%H%M%S")
                             
-                            def safe_get(row, col_name, fallback_cols):
-                                if col_name in row: return row[col_name]
-                                for c in fallback_cols:
-                                    if c in row: return row[c]
-                                return "S/D"
-
-                            desc_group_b = f"Match Manual (Ref: {safe_get(sel_b.iloc[0], cmap['c_d_b'], cols_view_b) if not sel_b.empty else 'Var'}...)"
-                            desc_group_m = f"Match Manual (Ref: {safe_get(sel_m.iloc[0], cmap['c_d_m'], cols_view_m) if not sel_m.empty else 'Var'}...)"
+                            desc_group_b = f"Match Manual (Ref: {sel_b.iloc[0]['descripcion'] if not sel_b.empty else 'Var'}...)"
+                            desc_group_m = f"Match Manual (Ref: {sel_m.iloc[0]['descripcion'] if not sel_m.empty else 'Var'}...)"
                             
                             for idx, row in sel_m.iterrows():
                                 new_matches.append({
-                                    'Fecha_Mayor': safe_get(row, cmap['c_f_m'], cols_view_m),
-                                    'Detalle_Mayor': safe_get(row, cmap['c_d_m'], cols_view_m),
-                                    'Monto': row['NETO'],
-                                    'Fecha_Banco': safe_get(sel_b.iloc[0], cmap['c_f_b'], cols_view_b) if not sel_b.empty else safe_get(row, cmap['c_f_m'], cols_view_m),
-                                    'Detalle_Banco': f"🖇️ {desc_group_b} [ID:{match_id}]"
+                                    'Fecha_Mayor': row['fecha'],
+                                    'Detalle_Mayor': row['descripcion'],
+                                    'Monto': row['neto'],
+                                    'Fecha_Banco': sel_b.iloc[0]['fecha'] if not sel_b.empty else row['fecha'],
+                                    'Detalle_Banco': f"🖇️ {desc_group_b} [ID:{match_id}]",
+                                    'id_mayor': row['source_row_id']
                                 })
 
                             if sel_m.empty and not sel_b.empty:
                                 for idx, row in sel_b.iterrows():
                                     new_matches.append({
-                                        'Fecha_Mayor': safe_get(row, cmap['c_f_b'], cols_view_b),
+                                        'Fecha_Mayor': row['fecha'],
                                         'Detalle_Mayor': f"🖇️ {desc_group_m} [ID:{match_id}]",
-                                        'Monto': row['NETO'],
-                                        'Fecha_Banco': safe_get(row, cmap['c_f_b'], cols_view_b),
-                                        'Detalle_Banco': safe_get(row, cmap['c_d_b'], cols_view_b)
+                                        'Monto': row['neto'],
+                                        'Fecha_Banco': row['fecha'],
+                                        'Detalle_Banco': row['descripcion'],
+                                        'id_banco': row['source_row_id']
                                     })
                             
-                            res['p_m'] = res['p_m'].drop(sel_m.index).reset_index(drop=True)
-                            res['p_b'] = res['p_b'].drop(sel_b.index).reset_index(drop=True)
-                            res['matched'] = pd.concat([res.get('matched', pd.DataFrame()), pd.DataFrame(new_matches)], ignore_index=True)
+                            # Los cruces 1 a 1 se aprenden como alias al cerrar el período
+                            par = None
+                            if len(sel_m) == 1 and len(sel_b) == 1:
+                                par = (sel_m.iloc[0]['descripcion'], sel_b.iloc[0]['descripcion'])
+
+                            accion_cruce(res, 'match', sel_m.index, sel_b.index, pd.DataFrame(new_matches), alias=par,
+                                         descripcion=f"Match manual {len(sel_m)} mayor ↔ {len(sel_b)} banco (${sum_m:,.2f})")
                             st.success(f"✅ ¡Conciliado!")
                             st.rerun()
 
-                        if not valid_match and (len(sel_m) > 0 or len(sel_b) > 0):
+                        if not valid_match and (n_sel_m > 0 or n_sel_b > 0):
                             st.caption("⚠️ Las sumas deben ser idénticas.")
             
-            # --- CÁLCULOS Y CIERRE ---
-            p_m_anulados = res['p_m'][res['p_m']['Anular por Error'].fillna(False)]
-            ajuste_por_anulacion = p_m_anulados['NETO'].sum()
-            
-            p_b_para_ajuste_teorico = res['p_b'][res['p_b']['Ajustar en Libros'].fillna(False)]
-            ajuste_por_banco_teorico = p_b_para_ajuste_teorico['NETO'].sum()
-            
-            mayor_ajustado_real = res['s_fin_m'] - ajuste_por_anulacion + ajuste_por_banco_teorico
-          
-            p_m_no_anular = res['p_m'][~res['p_m']['Anular por Error'].fillna(False)]
-            p_b_no_ajustar = res['p_b'][~res['p_b']['Ajustar en Libros'].fillna(False)]
-            
-            partidas_m_pend_neto = p_m_no_anular['NETO'].sum()
-            partidas_b_pend_neto = p_b_no_ajustar['NETO'].sum()
-            
-            m_ajustado_teorico = mayor_ajustado_real - partidas_m_pend_neto + partidas_b_pend_neto
-            
-            s_fin_b_numeric = pd.to_numeric(res.get('s_fin_b'), errors='coerce')
-            if pd.isna(s_fin_b_numeric): s_fin_b_numeric = 0.0
-            dif_final = round(m_ajustado_teorico - s_fin_b_numeric, 2)
+            if res['eventos']:
+                with st.expander(f"🧾 Historial de acciones ({len(res['eventos'])})"):
+                    st.dataframe(historial(res), use_container_width=True, hide_index=True)
+                    if st.button("Verificar (reproducir el historial)", key="btn_verificar_log"):
+                        if verificar(res): st.success("El historial reproduce exactamente el estado actual.")
+                        else: st.error("El historial no reproduce el estado actual.")
+
+            # --- CÁLCULOS Y CIERRE (totales incrementales: no recorren los pendientes) ---
+            ajuste_por_tolerancia = tot['tolerancia']
+            mayor_ajustado_real, m_ajustado_teorico, s_fin_b_numeric, dif_final, df_reconcile = cuadro_cierre(res, tot)
 
             st.divider()
             st.markdown("### 📊 Totales de Conciliación")
@@ -675,17 +1113,10 @@ def render():
             col1.metric("Saldo Mayor Contable Teórico", f"${m_ajustado_teorico:,.2f}")
             col2.metric("Saldo Final Extracto Bancario", f"${s_fin_b_numeric:,.2f}")
             col3.metric("Diferencia", f"${dif_final:,.2f}")
+            if round(ajuste_por_tolerancia, 2) != 0:
+                st.caption(f"Incluye ${ajuste_por_tolerancia:,.2f} de diferencias de importe en cruces con tolerancia (a ajustar en libros).")
             st.divider()
 
-            df_reconcile = pd.DataFrame([
-                {"Concepto": "Saldo Contable Ajustado (p/ Cierre)", "Importe": mayor_ajustado_real},
-                {"Concepto": "(-) Partidas de Mayor no conciliadas", "Importe": -partidas_m_pend_neto},
-                {"Concepto": "(+) Partidas de Banco no conciliadas", "Importe": partidas_b_pend_neto},
-                {"Concepto": "SALDO TEÓRICO CONCILIADO", "Importe": m_ajustado_teorico},
-                {"Concepto": "SALDO FINAL BANCARIO (Extracto)", "Importe": s_fin_b_numeric},
-                {"Concepto": "DIFERENCIA DE CONCILIACIÓN", "Importe": dif_final},
-            ])
-
             st.markdown("### 📝 Hoja de Trabajo (Análisis de Diferencias)")
             st.table(df_reconcile.style.format({"Importe": "{:,.2f}"}).apply(style_summary, axis=1))
 
@@ -698,42 +1129,51 @@ def render():
             
             if c_close2.button("✅ Confirmar Cierre", type="primary", disabled=(dif_final != 0)):
                 sel_mes, sel_anio = res['periodo'].split()
-                
-                # 1. GUARDAR EN BASE DE DATOS
+
+                # 1. ARRASTRES (ya en el esquema canónico): pasan al mes siguiente y alimentan el resumen
+                pm_save, pb_save = arrastres_de(res)
+
+                # 2. GUARDAR EN BASE DE DATOS
                 db = SessionLocal()
-                hoja_trabajo_dict = df_reconcile.to_dict(orient='records')
-                
-                nueva_conciliacion = Conciliacion(
-                    user_id=st.session_state['user_id'],
-                    periodo_mes=meses.index(sel_mes) + 1,
-                    periodo_anio=int(sel_anio),
-                    fecha_cierre=datetime.now(),
-                    saldo_mayor=mayor_ajustado_real,
-                    saldo_banco=res['s_fin_b'],
-                    estado="CERRADO OK" if dif_final == 0 else "CERRADO CON DIF.",
-                    datos_hoja_trabajo=hoja_trabajo_dict
-                )
-                db.add(nueva_conciliacion)
+                registrar_cierre(db, res, int(sel_anio), MESES.index(sel_mes) + 1, mayor_ajustado_real, dif_final, df_reconcile, pm_save, pb_save)
                 db.commit()
                 db.close()
 
-                # 2. PREPARAR ARRASTRES (ESTANDARIZANDO COLUMNAS)
-                pm_save = p_m_no_anular.drop(columns=['Anular por Error'], errors='ignore')
-                pb_save = p_b_no_ajustar.drop(columns=['Ajustar en Libros'], errors='ignore')
-                
-                if cmap['c_f_m'] in pm_save.columns: pm_save = pm_save.rename(columns={cmap['c_f_m']: '_saved_fecha'})
-                if cmap['c_d_m'] in pm_save.columns: pm_save = pm_save.rename(columns={cmap['c_d_m']: '_saved_desc'})
-
-                if cmap['c_f_b'] in pb_save.columns: pb_save = pb_save.rename(columns={cmap['c_f_b']: '_saved_fecha'})
-                if cmap['c_d_b'] in pb_save.columns: pb_save = pb_save.rename(columns={cmap['c_d_b']: '_saved_desc'})
+                multi = st.session_state.get('multicuenta')
+                if multi:
+                    # Multi-cuenta: saldos y arrastres del banco por cuenta; el mayor compartido arrastra desde la principal,
+                    # que además deja sus saldos y arrastres en los de la sesión (los que abre un período de una sola cuenta)
+                    guardar_saldos_cuenta(st.session_state['db_sistema'], res['cuenta'], mayor_ajustado_real, res['s_fin_b'], pb_save)
+                    if res['cuenta'] == multi['principal']:
+                        st.session_state['db_sistema'].update({
+                            'saldo_acumulado_m': mayor_ajustado_real, 'saldo_acumulado_b': res['s_fin_b'],
+                            'partidas_arrastradas_m': pm_save, 'partidas_arrastradas_b': pb_save})
+                    del multi['sesiones'][res['cuenta']]
+                    multi['cerradas'].append(res['cuenta'])
+                    if multi['sesiones']:
+                        st.session_state['conciliacion_activa'] = next(iter(multi['sesiones'].values()))
+                        st.success(f"✨ ¡CONCILIACIÓN DE {res['cuenta']} ({res['periodo']}) GUARDADA! Quedan {len(multi['sesiones'])} cuentas.")
+                        st.rerun()
+                    del st.session_state['multicuenta']
+                    st.session_state['db_sistema']['last_closed_period'] = (MESES.index(sel_mes), int(sel_anio))
+                else:
+                    st.session_state['db_sistema']['saldo_acumulado_m'] = mayor_ajustado_real
+                    st.session_state['db_sistema']['saldo_acumulado_b'] = res['s_fin_b']
+                    st.session_state['db_sistema']['last_closed_period'] = (MESES.index(sel_mes), int(sel_anio))
+
+                    st.session_state['db_sistema']['partidas_arrastradas_m'] = pm_save
+                    st.session_state['db_sistema']['partidas_arrastradas_b'] = pb_save
+                    guardar_saldos_cuenta(st.session_state['db_sistema'], res.get('cuenta', CUENTA_DEFAULT), mayor_ajustado_real,
+                                          res['s_fin_b'], pb_save, solo_si_existe=True)
+
+                    if st.session_state.get('puesta_al_dia'):
+                        # Puesta al día: el mes trabajado a mano quedó cerrado, la corrida sigue con los que esperan
+                        st.session_state['puesta_al_dia']['cerrados'].append(res['periodo'])
+                        st.session_state['puesta_al_dia']['detenido'] = None
+                        n_lote = avanzar_puesta_al_dia()
+                        st.toast(f"{res['periodo']} cerrado" + (f" y {n_lote} meses más en lote." if n_lote else "."))
+                        st.rerun()
 
-                st.session_state['db_sistema']['saldo_acumulado_m'] = mayor_ajustado_real
-                st.session_state['db_sistema']['saldo_acumulado_b'] = res['s_fin_b']
-                st.session_state['db_sistema']['last_closed_period'] = (meses.index(sel_mes), int(sel_anio))
-                
-                st.session_state['db_sistema']['partidas_arrastradas_m'] = pm_save
-                st.session_state['db_sistema']['partidas_arrastradas_b'] = pb_save
-            
                 st.session_state['conciliacion_activa'] = None
                 st.session_state.conciliacion_step = 'upload'
                 st.success(f"✨ ¡CONCILIACIÓN DE {res['periodo']} GUARDADA EN BASE DE DATOS!")
@@ -741,6 +1181,8 @@ def render():
 
             if c_close3.button("❌ Cancelar"):
                 st.session_state['conciliacion_activa'] = None
+                st.session_state.pop('multicuenta', None)
+                st.session_state.pop('puesta_al_dia', None)
                 st.session_state.conciliacion_step = 'upload'
                 st.toast("Conciliación cancelada.")
                 st.rerun()
@@ -757,9 +1199,9 @@ def render():
         if conciliaciones_db:
             data_view = []
             for c in conciliaciones_db:
-                mes_nombre = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"][c.periodo_mes - 1]
+                mes_nombre = MESES[c.periodo_mes - 1]
                 data_view.append({
-                    "ID": c.id, "Periodo": f"{mes_nombre} {c.periodo_anio}",
+                    "ID": c.id, "Periodo": f"{mes_nombre} {c.periodo_anio}", "Cuenta": c.cuenta or CUENTA_DEFAULT,
                     "Fecha Cierre": c.fecha_cierre.strftime("%Y-%m-%d %H:%M"),
                     "Saldo Final Mayor": c.saldo_mayor, "Saldo Final Banco": c.saldo_banco, "Estado": c.estado
                 })
@@ -768,7 +1210,7 @@ def render():
             st.divider()
             
             st.write("#### 🔎 Visualizar Conciliación Anterior")
-            opciones = {f"{d['Periodo']} (ID: {d['ID']})": d['ID'] for d in data_view}
+            opciones = {f"{d['Periodo']} - {d['Cuenta']} (ID: {d['ID']})": d['ID'] for d in data_view}
             seleccion_str = st.selectbox("Selecciona un período cerrado:", list(opciones.keys()))
             
             if seleccion_str:
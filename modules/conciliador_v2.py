@@ -2,6 +2,13 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 from models import SessionLocal, ConciliacionV2, MovimientoBanco, MovimientoContable
+from modules.formatos import (huella_archivo, detectar_opciones, detectar_formato_numero, convertir_montos,
+                              buscar_formato, guardar_formato, registrar_uso, COLUMNA_ORIGEN)
+from modules.ingesta import leer as leer_partes
+from modules.fechas import normalizar_fechas
+from modules.huellas import filtrar_nuevos, registrar_huellas
+
+MODULO_FORMATO = 'conciliador_v2' # Clave de sus layouts guardados (mapeo fecha/concepto/monto)
 
 # --- Inicialización del Session State ---
 def init_session_state():
@@ -14,71 +21,113 @@ def init_session_state():
             "nombre_archivo_mayor": "",
             "columnas_mapeadas_banco": {},
             "columnas_mapeadas_mayor": {},
+            "huellas": {"banco": None, "mayor": None},
             "conciliacion_id": None,
             "saldos": {"banco": 0.0, "mayor": 0.0},
             "step": 1,
         }
 
 # --- Lógica de Carga y Procesamiento de Archivos ---
-def procesar_archivo_cargado(archivo_subido):
-    """Lee un archivo de Excel o CSV y lo carga en un DataFrame de pandas."""
-    if archivo_subido:
-        nombre_archivo = archivo_subido.name
+def procesar_archivo_cargado(archivos_subidos, db=None, origen=None):
+    """Lee uno o varios archivos de Excel o CSV (todas sus hojas) y los une en un DataFrame de pandas
+    (modules.ingesta). Si el layout del primero ya fue mapeado por el usuario, lee solo las columnas
+    necesarias con dtypes explícitos."""
+    if archivos_subidos and not isinstance(archivos_subidos, list): archivos_subidos = [archivos_subidos]
+    if archivos_subidos:
+        nombre_archivo = archivos_subidos[0].name
         try:
-            if nombre_archivo.endswith('.csv'):
-                df = pd.read_csv(archivo_subido)
-            elif nombre_archivo.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(archivo_subido)
-            else:
+            if not all(a.name.endswith(('.csv', '.xls', '.xlsx')) for a in archivos_subidos):
                 st.warning("Formato de archivo no soportado.")
                 return None, ""
-            st.success(f"Archivo '{nombre_archivo}' cargado.")
+            archivos = [(a.name, a.getvalue()) for a in archivos_subidos]
+            huella = huella_archivo(archivos[0][1], nombre_archivo)
+            st.session_state.conciliador_v2['huellas'][origen] = huella
+            formato = buscar_formato(db, st.session_state.get('user_id'), MODULO_FORMATO, origen, huella) if db is not None else None
+            dfs, informe = leer_partes({origen: archivos}, {origen: formato.opciones_lectura if formato is not None else None})
+            df = dfs[origen]
+            if informe['omitidas'][origen]:
+                st.warning(f"Se omitieron partes con otros encabezados que la primera: {', '.join(informe['omitidas'][origen])}.")
+            if len(archivos) > 1: nombre_archivo = f"{nombre_archivo} (+{len(archivos) - 1})"
+            st.success(f"Archivo '{nombre_archivo}' cargado ({informe['partes'][origen]} partes, {len(df)} filas, {informe['segundos']:,.2f} s).")
             return df, nombre_archivo
         except Exception as e:
             st.error(f"Error al leer el archivo: {e}")
             return None, ""
     return None, ""
 
-def guardar_movimientos_db(db, conciliacion_id):
+def normalizar_movimientos(df, mapeo):
+    """Convierte las columnas mapeadas a fecha/descripcion/monto con un único formato por columna (vectorizado)."""
+    fechas, formato, filas_invalidas = normalizar_fechas(df[mapeo['fecha']])
+    montos = convertir_montos(df[mapeo['monto']], detectar_formato_numero(df[mapeo['monto']]))
+    normalizado = pd.DataFrame({
+        'fecha': fechas.dt.date.astype(object).where(fechas.notna(), None),
+        'descripcion': df[mapeo['concepto']].astype(str),
+        'monto': montos,
+    })
+    return normalizado, filas_invalidas
+
+def conciliacion_de_sesion(db):
+    """Id de la ConciliacionV2 de la sesión. Se crea recién al guardar movimientos: abrir la pantalla no deja
+    cabeceras vacías en la base."""
+    conciliacion_id = st.session_state.conciliador_v2.get('conciliacion_id')
+    if not conciliacion_id:
+        nueva_conciliacion = ConciliacionV2(user_id=st.session_state['user_id'], periodo=datetime.today().date())
+        db.add(nueva_conciliacion)
+        db.flush()
+        st.session_state.conciliador_v2['conciliacion_id'] = conciliacion_id = nueva_conciliacion.id
+    return conciliacion_id
+
+def guardar_movimientos_db(db, conciliacion_id=None):
     """Guarda los movimientos de los DataFrames de la sesión en la DB."""
+    conciliacion_id = conciliacion_id or conciliacion_de_sesion(db)
     df_banco = st.session_state.conciliador_v2['df_banco']
     df_mayor = st.session_state.conciliador_v2['df_mayor']
     map_banco = st.session_state.conciliador_v2['columnas_mapeadas_banco']
     map_mayor = st.session_state.conciliador_v2['columnas_mapeadas_mayor']
+    user_id = st.session_state.get('user_id')
+    cuenta = db.query(ConciliacionV2.banco_nombre).filter_by(id=conciliacion_id).scalar() or "Mi Banco"
 
-    for _, row in df_banco.iterrows():
-        db.add(MovimientoBanco(
-            conciliacion_id=conciliacion_id,
-            fecha=pd.to_datetime(row[map_banco['fecha']], errors='coerce'),
-            descripcion=str(row[map_banco['concepto']]),
-            monto=float(str(row[map_banco['monto']]).replace('.', '').replace(',', '.'))
-        ))
-    
-    for _, row in df_mayor.iterrows():
-        db.add(MovimientoContable(
-            conciliacion_id=conciliacion_id,
-            fecha=pd.to_datetime(row[map_mayor['fecha']], errors='coerce'),
-            descripcion=str(row[map_mayor['concepto']]),
-            monto=float(str(row[map_mayor['monto']]).replace('.', '').replace(',', '.'))
-        ))
+    for modelo, df, mapeo, etiqueta, lado in ((MovimientoBanco, df_banco, map_banco, "extracto", 'banco'), (MovimientoContable, df_mayor, map_mayor, "mayor", 'mayor')):
+        normalizado, filas_invalidas = normalizar_movimientos(df, mapeo)
+        if len(filas_invalidas):
+            st.warning(f"{len(filas_invalidas)} filas del {etiqueta} tienen una fecha no reconocida (filas: {', '.join(str(i) for i in filas_invalidas[:10])}{'...' if len(filas_invalidas) > 10 else ''}).")
+        # Importación incremental: solo se insertan los movimientos que la cuenta no tenía
+        nuevos, huellas = filtrar_nuevos(db, user_id, cuenta, lado, normalizado['fecha'], normalizado['monto'], normalizado['descripcion'])
+        if (~nuevos).sum():
+            st.info(f"{int((~nuevos).sum())} movimientos del {etiqueta} ya estaban importados y se omitieron.")
+        normalizado = normalizado[nuevos]
+        normalizado['conciliacion_id'] = conciliacion_id
+        db.bulk_insert_mappings(modelo, normalizado.to_dict(orient='records'))
+        registrar_huellas(db, user_id, cuenta, lado, huellas[nuevos], normalizado['fecha'], commit=False)
     db.commit()
     st.success("Mapeo y datos guardados en la base de datos.")
 
+def finalizar_conciliacion(db, conciliacion_id):
+    """Cierra la ConciliacionV2 al terminar la conciliación manual: guarda los saldos finales y la deja
+    'finalizada' (período cerrado: mantenimiento.archivar ya puede mover sus movimientos al archivo)."""
+    if not conciliacion_id: return
+    conciliacion = db.get(ConciliacionV2, conciliacion_id)
+    if conciliacion is None: return
+    saldos = st.session_state.conciliador_v2['saldos']
+    conciliacion.saldo_final_banco, conciliacion.saldo_final_mayor = saldos['banco'], saldos['mayor']
+    conciliacion.estado = 'finalizada'
+    db.commit()
+
 # --- Componentes de la Interfaz de Usuario (UI) ---
-def ui_carga_archivos():
+def ui_carga_archivos(db):
     st.header("1. Carga de Documentos")
     col1, col2 = st.columns(2)
     with col1:
-        archivo_banco = st.file_uploader("Sube el extracto", key="uploader_banco")
+        archivo_banco = st.file_uploader("Sube el extracto", key="uploader_banco", accept_multiple_files=True)
         if archivo_banco and st.session_state.conciliador_v2['df_banco'] is None:
-            df, nombre = procesar_archivo_cargado(archivo_banco)
+            df, nombre = procesar_archivo_cargado(archivo_banco, db, 'banco')
             if df is not None:
                 st.session_state.conciliador_v2['df_banco'] = df
                 st.session_state.conciliador_v2['nombre_archivo_banco'] = nombre
     with col2:
-        archivo_mayor = st.file_uploader("Sube el mayor", key="uploader_mayor")
+        archivo_mayor = st.file_uploader("Sube el mayor", key="uploader_mayor", accept_multiple_files=True)
         if archivo_mayor and st.session_state.conciliador_v2['df_mayor'] is None:
-            df, nombre = procesar_archivo_cargado(archivo_mayor)
+            df, nombre = procesar_archivo_cargado(archivo_mayor, db, 'mayor')
             if df is not None:
                 st.session_state.conciliador_v2['df_mayor'] = df
                 st.session_state.conciliador_v2['nombre_archivo_mayor'] = nombre
@@ -97,27 +146,53 @@ def ui_mapeo_columnas(db, conciliacion_id):
         st.info("Carga ambos archivos para continuar.")
         st.stop()
 
+    # Layouts ya conocidos: se preselecciona el mapeo guardado y se puede saltar este paso
+    user_id = st.session_state.get('user_id')
+    huellas = st.session_state.conciliador_v2['huellas']
+    fmt_banco = buscar_formato(db, user_id, MODULO_FORMATO, 'banco', huellas['banco']) if huellas['banco'] else None
+    fmt_mayor = buscar_formato(db, user_id, MODULO_FORMATO, 'mayor', huellas['mayor']) if huellas['mayor'] else None
+    prev_banco = fmt_banco.mapeo if fmt_banco else {}
+    prev_mayor = fmt_mayor.mapeo if fmt_mayor else {}
+
+    if fmt_banco is not None and fmt_mayor is not None:
+        st.success("Formato de ambos archivos reconocido.")
+        if st.button("Usar Mapeo Guardado y Continuar", type="primary"):
+            st.session_state.conciliador_v2['columnas_mapeadas_banco'] = fmt_banco.mapeo
+            st.session_state.conciliador_v2['columnas_mapeadas_mayor'] = fmt_mayor.mapeo
+            registrar_uso(db, fmt_banco)
+            registrar_uso(db, fmt_mayor)
+            guardar_movimientos_db(db, conciliacion_id)
+            st.session_state.conciliador_v2['step'] = 3
+            st.rerun()
+
+    def _idx(opciones, valor):
+        return opciones.index(valor) if valor in opciones else 0
+
     col1, col2 = st.columns(2)
     with col1:
         st.subheader("Extracto Bancario")
-        columnas_banco = df_banco.columns.tolist()
+        columnas_banco = [c for c in df_banco.columns if c != COLUMNA_ORIGEN]
         mapeo_banco = {
-            'fecha': st.selectbox("Columna de Fecha", options=columnas_banco, key="banco_fecha"),
-            'concepto': st.selectbox("Columna de Concepto", options=columnas_banco, key="banco_concepto"),
-            'monto': st.selectbox("Columna de Monto", options=columnas_banco, key="banco_monto")
+            'fecha': st.selectbox("Columna de Fecha", options=columnas_banco, index=_idx(columnas_banco, prev_banco.get('fecha')), key="banco_fecha"),
+            'concepto': st.selectbox("Columna de Concepto", options=columnas_banco, index=_idx(columnas_banco, prev_banco.get('concepto')), key="banco_concepto"),
+            'monto': st.selectbox("Columna de Monto", options=columnas_banco, index=_idx(columnas_banco, prev_banco.get('monto')), key="banco_monto")
         }
         st.session_state.conciliador_v2['columnas_mapeadas_banco'] = mapeo_banco
     with col2:
         st.subheader("Mayor Contable")
-        columnas_mayor = df_mayor.columns.tolist()
+        columnas_mayor = [c for c in df_mayor.columns if c != COLUMNA_ORIGEN]
         mapeo_mayor = {
-            'fecha': st.selectbox("Columna de Fecha", options=columnas_mayor, key="mayor_fecha"),
-            'concepto': st.selectbox("Columna de Concepto", options=columnas_mayor, key="mayor_concepto"),
-            'monto': st.selectbox("Columna de Monto", options=columnas_mayor, key="mayor_monto")
+            'fecha': st.selectbox("Columna de Fecha", options=columnas_mayor, index=_idx(columnas_mayor, prev_mayor.get('fecha')), key="mayor_fecha"),
+            'concepto': st.selectbox("Columna de Concepto", options=columnas_mayor, index=_idx(columnas_mayor, prev_mayor.get('concepto')), key="mayor_concepto"),
+            'monto': st.selectbox("Columna de Monto", options=columnas_mayor, index=_idx(columnas_mayor, prev_mayor.get('monto')), key="mayor_monto")
         }
         st.session_state.conciliador_v2['columnas_mapeadas_mayor'] = mapeo_mayor
 
     if st.button("Guardar Mapeo y Continuar"):
+        for origen, df, mapeo in (('banco', df_banco, mapeo_banco), ('mayor', df_mayor, mapeo_mayor)):
+            if huellas[origen]:
+                opciones = detectar_opciones(df, mapeo['fecha'], [mapeo['concepto']], [mapeo['monto']])
+                guardar_formato(db, user_id, MODULO_FORMATO, origen, huellas[origen], mapeo, opciones)
         guardar_movimientos_db(db, conciliacion_id)
         st.session_state.conciliador_v2['step'] = 3
         st.rerun()
@@ -154,6 +229,7 @@ def ui_conciliacion_manual(db):
             # Lógica para mostrar checkboxes
         submitted = st.form_submit_button("Conciliar Seleccionados")
         if submitted:
+            finalizar_conciliacion(db, st.session_state.conciliador_v2.get('conciliacion_id'))
             st.success("Partidas seleccionadas conciliadas manualmente.")
             st.session_state.conciliador_v2['step'] = 6
             st.rerun()
@@ -203,17 +279,11 @@ def run():
     db = SessionLocal()
 
     conciliacion_id = st.session_state.conciliador_v2.get('conciliacion_id')
-    if not conciliacion_id:
-        nueva_conciliacion = ConciliacionV2(user_id=st.session_state['user_id'], periodo=datetime.today().date())
-        db.add(nueva_conciliacion)
-        db.commit()
-        st.session_state.conciliador_v2['conciliacion_id'] = nueva_conciliacion.id
-        conciliacion_id = nueva_conciliacion.id
 
     step = st.session_state.conciliador_v2.get('step', 1)
 
     if step == 1:
-        ui_carga_archivos()
+        ui_carga_archivos(db)
     elif step == 2:
         ui_mapeo_columnas(db, conciliacion_id)
     elif step == 3:
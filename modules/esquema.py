@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from modules.fechas import normalizar_fechas
+from modules.formatos import convertir_montos, COLUMNA_ORIGEN
+
+# --- Esquema interno canónico ---
+# Todo archivo (mayor o extracto) se proyecta una sola vez, al ingresar, a estas columnas tipadas.
+# Matcheo, editores, arrastres y cierre trabajan siempre sobre estos nombres: no hay que volver a
+# resolver las columnas elegidas por el usuario en cada rerun.
+COLUMNAS = ['fecha', 'descripcion', 'neto', 'origen', 'source_row_id']
+TIPOS = {'fecha': 'datetime64[ns]', 'descripcion': 'str', 'neto': 'float64', 'origen': 'str', 'source_row_id': 'int64'}
+
+def esquema_vacio():
+    return pd.DataFrame({c: pd.Series(dtype=t) for c, t in TIPOS.items()})
+
+def proximo_id(*dfs):
+    """Primer source_row_id libre considerando los DataFrames ya existentes (ej. arrastres)."""
+    maximos = [int(df['source_row_id'].max()) for df in dfs if df is not None and not df.empty]
+    return max(maximos) + 1 if maximos else 0
+
+def a_esquema(df_orig, mapeo, opciones, origen, primer_id=0):
+    """Proyecta un archivo mapeado al esquema canónico. Si viene de varios archivos/hojas (COLUMNA_ORIGEN), el
+    origen de cada fila es el de su parte; si no, 'origen'.
+    Devuelve (df, filas_invalidas): las filas con fecha ilegible quedan con fecha NaT y se informan aparte."""
+    opciones = opciones or {}
+    montos = opciones.get('montos', {})
+    fechas, _, filas_invalidas = normalizar_fechas(df_orig[mapeo['fecha']], opciones.get('fecha'))
+    neto = convertir_montos(df_orig[mapeo['monto_1']], montos.get(str(mapeo['monto_1'])))
+    if mapeo.get('monto_2') and mapeo['monto_2'] != "Ninguna":
+        neto = neto - convertir_montos(df_orig[mapeo['monto_2']], montos.get(str(mapeo['monto_2'])))
+    df = pd.DataFrame({
+        'fecha': fechas.astype('datetime64[ns]'),
+        'descripcion': df_orig[mapeo['descripcion']].fillna('').astype(str),
+        'neto': neto.astype('float64'),
+        'origen': df_orig[COLUMNA_ORIGEN].astype(str) if COLUMNA_ORIGEN in df_orig.columns else str(origen),
+        'source_row_id': np.arange(primer_id, primer_id + len(df_orig), dtype='int64'),
+    }, index=df_orig.index)
+    return df.reset_index(drop=True), filas_invalidas
+
+def normalizar_arrastre(df):
+    """Convierte arrastres guardados con el formato anterior (_saved_fecha/_saved_desc/NETO) al esquema canónico."""
+    if df is None or df.empty: return esquema_vacio()
+    if set(COLUMNAS).issubset(df.columns): return df[COLUMNAS]
+    df = df.rename(columns={'_saved_fecha': 'fecha', '_saved_desc': 'descripcion', 'NETO': 'neto'})
+    return pd.DataFrame({
+        'fecha': pd.to_datetime(df['fecha'], errors='coerce') if 'fecha' in df.columns else pd.NaT,
+        'descripcion': df['descripcion'].fillna('').astype(str) if 'descripcion' in df.columns else '',
+        'neto': pd.to_numeric(df['neto'], errors='coerce').fillna(0.0) if 'neto' in df.columns else 0.0,
+        'origen': 'arrastre',
+        'source_row_id': np.arange(len(df), dtype='int64'),
+    }).astype(TIPOS)
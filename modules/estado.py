@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+# --- Estado incremental de la conciliación activa ---
+# Los pendientes de cada lado quedan indexados por source_row_id (ids estables) y los totales se llevan
+# en centavos enteros: cada marca, selección o cruce confirmado suma o resta solo las filas que cambiaron.
+# El panel de totales y la hoja de trabajo se arman con estos acumulados, sin recorrer los pendientes.
+# Las filas cruzadas o ajustadas no se borran: salen de 'Pendiente', así volver atrás (modules.eventos)
+# solo toca las filas afectadas.
+# 'rev' cambia con cada modificación: los editores usan una key por revisión, así sus ediciones (por
+# posición) nunca se aplican sobre un conjunto de filas distinto del que se dibujó.
+
+MARCAS = {'m': 'Anular por Error', 'b': 'Ajustar en Libros'}
+SELECCION = 'Select_Match'
+PENDIENTE = 'Pendiente'
+
+def _centavos(montos):
+    return int(np.round(np.asarray(montos, dtype='float64') * 100).astype('int64').sum())
+
+def _aportes(df, filas, marca):
+    """Aportes de un conjunto de filas a los acumulados de su lado."""
+    sel = filas[SELECCION].to_numpy(dtype=bool)
+    return {'n': len(filas), 'pend': _centavos(filas['neto']), 'marcado': _centavos(filas.loc[filas[marca].to_numpy(dtype=bool), 'neto']),
+            'sel': _centavos(filas.loc[sel, 'neto']), 'n_sel': int(sel.sum())}
+
+def calcular_totales(res):
+    """Acumulados desde cero (al iniciar y al reproducir el log de acciones)."""
+    res['totales'] = {'tolerancia': 0}
+    for lado, marca in MARCAS.items():
+        df = res['p_' + lado]
+        res['totales'][lado] = _aportes(df, df[df[PENDIENTE].to_numpy()], marca)
+    matched = res.get('matched')
+    if matched is not None and 'Diferencia' in matched.columns:
+        res['totales']['tolerancia'] = _centavos(matched['Diferencia'].fillna(0))
+
+def iniciar_estado(res):
+    """Indexa los pendientes por id, asegura las columnas de marcas y calcula los totales una sola vez.
+    También arranca vacío el log de acciones manuales (modules.eventos)."""
+    res['rev'] = res.get('rev', 0) + 1
+    for lado, marca in MARCAS.items():
+        df = res['p_' + lado]
+        df.index = pd.Index(df['source_row_id'].to_numpy(), name=None)
+        for col in (marca, SELECCION):
+            df[col] = df[col].fillna(False).astype(bool) if col in df.columns else False
+        df[PENDIENTE] = True
+    calcular_totales(res)
+    res['eventos'], res['pila'], res['rehacer'] = [], [], []
+    res['inicial'] = {
+        'n_matched': len(res.get('matched', [])), 's_fin_m': res.get('s_fin_m'),
+        'marcas': {lado: {col: res['p_' + lado].index[res['p_' + lado][col].to_numpy()].tolist() for col in (marca, SELECCION)}
+                   for lado, marca in MARCAS.items()},
+    }
+    return res
+
+def _pendientes_de(df, ids):
+    ids = df.index.intersection(pd.Index(ids))
+    return ids[df.loc[ids, PENDIENTE].to_numpy(dtype=bool)]
+
+def marcar(res, lado, columna, ids, valor):
+    """Cambia una marca (anular/ajustar o selección) para los ids pendientes dados; los totales se ajustan
+    solo por las filas cuyo valor cambió. Devuelve los ids que cambiaron."""
+    df = res['p_' + lado]
+    ids = _pendientes_de(df, ids)
+    cambian = ids[df.loc[ids, columna].to_numpy(dtype=bool) != bool(valor)]
+    if len(cambian) == 0: return cambian
+    delta = _centavos(df.loc[cambian, 'neto']) * (1 if valor else -1)
+    df.loc[cambian, columna] = bool(valor)
+    res['rev'] += 1
+    t = res['totales'][lado]
+    if columna == SELECCION:
+        t['sel'] += delta
+        t['n_sel'] += len(cambian) * (1 if valor else -1)
+    else:
+        t['marcado'] += delta
+    return cambian
+
+def _mover(res, lado, ids, pendiente):
+    df = res['p_' + lado]
+    ids = df.index.intersection(pd.Index(ids))
+    ids = ids[df.loc[ids, PENDIENTE].to_numpy(dtype=bool) != pendiente]
+    if len(ids) == 0: return ids
+    signo = 1 if pendiente else -1
+    t = res['totales'][lado]
+    for k, v in _aportes(df, df.loc[ids], MARCAS[lado]).items():
+        t[k] += signo * v
+    df.loc[ids, PENDIENTE] = pendiente
+    res['rev'] += 1
+    return ids
+
+def quitar_pendientes(res, lado, ids):
+    """Saca filas de los pendientes (cruce confirmado o ajuste) descontando sus aportes a los totales."""
+    return _mover(res, lado, ids, False)
+
+def restaurar_pendientes(res, lado, ids):
+    """Inverso de quitar_pendientes: las filas vuelven con las marcas que tenían."""
+    return _mover(res, lado, ids, True)
+
+def agregar_conciliados(res, nuevos):
+    if nuevos.empty: return
+    res['matched'] = pd.concat([res.get('matched', pd.DataFrame()), nuevos], ignore_index=True)
+    if 'Diferencia' in nuevos.columns:
+        res['totales']['tolerancia'] += _centavos(nuevos['Diferencia'].fillna(0))
+
+def quitar_conciliados(res, n):
+    """Saca los últimos n cruces agregados (deshacer un ajuste o un match manual)."""
+    if n <= 0: return
+    ultimos = res['matched'].iloc[-n:]
+    if 'Diferencia' in ultimos.columns:
+        res['totales']['tolerancia'] -= _centavos(ultimos['Diferencia'].fillna(0))
+    res['matched'] = res['matched'].iloc[:-n]
+
+def pendientes(res, lado):
+    df = res['p_' + lado]
+    return df[df[PENDIENTE].to_numpy()]
+
+def ids_marcados(res, lado, columna):
+    df = res['p_' + lado]
+    return df.index[df[columna].to_numpy() & df[PENDIENTE].to_numpy()]
+
+def totales(res):
+    """Importes (float) para el panel y la hoja de trabajo, en O(1)."""
+    t = res['totales']
+    return {
+        'anulado_m': t['m']['marcado'] / 100, 'ajustado_b': t['b']['marcado'] / 100,
+        'pend_m': (t['m']['pend'] - t['m']['marcado']) / 100, 'pend_b': (t['b']['pend'] - t['b']['marcado']) / 100,
+        'sel_m': t['m']['sel'] / 100, 'sel_b': t['b']['sel'] / 100, 'n_sel_m': t['m']['n_sel'], 'n_sel_b': t['b']['n_sel'],
+        'n_pend_m': t['m']['n'], 'n_pend_b': t['b']['n'], 'tolerancia': t['tolerancia'] / 100,
+    }
@@ -0,0 +1,133 @@
+from datetime import datetime
+import pandas as pd
+from modules.estado import (marcar, quitar_pendientes, restaurar_pendientes, agregar_conciliados, quitar_conciliados,
+                            calcular_totales, MARCAS, SELECCION, PENDIENTE)
+
+# --- Log de acciones manuales (deshacer / rehacer / auditoría) ---
+# Cada acción del paso de conciliación (marcar o seleccionar, confirmar ajustes, match manual) es un evento
+# sobre source_row_ids que se agrega a res['eventos'] y nunca se borra. Deshacer y rehacer también quedan
+# registrados, así que el log completo reproduce el estado actual a partir del resultado automático.
+# res['pila'] y res['rehacer'] guardan las posiciones de los eventos vigentes y deshechos: volver atrás
+# aplica la inversa del evento sobre sus propias filas, sin copias de los pendientes.
+
+def _aplicar(res, ev):
+    tipo = ev['tipo']
+    if tipo == 'marcar':
+        marcar(res, ev['lado'], ev['columna'], ev['ids'], ev['valor'])
+    elif tipo in ('ajuste', 'match'):
+        for lado in MARCAS:
+            quitar_pendientes(res, lado, ev['ids_' + lado])
+        agregar_conciliados(res, ev['filas'])
+        res['s_fin_m'] += ev.get('importe', 0.0)
+        if ev.get('alias'): res.setdefault('alias_nuevos', []).append(ev['alias'])
+
+def _revertir(res, ev):
+    tipo = ev['tipo']
+    if tipo == 'marcar':
+        marcar(res, ev['lado'], ev['columna'], ev['ids'], not ev['valor'])
+    elif tipo in ('ajuste', 'match'):
+        quitar_conciliados(res, len(ev['filas']))
+        for lado in MARCAS:
+            restaurar_pendientes(res, lado, ev['ids_' + lado])
+        res['s_fin_m'] -= ev.get('importe', 0.0)
+        if ev.get('alias') and ev['alias'] in res.get('alias_nuevos', []): res['alias_nuevos'].remove(ev['alias'])
+
+def _anotar(res, ev):
+    ev.update(n=len(res['eventos']), ts=datetime.now().isoformat(timespec='seconds'))
+    res['eventos'].append(ev)
+    return ev
+
+def _registrar(res, ev):
+    _anotar(res, ev)
+    res['pila'].append(ev['n'])
+    res['rehacer'].clear()
+    return ev
+
+# --- Acciones ---
+def accion_marcar(res, lado, columna, ids, valor, descripcion=None):
+    """Marca/desmarca ids; el evento guarda solo los ids que efectivamente cambiaron."""
+    cambian = marcar(res, lado, columna, ids, valor)
+    if len(cambian) == 0: return None
+    if descripcion is None:
+        que = 'Selección' if columna == SELECCION else columna
+        descripcion = f"{que} {'marcada' if valor else 'desmarcada'} ({len(cambian)} fila{'s' if len(cambian) != 1 else ''} {'mayor' if lado == 'm' else 'banco'})"
+    return _registrar(res, {'tipo': 'marcar', 'lado': lado, 'columna': columna, 'ids': cambian.tolist(),
+                            'valor': bool(valor), 'descripcion': descripcion})
+
+def accion_ediciones(res, lado, columna, ids_vista, edited_rows):
+    """Cambios de un st.data_editor (edited_rows: {posición en la vista: {columna: valor}}) como eventos;
+    ids_vista son los ids de las filas en el orden en que se dibujaron."""
+    por_valor = {True: [], False: []}
+    for pos, cambios in (edited_rows or {}).items():
+        if columna in cambios and int(pos) < len(ids_vista):
+            por_valor[bool(cambios[columna])].append(ids_vista[int(pos)])
+    for valor, ids in por_valor.items():
+        accion_marcar(res, lado, columna, ids, valor)
+
+def accion_cruce(res, tipo, ids_m, ids_b, filas, importe=0.0, alias=None, descripcion=''):
+    """Ajuste contabilizado o match manual: saca los ids de pendientes y agrega 'filas' a conciliados."""
+    ev = {'tipo': tipo, 'ids_m': [int(i) for i in ids_m], 'ids_b': [int(i) for i in ids_b], 'filas': filas.reset_index(drop=True),
+          'importe': float(importe), 'alias': alias, 'descripcion': descripcion}
+    _aplicar(res, ev)
+    return _registrar(res, ev)
+
+def deshacer(res):
+    if not res.get('pila'): return None
+    ev = res['eventos'][res['pila'].pop()]
+    _revertir(res, ev)
+    res['rehacer'].append(ev['n'])
+    _anotar(res, {'tipo': 'deshacer', 'ref': ev['n'], 'descripcion': f"Deshacer: {ev['descripcion']}"})
+    return ev
+
+def rehacer(res):
+    if not res.get('rehacer'): return None
+    ev = res['eventos'][res['rehacer'].pop()]
+    _aplicar(res, ev)
+    res['pila'].append(ev['n'])
+    _anotar(res, {'tipo': 'rehacer', 'ref': ev['n'], 'descripcion': f"Rehacer: {ev['descripcion']}"})
+    return ev
+
+def ultimo(res, pila='pila'):
+    """Evento que deshacer ('pila') o rehacer ('rehacer') afectaría, o None."""
+    return res['eventos'][res[pila][-1]] if res.get(pila) else None
+
+# --- Auditoría ---
+def reproducir(res):
+    """Reconstruye el estado desde el resultado automático aplicando el log completo, en orden."""
+    inicial = res['inicial']
+    base = {'rev': 0, 's_fin_m': inicial['s_fin_m'], 'alias_nuevos': [],
+            'matched': res['matched'].iloc[:inicial['n_matched']]}
+    for lado, marca in MARCAS.items():
+        df = res['p_' + lado][['neto', marca, SELECCION]].copy()
+        df[PENDIENTE] = True
+        for col, ids in inicial['marcas'][lado].items():
+            df[col] = df.index.isin(ids)
+        base['p_' + lado] = df
+    calcular_totales(base)
+    for ev in res['eventos']:
+        if ev['tipo'] == 'deshacer': _revertir(base, res['eventos'][ev['ref']])
+        elif ev['tipo'] == 'rehacer': _aplicar(base, res['eventos'][ev['ref']])
+        else: _aplicar(base, ev)
+    return base
+
+def verificar(res):
+    """True si reproducir el log da exactamente el estado actual (marcas, pendientes, cruces y totales)."""
+    base = reproducir(res)
+    for lado, marca in MARCAS.items():
+        cols = [marca, SELECCION, PENDIENTE]
+        if not base['p_' + lado][cols].equals(res['p_' + lado][cols]): return False
+    return (len(base['matched']) == len(res['matched']) and base['totales'] == res['totales']
+            and round(base['s_fin_m'] - res['s_fin_m'], 2) == 0 and base['alias_nuevos'] == list(res.get('alias_nuevos', [])))
+
+def exportar(res):
+    """Log serializable (JSON) para guardar con el cierre: los cruces se guardan como ids, no como filas."""
+    return [{k: v for k, v in ev.items() if k != 'filas'} | ({'cruces': len(ev['filas'])} if 'filas' in ev else {})
+            for ev in res.get('eventos', [])]
+
+def historial(res):
+    """Log para mostrar: una fila por evento, marcando los que hoy están deshechos."""
+    if not res.get('eventos'): return pd.DataFrame(columns=['#', 'Hora', 'Acción', 'Vigente'])
+    vigentes = set(res['pila'])
+    return pd.DataFrame([{'#': ev['n'] + 1, 'Hora': ev['ts'][11:], 'Acción': ev['descripcion'],
+                          'Vigente': ev['n'] in vigentes if ev['tipo'] not in ('deshacer', 'rehacer') else None}
+                         for ev in res['eventos']])
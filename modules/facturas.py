@@ -0,0 +1,199 @@
+import io
+import os
+import re
+import time
+import hashlib
+import importlib
+import unicodedata
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from sqlalchemy import insert
+from models import Factura
+from modules.formatos import convertir_montos
+from modules.fechas import parsear_fechas
+
+# --- Extracción de facturas (PDF AFIP) ---
+# Primero se usa la capa de texto del PDF (pypdf); las páginas sin texto (escaneadas) pasan por un backend
+# de OCR opcional. Cada archivo se identifica por el SHA-256 de su contenido: lo ya extraído queda en la
+# tabla facturas y al volver a subir la carpeta solo se procesan los archivos nuevos.
+
+# Backends de OCR: nombre -> 'modulo:funcion'. La función recibe (bytes del PDF, índices de página) y
+# devuelve el texto de esas páginas. Se resuelve por nombre para que funcione dentro de los procesos hijos.
+OCR_BACKENDS = {'tesseract': 'modules.facturas:ocr_tesseract'}
+
+# Una página con menos caracteres que esto se considera escaneada
+MIN_CARACTERES_PAGINA = 20
+# Con menos archivos nuevos que esto no conviene pagar el arranque del pool de procesos
+PARALELO_MIN_ARCHIVOS = 8
+
+CAMPOS = ['tipo', 'punto_venta', 'numero', 'fecha', 'cuit_emisor', 'cuit_receptor', 'neto', 'iva', 'total']
+
+RE_CUIT = re.compile(r'(?<!\d)(\d{2})[- ]?(\d{8})[- ]?(\d)(?!\d)')
+RE_TIPO = re.compile(r'\bFACTURA\s+([ABCEM])\b|^\s*([ABCEM])\s*$|\bCOD\.?\s*(?:N\W?\s*)?0?(\d{1,3})\b', re.MULTILINE)
+RE_PUNTO_NUMERO = re.compile(r'PUNTO\s+DE\s+VENTA\W*(\d{1,5})\s*COMP\.?\s*(?:NRO|N\W)\W*(\d{1,8})')
+RE_PUNTO_NUMERO_CORTO = re.compile(r'(?<!\d)(\d{4,5})-(\d{8})(?!\d)')
+RE_FECHA_EMISION = re.compile(r'FECHA\s+DE\s+EMISION\W*(\d{1,2}/\d{1,2}/\d{4})')
+RE_FECHA = re.compile(r'(?<!\d)(\d{2}/\d{2}/\d{4})(?!\d)')
+IMPORTE = r'\$?\s*(-?\d[\d.,]*\d|\d)'
+RE_NETO = re.compile(r'(?:IMPORTE\s+)?NETO\s+(?:NO\s+)?GRAVADO\W*' + IMPORTE)
+RE_SUBTOTAL = re.compile(r'\bSUBTOTAL\W*' + IMPORTE)
+RE_IVA = re.compile(r'\bIVA\s*\d{1,2}(?:[.,]\d{1,2})?\s*%\W*' + IMPORTE)
+RE_TOTAL = re.compile(r'IMPORTE\s+TOTAL\W*' + IMPORTE)
+RE_TOTAL_SUELTO = re.compile(r'\bTOTAL\W*' + IMPORTE)
+# Códigos de comprobante AFIP -> letra
+LETRA_POR_CODIGO = {1: 'A', 2: 'A', 3: 'A', 6: 'B', 7: 'B', 8: 'B', 11: 'C', 12: 'C', 13: 'C', 19: 'E', 51: 'M'}
+
+def hash_contenido(data):
+    return hashlib.sha256(data).hexdigest()
+
+def cuit_valido(cuit):
+    """Dígito verificador (módulo 11) de un CUIT de 11 dígitos."""
+    if len(cuit) != 11 or not cuit.isdigit(): return False
+    suma = sum(int(d) * p for d, p in zip(cuit[:10], (5, 4, 3, 2, 7, 6, 5, 4, 3, 2)))
+    verificador = 11 - suma % 11
+    verificador = {11: 0, 10: 9}.get(verificador, verificador)
+    return verificador == int(cuit[10])
+
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode('ascii')
+    return texto.upper()
+
+def _importes(patron, texto):
+    valores = [m.group(1) for m in patron.finditer(texto)]
+    if not valores: return []
+    return convertir_montos(pd.Series(valores, dtype='str')).tolist()
+
+def extraer_campos(texto):
+    """Campos de una factura AFIP a partir de su texto (cualquier campo puede quedar en None)."""
+    t = _normalizar(texto)
+    campos = dict.fromkeys(CAMPOS)
+    cuits = list(dict.fromkeys(''.join(m.groups()) for m in RE_CUIT.finditer(t)))
+    cuits = [c for c in cuits if cuit_valido(c)]
+    # El primer CUIT del comprobante es el del emisor y el siguiente distinto, el del receptor
+    if cuits: campos['cuit_emisor'] = cuits[0]
+    if len(cuits) > 1: campos['cuit_receptor'] = cuits[1]
+
+    m = RE_TIPO.search(t)
+    if m:
+        campos['tipo'] = m.group(1) or m.group(2) or LETRA_POR_CODIGO.get(int(m.group(3)))
+    m = RE_PUNTO_NUMERO.search(t) or RE_PUNTO_NUMERO_CORTO.search(t)
+    if m: campos['punto_venta'], campos['numero'] = int(m.group(1)), int(m.group(2))
+    m = RE_FECHA_EMISION.search(t) or RE_FECHA.search(t)
+    if m:
+        fecha = parsear_fechas(pd.Series([m.group(1)]), '%d/%m/%Y').iloc[0]
+        campos['fecha'] = None if pd.isna(fecha) else fecha.date()
+
+    netos = _importes(RE_NETO, t) or _importes(RE_SUBTOTAL, t)
+    ivas = _importes(RE_IVA, t)
+    totales = _importes(RE_TOTAL, t) or _importes(RE_TOTAL_SUELTO, t)
+    if netos: campos['neto'] = round(sum(netos), 2)
+    if ivas: campos['iva'] = round(sum(ivas), 2)
+    # El total es el último importe rotulado (los PDFs repiten el bloque de totales en el talón)
+    if totales: campos['total'] = round(totales[-1], 2)
+    elif netos: campos['total'] = round(campos['neto'] + (campos['iva'] or 0.0), 2)
+    return campos
+
+# --- Texto de los PDFs ---
+def textos_pdf(data):
+    """Texto de cada página desde la capa de texto del PDF."""
+    from pypdf import PdfReader
+    return [pagina.extract_text() or '' for pagina in PdfReader(io.BytesIO(data)).pages]
+
+def ocr_tesseract(data, paginas):
+    """Backend de OCR local (pdf2image + pytesseract, ambos opcionales)."""
+    from pdf2image import convert_from_bytes
+    import pytesseract
+    textos = []
+    for i in paginas:
+        imagen = convert_from_bytes(data, first_page=i + 1, last_page=i + 1, dpi=300)[0]
+        textos.append(pytesseract.image_to_string(imagen, lang='spa'))
+    return textos
+
+def resolver_ocr(nombre):
+    modulo, funcion = OCR_BACKENDS[nombre].split(':')
+    return getattr(importlib.import_module(modulo), funcion)
+
+def extraer_factura(nombre, data, ocr=None, hash_archivo=None):
+    """Procesa un PDF (se ejecuta en los procesos del pool): devuelve un dict con los campos, páginas,
+    método, estado y segundos de proceso."""
+    t0 = time.perf_counter()
+    fila = {'hash_archivo': hash_archivo or hash_contenido(data), 'nombre_archivo': nombre, 'paginas': 0,
+            'metodo': 'texto', 'estado': 'error', 'error': None, **dict.fromkeys(CAMPOS)}
+    try:
+        textos = textos_pdf(data)
+        fila['paginas'] = len(textos)
+        escaneadas = [i for i, tx in enumerate(textos) if len(tx.strip()) < MIN_CARACTERES_PAGINA]
+        if escaneadas and ocr:
+            for i, tx in zip(escaneadas, resolver_ocr(ocr)(data, escaneadas)):
+                textos[i] = tx
+            fila['metodo'] = f"ocr:{ocr}"
+        texto = '\n'.join(textos)
+        if len(texto.strip()) < MIN_CARACTERES_PAGINA:
+            fila['estado'] = 'sin_texto'
+        else:
+            fila.update(extraer_campos(texto))
+            completa = fila['cuit_emisor'] and fila['fecha'] and fila['total'] is not None
+            fila['estado'] = 'ok' if completa else 'incompleta'
+    except Exception as e:
+        fila['error'] = f"{type(e).__name__}: {e}"
+    fila['segundos'] = time.perf_counter() - t0
+    return fila
+
+def _extraer_bloque(tareas, ocr):
+    return [extraer_factura(nombre, data, ocr, h) for nombre, data, h in tareas]
+
+def procesar_lote(archivos, conocidos=(), ocr=None, procesos=None):
+    """archivos: lista de (nombre, bytes). Los que ya están en 'conocidos' (hashes) o repetidos en el lote se
+    omiten. Devuelve (DataFrame de resultados nuevos, métricas del lote)."""
+    t0 = time.perf_counter()
+    conocidos, tareas, vistos = set(conocidos), [], set()
+    for nombre, data in archivos:
+        h = hash_contenido(data)
+        if h in conocidos or h in vistos: continue
+        vistos.add(h)
+        tareas.append((nombre, data, h))
+    procesos = max(1, min(procesos or os.cpu_count() or 1, len(tareas)))
+    if procesos > 1 and len(tareas) >= PARALELO_MIN_ARCHIVOS:
+        # Bloques intercalados: cada proceso recibe una sola tarea con varios archivos
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn')) as pool:
+            bloques = pool.map(_extraer_bloque, [tareas[w::procesos] for w in range(procesos)], [ocr] * procesos)
+            por_hash = {f['hash_archivo']: f for bloque in bloques for f in bloque}
+        filas = [por_hash[h] for _, _, h in tareas]
+    else:
+        procesos = 1
+        filas = _extraer_bloque(tareas, ocr)
+    segundos = time.perf_counter() - t0
+    df = pd.DataFrame(filas, columns=['hash_archivo', 'nombre_archivo', *CAMPOS, 'paginas', 'metodo', 'estado', 'error', 'segundos'])
+    paginas = int(df['paginas'].sum()) if not df.empty else 0
+    metricas = {'archivos': len(archivos), 'nuevos': len(tareas), 'omitidos': len(archivos) - len(tareas),
+                'paginas': paginas, 'segundos': segundos, 'procesos': procesos,
+                'paginas_por_seg': paginas / segundos if segundos > 0 and paginas else 0.0}
+    return df, metricas
+
+# --- Persistencia ---
+# 'sin_texto' y 'error' no cuentan como procesados: si después se configura OCR o se corrige el archivo,
+# se vuelven a intentar.
+def hashes_procesados(db, user_id, hashes):
+    if not user_id or not hashes: return set()
+    q = db.query(Factura.hash_archivo).filter(Factura.user_id == user_id, Factura.hash_archivo.in_(list(hashes)),
+                                              Factura.estado.in_(['ok', 'incompleta']))
+    return {h for (h,) in q.all()}
+
+def guardar_facturas(db, user_id, df, commit=True):
+    """Inserta en bloque los resultados del lote (reemplaza los intentos fallidos del mismo archivo)."""
+    if not user_id or df.empty: return
+    db.query(Factura).filter(Factura.user_id == user_id, Factura.hash_archivo.in_(df['hash_archivo'].tolist())).delete(synchronize_session=False)
+    base = df.drop(columns=['segundos'])
+    registros = base.astype(object).where(base.notna(), None)
+    registros['user_id'], registros['procesado'] = user_id, datetime.utcnow()
+    db.execute(insert(Factura.__table__), registros.to_dict(orient='records'))
+    if commit: db.commit()
+
+def cargar_facturas(db, user_id, desde=None, hasta=None):
+    q = db.query(Factura).filter(Factura.user_id == user_id)
+    if desde is not None: q = q.filter(Factura.fecha >= desde)
+    if hasta is not None: q = q.filter(Factura.fecha <= hasta)
+    columnas = ['id', 'nombre_archivo', *CAMPOS, 'paginas', 'metodo', 'estado', 'error', 'procesado']
+    return pd.DataFrame([{c: getattr(f, c) for c in columnas} for f in q.order_by(Factura.fecha, Factura.id).all()], columns=columnas)
@@ -0,0 +1,111 @@
+import re
+import numpy as np
+import pandas as pd
+
+# --- Normalización de fechas ---
+# Se infiere UN formato a partir de una muestra y se parsea la columna completa de forma vectorizada
+# con ese formato explícito. Así evitamos la inferencia elemento a elemento de pd.to_datetime y el
+# error clásico de leer 05/03 como 3 de mayo en archivos es-AR (dd/mm/aaaa).
+
+# Orden de prueba: primero los formatos locales (día primero); mm/dd solo si nada de lo anterior sirve
+FORMATOS_CANDIDATOS = [
+    '%d/%m/%Y', '%d/%m/%y', '%d-%m-%Y', '%d-%m-%y', '%d.%m.%Y', '%d.%m.%y',
+    '%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S',
+    '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d', '%Y%m%d',
+    '%m/%d/%Y', '%m/%d/%y',
+]
+
+# Abreviaturas de mes de los exports bancarios (05-ENE-26, 05-Jan-2026)
+MESES_ABREV = {
+    'ENE': '01', 'JAN': '01', 'FEB': '02', 'MAR': '03', 'ABR': '04', 'APR': '04', 'MAY': '05',
+    'JUN': '06', 'JUL': '07', 'AGO': '08', 'AUG': '08', 'SEP': '09', 'SET': '09', 'OCT': '10',
+    'NOV': '11', 'DIC': '12', 'DEC': '12',
+}
+RE_MES_ABREV = re.compile(r'^\d{1,2}[-/ ]([A-Za-z]{3})[A-Za-z]*\.?[-/ ]\d{2,4}$')
+RE_SEPARADOR_MES = re.compile(r'^(\d{1,2})[-/ ]([A-Za-z]{3})[A-Za-z]*\.?[-/ ](\d{2,4})$')
+
+# Rango razonable de seriales de Excel (1954 a 2119)
+SERIAL_MIN, SERIAL_MAX = 20000, 80000
+# Enteros aaaammdd (20260105) de los CSV exportados sin formato de fecha
+AAAAMMDD_MIN, AAAAMMDD_MAX = 19000101, 21001231
+ORIGEN_EXCEL = '1899-12-30'
+
+def _muestra(serie, n):
+    s = serie.dropna()
+    if s.dtype == object or pd.api.types.is_string_dtype(s):
+        s = s.astype(str).str.strip()
+        s = s[s != '']
+    # Muestra distribuida a lo largo del archivo (no solo las primeras filas)
+    if len(s) > n:
+        s = s.iloc[np.linspace(0, len(s) - 1, n).astype(int)]
+    return s
+
+def _es_aaaammdd(muestra):
+    num = pd.to_numeric(muestra, errors='coerce')
+    if not (num.notna().all() and (num % 1 == 0).all() and num.between(AAAAMMDD_MIN, AAAAMMDD_MAX).all()): return False
+    return pd.to_datetime(num.astype('int64').astype(str), format='%Y%m%d', errors='coerce').notna().all()
+
+def _es_serial(muestra):
+    num = pd.to_numeric(muestra, errors='coerce')
+    return num.notna().all() and num.between(SERIAL_MIN, SERIAL_MAX).all()
+
+def _traducir_meses(serie):
+    """'05-ENE-26' -> '05-01-26' (vectorizado con regex)."""
+    partes = serie.astype(str).str.strip().str.extract(RE_SEPARADOR_MES)
+    meses = partes[1].str.upper().map(MESES_ABREV)
+    return partes[0].str.zfill(2) + '-' + meses + '-' + partes[2]
+
+def inferir_formato_fecha(serie, muestra=500):
+    """Devuelve 'nativo', 'serial_excel', 'abrev:<fmt>', un formato strftime o None si no hay datos."""
+    if pd.api.types.is_datetime64_any_dtype(serie): return 'nativo'
+    s = _muestra(serie, muestra)
+    if s.empty: return None
+    if pd.api.types.is_numeric_dtype(s): return '%Y%m%d' if _es_aaaammdd(s) else 'serial_excel'
+    # Excel con celdas de fecha reales mezcladas (dtype object con Timestamps/datetime)
+    if s.map(lambda v: hasattr(v, 'year')).mean() > 0.5: return 'nativo'
+    s = s.astype(str)
+    if _es_aaaammdd(s): return '%Y%m%d'
+    if _es_serial(s): return 'serial_excel'
+    if s.str.match(RE_MES_ABREV).mean() > 0.5:
+        traducida = _traducir_meses(s)
+        anio_largo = traducida.str.len().max() > 8
+        return 'abrev:' + ('%d-%m-%Y' if anio_largo else '%d-%m-%y')
+    mejor, mejor_tasa = None, 0.0
+    for fmt in FORMATOS_CANDIDATOS:
+        tasa = pd.to_datetime(s, format=fmt, errors='coerce').notna().mean()
+        if tasa > mejor_tasa:
+            mejor, mejor_tasa = fmt, tasa
+            if tasa == 1.0: break
+    return mejor
+
+def parsear_fechas(serie, formato=None):
+    """Parsea la columna completa con el formato indicado (o inferido si no se pasa)."""
+    if formato is None:
+        formato = inferir_formato_fecha(serie)
+    if formato is None:
+        return pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+    if formato == 'nativo':
+        return pd.to_datetime(serie, errors='coerce')
+    if formato == 'serial_excel':
+        num = pd.to_numeric(serie, errors='coerce')
+        return pd.to_datetime(num.where(num.between(SERIAL_MIN, SERIAL_MAX)), unit='D', origin=ORIGEN_EXCEL)
+    if formato.startswith('abrev:'):
+        return pd.to_datetime(_traducir_meses(serie), format=formato[len('abrev:'):], errors='coerce')
+    if pd.api.types.is_numeric_dtype(serie):
+        # 20260105.0 (columna float por celdas vacías) -> '20260105'
+        s = pd.to_numeric(serie, errors='coerce').astype('Int64').astype(str)
+    else:
+        s = serie.astype(str).str.strip() if not pd.api.types.is_string_dtype(serie) else serie.str.strip()
+    return pd.to_datetime(s, format=formato, errors='coerce')
+
+def normalizar_fechas(serie, formato=None):
+    """Devuelve (fechas, formato, filas_invalidas): filas_invalidas son las que traían un valor no vacío
+    que no se pudo interpretar con el formato inferido."""
+    if formato is None:
+        formato = inferir_formato_fecha(serie)
+    fechas = parsear_fechas(serie, formato)
+    con_valor = serie.notna()
+    if serie.dtype == object or pd.api.types.is_string_dtype(serie):
+        con_valor &= serie.astype(str).str.strip() != ''
+    filas_invalidas = serie.index[con_valor & fechas.isna()]
+    return fechas, formato, filas_invalidas
@@ -0,0 +1,125 @@
+import io
+import hashlib
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from models import FormatoArchivo
+from modules.fechas import inferir_formato_fecha
+
+# --- Caché de formatos de archivo por usuario ---
+# Cada layout (encabezados + tipo de archivo) se identifica con una huella. Si el usuario ya
+# mapeó ese layout, reutilizamos el mapeo y leemos solo las columnas necesarias con dtypes explícitos.
+
+def es_excel(nombre):
+    return str(nombre).lower().endswith(('xlsx', 'xls'))
+
+# Columna que agrega la ingesta de varios archivos/hojas (modules.ingesta): de qué archivo u hoja viene cada fila
+COLUMNA_ORIGEN = '(Origen)'
+
+def leer_archivo(data, nombre, usecols=None, dtype=None, nrows=None, hoja=0):
+    """Lee un Excel/CSV desde bytes, opcionalmente restringido a columnas y tipos.
+    hoja: la del libro a leer (por defecto la primera); None lee todas y devuelve {hoja: df}."""
+    buf = io.BytesIO(data)
+    if es_excel(nombre):
+        return pd.read_excel(buf, usecols=usecols, dtype=dtype, nrows=nrows, sheet_name=hoja)
+    return pd.read_csv(buf, usecols=usecols, dtype=dtype, nrows=nrows)
+
+def huella_layout(columnas, nombre):
+    """Hash estable del layout: tipo de archivo, cantidad y nombre normalizado de columnas."""
+    partes = ['excel' if es_excel(nombre) else 'csv', str(len(columnas))]
+    partes += [str(c).strip().upper() for c in columnas]
+    return hashlib.sha1("|".join(partes).encode('utf-8')).hexdigest()
+
+def huella_archivo(data, nombre):
+    """Calcula la huella leyendo solo la fila de encabezados."""
+    cabecera = leer_archivo(data, nombre, nrows=0)
+    return huella_layout(list(cabecera.columns), nombre)
+
+# --- Detección de formatos de número (las fechas se infieren en modules.fechas) ---
+def detectar_formato_numero(serie):
+    """'numerico' si ya viene tipado; 'es' (1.234,56), 'en' (1,234.56), 'mixto' si hay de ambos y None si la
+    muestra no decide (solo enteros o 1.234 / 1,234, que valen en los dos): ese formato no se guarda en el layout
+    y convertir_montos decide celda por celda en cada lectura."""
+    if pd.api.types.is_numeric_dtype(serie): return 'numerico'
+    s = serie.dropna().astype(str).str.replace('$', '', regex=False).str.replace(' ', '', regex=False)
+    s = s[s != ''].head(500)
+    if s.empty: return 'numerico'
+    pos_c, pos_p = s.str.find(','), s.str.find('.')
+    ambos = (pos_c >= 0) & (pos_p >= 0)
+    # Evidencia positiva: los dos separadores en orden, el separador repetido (miles) o un único separador
+    # seguido de una cantidad de dígitos distinta de 3 (no puede ser de miles)
+    evid_es = ((ambos & (pos_p < pos_c)) | s.str.contains(r'\..*\.', regex=True)
+               | ((pos_p < 0) & s.str.contains(r',(?:\d{1,2}|\d{4,})$', regex=True))).any()
+    evid_en = ((ambos & (pos_c < pos_p)) | s.str.contains(r',.*,', regex=True)
+               | ((pos_c < 0) & s.str.contains(r'\.(?:\d{1,2}|\d{4,})$', regex=True))).any()
+    if evid_es and evid_en: return 'mixto'
+    if evid_es: return 'es'
+    if evid_en: return 'en'
+    return None
+
+def convertir_montos(serie, formato=None):
+    """Convierte importes de texto a float de forma vectorizada; con formato conocido evita la detección por celda.
+    'numerico' solo se respeta si la serie vino tipada: un layout guardado como numérico que llega con texto
+    (ej. '1.234,56' en otro mes) se decide celda por celda en vez de convertirse en 0."""
+    if pd.api.types.is_numeric_dtype(serie):
+        return pd.to_numeric(serie, errors='coerce').fillna(0.0).astype('float64')
+    s = serie.astype(str).str.replace('$', '', regex=False).str.replace(' ', '', regex=False).str.strip()
+    if formato == 'es':
+        s = s.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    elif formato == 'en':
+        s = s.str.replace(',', '', regex=False)
+    else:
+        # Mixto (o sin formato confiable): el separador decimal se decide fila por fila (el último de los dos), pero sin apply
+        pos_c, pos_p = s.str.find(','), s.str.find('.')
+        s = pd.Series(np.select(
+            [(pos_c >= 0) & (pos_p >= 0) & (pos_p < pos_c), (pos_c >= 0) & (pos_p >= 0), pos_c >= 0],
+            [s.str.replace('.', '', regex=False).str.replace(',', '.', regex=False),
+             s.str.replace(',', '', regex=False),
+             s.str.replace(',', '.', regex=False)],
+            default=s), index=s.index)
+    return pd.to_numeric(s, errors='coerce').fillna(0.0).astype('float64')
+
+def detectar_opciones(df, col_fecha, cols_texto, cols_monto):
+    """Arma las opciones de lectura (usecols + dtypes + formatos) a partir del archivo ya mapeado."""
+    cols_monto = [c for c in cols_monto if c and c != "Ninguna"]
+    usecols = list(dict.fromkeys([col_fecha] + list(cols_texto) + cols_monto))
+    formato_fecha = inferir_formato_fecha(df[col_fecha])
+    montos = {c: detectar_formato_numero(df[c]) for c in cols_monto}
+    dtypes = {c: 'str' for c in cols_texto}
+    if formato_fecha not in ('nativo', 'serial_excel'): dtypes[col_fecha] = 'str'
+    for c, fmt in montos.items():
+        dtypes[c] = 'float64' if fmt == 'numerico' else 'str'
+    return {'usecols': [str(c) for c in usecols], 'dtype': {str(k): v for k, v in dtypes.items()},
+            'fecha': formato_fecha, 'montos': {str(k): v for k, v in montos.items()}}
+
+def leer_con_formato(data, nombre, opciones, hoja=0):
+    """Lee solo las columnas mapeadas con dtypes explícitos; si el archivo no coincide, lee completo.
+    Devuelve (df, con_formato): con_formato False avisa que las opciones guardadas no valen para este archivo
+    y hay que volver a detectarlas sobre lo leído en vez de reutilizarlas."""
+    try:
+        return leer_archivo(data, nombre, usecols=opciones['usecols'], dtype=opciones['dtype'], hoja=hoja), True
+    except (ValueError, KeyError):
+        return leer_archivo(data, nombre, hoja=hoja), False
+
+# --- Persistencia ---
+def buscar_formato(db, user_id, modulo, origen, huella):
+    if not user_id: return None
+    return db.query(FormatoArchivo).filter_by(user_id=user_id, modulo=modulo, origen=origen, huella=huella).first()
+
+def guardar_formato(db, user_id, modulo, origen, huella, mapeo, opciones):
+    if not user_id: return None
+    formato = buscar_formato(db, user_id, modulo, origen, huella)
+    if formato is None:
+        formato = FormatoArchivo(user_id=user_id, modulo=modulo, origen=origen, huella=huella, usos=0)
+        db.add(formato)
+    formato.mapeo = mapeo
+    formato.opciones_lectura = opciones
+    formato.usos = (formato.usos or 0) + 1
+    formato.ultimo_uso = datetime.utcnow()
+    db.commit()
+    return formato
+
+def registrar_uso(db, formato):
+    formato.usos = (formato.usos or 0) + 1
+    formato.ultimo_uso = datetime.utcnow()
+    db.commit()
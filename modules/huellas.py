@@ -0,0 +1,51 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert
+from models import HuellaMovimiento
+from modules.texto import normalizar_descripcion
+
+# --- Huellas de movimientos (importación incremental) ---
+# Cada movimiento normalizado se identifica por (fecha, importe en centavos, descripción normalizada,
+# n° de ocurrencia). El n° de ocurrencia distingue movimientos idénticos del mismo día, y se numera en el
+# orden del archivo, así que un extracto re-exportado con más días produce las mismas huellas para las
+# filas que ya estaban.
+
+def calcular_huellas(fechas, montos, descripciones):
+    """Devuelve una Serie de huellas (hex) alineada con las filas recibidas."""
+    claves = pd.DataFrame({
+        'fecha': pd.to_datetime(fechas, errors='coerce').dt.strftime('%Y%m%d').fillna(''),
+        'centavos': np.round(pd.to_numeric(montos, errors='coerce').fillna(0.0).to_numpy() * 100).astype('int64'),
+        'desc': normalizar_descripcion(descripciones).to_numpy(),
+    }, index=fechas.index)
+    claves['ocurrencia'] = claves.groupby(['fecha', 'centavos', 'desc'], sort=False).cumcount()
+    texto = claves['fecha'] + '|' + claves['centavos'].astype(str) + '|' + claves['desc'] + '|' + claves['ocurrencia'].astype(str)
+    return pd.Series([hashlib.blake2b(t.encode('utf-8'), digest_size=16).hexdigest() for t in texto],
+                     index=fechas.index, dtype='str')
+
+def huellas_existentes(db, user_id, cuenta, lado, fecha_min, fecha_max):
+    """Huellas ya registradas de la cuenta dentro del rango de fechas del archivo (consulta por índice)."""
+    q = db.query(HuellaMovimiento.huella).filter(
+        HuellaMovimiento.user_id == user_id, HuellaMovimiento.cuenta == cuenta, HuellaMovimiento.lado == lado)
+    if fecha_min is not None and not pd.isna(fecha_min):
+        q = q.filter(HuellaMovimiento.fecha >= fecha_min.date(), HuellaMovimiento.fecha <= fecha_max.date())
+    return {h for (h,) in q.all()}
+
+def filtrar_nuevos(db, user_id, cuenta, lado, fechas, montos, descripciones):
+    """Devuelve (mascara_nuevos, huellas): True para las filas que no se importaron antes en esta cuenta."""
+    huellas = calcular_huellas(fechas, montos, descripciones)
+    fechas_dt = pd.to_datetime(fechas, errors='coerce')
+    existentes = huellas_existentes(db, user_id, cuenta, lado, fechas_dt.min(), fechas_dt.max()) if user_id else set()
+    return ~huellas.isin(existentes).to_numpy(), huellas
+
+def registrar_huellas(db, user_id, cuenta, lado, huellas, fechas, commit=True):
+    """Inserta en bloque las huellas de los movimientos importados (sin commit si es parte de otra transacción)."""
+    if not user_id or len(huellas) == 0: return
+    fechas_dt = pd.to_datetime(fechas, errors='coerce')
+    registros = pd.DataFrame({
+        'user_id': user_id, 'cuenta': cuenta, 'lado': lado, 'huella': np.asarray(huellas, dtype=object),
+        'fecha': fechas_dt.dt.date.astype(object).where(fechas_dt.notna(), None).to_numpy(),
+    }).drop_duplicates('huella')
+    # OR IGNORE: si otra sesión ya registró la misma huella, no es un error
+    db.execute(insert(HuellaMovimiento.__table__).prefix_with('OR IGNORE'), registros.to_dict(orient='records'))
+    if commit: db.commit()
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from modules.formatos import es_excel, leer_archivo, leer_con_formato, COLUMNA_ORIGEN
+
+# --- Ingesta de varios archivos y hojas por lado ---
+# Cada lado (mayor / banco) puede llegar como varios archivos (un extracto por mes) o como un libro con una
+# hoja por mes. Todos los archivos de todos los lados se leen juntos en un pool de hilos, una tarea por
+# archivo: un libro se abre una sola vez y se leen todas sus hojas (releerlo por hoja vuelve a parsear el
+# libro entero). Con formato guardado se leen solo las columnas mapeadas con dtypes explícitos; si algún archivo
+# no respeta esos tipos se lee completo y el informe lo marca en 'releidos', para volver a detectar las opciones.
+# Las partes de un lado se unen en un solo DataFrame con COLUMNA_ORIGEN (categórica: no repite el texto por
+# fila). Entran solo las partes con los mismos encabezados que la primera; las demás (hojas de resumen,
+# otros layouts) se informan aparte. Una sola parte pasa tal cual, sin copia ni columna de origen.
+# No se usa un pool de procesos: levantar los workers (spawn) cuesta más que leer los archivos de un cierre.
+
+MAX_HILOS = 8
+
+def _encabezados(df):
+    return tuple(str(c).strip().upper() for c in df.columns)
+
+def _leer(tarea):
+    """Una tarea del pool: un archivo completo. Devuelve (lado, [(etiqueta, df)], segundos, con_formato)."""
+    lado, nombre, data, opciones = tarea
+    t0 = time.perf_counter()
+    hoja = None if es_excel(nombre) else 0
+    if opciones:
+        hojas, con_formato = leer_con_formato(data, nombre, opciones, hoja=hoja)
+    else:
+        hojas, con_formato = leer_archivo(data, nombre, hoja=hoja), False
+    if not isinstance(hojas, dict): hojas = {None: hojas}
+    partes = [(nombre if len(hojas) == 1 else f"{nombre} › {h}", df) for h, df in hojas.items()]
+    return lado, partes, time.perf_counter() - t0, con_formato
+
+def unir(partes):
+    """[(etiqueta, df)] -> (df, omitidas). Se concatenan las partes con los encabezados de la primera."""
+    partes = [(e, df) for e, df in partes if not df.empty] or partes[:1]
+    base = _encabezados(partes[0][1])
+    validas = [(e, df) for e, df in partes if _encabezados(df) == base]
+    omitidas = [e for e, df in partes if _encabezados(df) != base]
+    if len(validas) == 1: return validas[0][1], omitidas
+    etiquetas = list(dict.fromkeys(e for e, _ in validas))
+    df = pd.concat([d for _, d in validas], ignore_index=True, sort=False)
+    codigos = np.repeat([etiquetas.index(e) for e, _ in validas], [len(d) for _, d in validas])
+    df[COLUMNA_ORIGEN] = pd.Categorical.from_codes(codigos, categories=etiquetas)
+    return df, omitidas
+
+def _correr(tareas, hilos):
+    if hilos == 1: return [_leer(t) for t in tareas]
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='ingesta') as pool:
+        return list(pool.map(_leer, tareas))
+
+def leer(lados, opciones=None, hilos=None):
+    """lados: {lado: [(nombre, bytes), ...]}; opciones: {lado: opciones de lectura del formato guardado o None}.
+    Devuelve ({lado: df}, informe): tiempo real y suma de los tiempos de las tareas (con hilos que compiten por
+    pocos núcleos la suma se infla; la comparación exacta contra la lectura en serie es la del __main__).
+    Si un archivo no respeta las opciones de su lado, ese lado entero se vuelve a leer completo (así todas sus
+    partes tienen los mismos encabezados) e informe['releidos'][lado] avisa que hay que volver a detectarlas."""
+    opciones = opciones or {}
+    tareas = [(lado, nombre, data, opciones.get(lado)) for lado, archivos in lados.items() for nombre, data in archivos]
+    hilos = hilos or max(1, min(MAX_HILOS, os.cpu_count() or 1, len(tareas)))
+    t0 = time.perf_counter()
+    resultados = _correr(tareas, hilos)
+    releidos = {lado: any(r[0] == lado and t[3] and not r[3] for t, r in zip(tareas, resultados)) for lado in lados}
+    if any(releidos.values()):
+        resultados = [r for r in resultados if not releidos[r[0]]]
+        resultados += _correr([(lado, nombre, data, None) for lado, nombre, data, _ in tareas if releidos[lado]], hilos)
+    partes = {lado: [] for lado in lados}
+    for lado, partes_archivo, _, _ in resultados:
+        partes[lado] += partes_archivo
+    dfs, omitidas = {}, {}
+    for lado, partes_lado in partes.items():
+        dfs[lado], omitidas[lado] = unir(partes_lado)
+    informe = {
+        'segundos': round(time.perf_counter() - t0, 3), 'suma_tareas': round(sum(r[2] for r in resultados), 3),
+        'hilos': hilos, 'archivos': len(tareas), 'partes': {lado: len(p) for lado, p in partes.items()}, 'omitidas': omitidas,
+        'releidos': releidos,
+    }
+    return dfs, informe
+
+# --- python -m modules.ingesta archivo [archivo ...]: lectura en serie vs. en paralelo ---
+if __name__ == "__main__":
+    archivos = [(os.path.basename(r), open(r, 'rb').read()) for r in sys.argv[1:]]
+    for n in (1, max(1, min(MAX_HILOS, len(archivos)))):
+        dfs, informe = leer({'archivos': archivos}, hilos=n)
+        print(f"hilos={informe['hilos']}: {informe['segundos']:.3f} s (suma de tareas {informe['suma_tareas']:.3f} s), "
+              f"{len(dfs['archivos'])} filas de {informe['partes']['archivos']} partes, omitidas: {informe['omitidas']['archivos']}")
@@ -0,0 +1,166 @@
+import re
+import time
+import threading
+from collections import Counter, deque
+from datetime import datetime
+from sqlalchemy import event
+
+# --- Instrumentación de la base de datos ---
+# Eventos del engine de SQLAlchemy: cada sentencia se cuenta y se cronometra dentro de la corrida del
+# script (un rerun de Streamlit) que la ejecutó. Al cerrarse la corrida sus contadores se suman a los de
+# su ruta (pantalla del menú). Las sentencias lentas quedan en un log con la forma de sus parámetros
+# (tipos y cantidades, nunca los valores). Todo vive en memoria del proceso y lo comparten las sesiones.
+
+UMBRAL_LENTA_MS = 100.0
+# Una misma sentencia repetida más que esto en una corrida se reporta como posible N+1
+UMBRAL_REPETIDAS = 20
+MAX_LENTAS = 200
+MAX_CORRIDAS = 200
+SIN_RUTA = '(sin ruta)'
+
+_lock = threading.Lock()
+_local = threading.local()
+_abiertas = {}  # session_id -> corrida en curso
+_instalado = set()
+_rutas = {}
+_lentas = deque(maxlen=MAX_LENTAS)
+_corridas = deque(maxlen=MAX_CORRIDAS)
+
+RE_LISTA = re.compile(r'\?(?:\s*,\s*\?)+')
+RE_FILAS = re.compile(r'\(\?…\)(?:\s*,\s*\(\?…\))+')
+RE_ESPACIOS = re.compile(r'\s+')
+
+def normalizar_sentencia(sql):
+    """SQL sin listas de parámetros ni espacios de más: la misma consulta con distinto IN (...) cuenta igual."""
+    sql = RE_ESPACIOS.sub(' ', sql).strip()
+    return RE_FILAS.sub('(?…), …', RE_LISTA.sub('?…', sql))
+
+def _forma(p):
+    if isinstance(p, dict):
+        return '{' + ', '.join(f"{k}: {type(v).__name__}" for k, v in p.items()) + '}'
+    if isinstance(p, (list, tuple)):
+        if len(p) > 8:
+            return '(' + ', '.join(f"{n}×{t}" for t, n in Counter(type(v).__name__ for v in p).items()) + ')'
+        return '(' + ', '.join(type(v).__name__ for v in p) + ')'
+    return type(p).__name__
+
+def forma_parametros(parametros, multiple=False):
+    """Forma de los parámetros ligados: tipos por posición/nombre y cantidad de filas en executemany."""
+    if parametros is None: return ''
+    if multiple:
+        filas = list(parametros)
+        return f"{len(filas)} filas × {_forma(filas[0])}" if filas else '0 filas'
+    return _forma(parametros)
+
+def _nueva_corrida(session_id):
+    return {'session_id': session_id, 'ruta': SIN_RUTA, 'inicio': time.perf_counter(), 'fecha': datetime.now(),
+            'sentencias': 0, 'ms': 0.0, 'escrituras': 0, 'lentas': 0, 'repeticiones': Counter()}
+
+def _session_id():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+        return ctx.session_id if ctx else None
+    except Exception:
+        return None
+
+def iniciar_corrida():
+    """Al principio de cada corrida del script. Una corrida anterior de la misma sesión que terminó con
+    st.rerun()/st.stop() (sin llegar a cerrar_corrida) se cierra acá."""
+    session_id = _session_id()
+    with _lock:
+        previa = _abiertas.pop(session_id, None)
+    if previa is not None: _acumular(previa)
+    corrida = _nueva_corrida(session_id)
+    with _lock:
+        _abiertas[session_id] = corrida
+    _local.corrida = corrida
+    return corrida
+
+def nombrar_corrida(ruta):
+    corrida = getattr(_local, 'corrida', None)
+    if corrida is not None: corrida['ruta'] = ruta
+
+def cerrar_corrida():
+    corrida = getattr(_local, 'corrida', None)
+    if corrida is None: return
+    _local.corrida = None
+    with _lock:
+        if _abiertas.get(corrida['session_id']) is corrida: del _abiertas[corrida['session_id']]
+    _acumular(corrida)
+
+def _acumular(corrida):
+    segundos = time.perf_counter() - corrida['inicio']
+    repetida, veces = corrida['repeticiones'].most_common(1)[0] if corrida['repeticiones'] else ('', 0)
+    with _lock:
+        r = _rutas.setdefault(corrida['ruta'], {'corridas': 0, 'sentencias': 0, 'escrituras': 0, 'ms': 0.0, 'max_sentencias': 0,
+                                                'lentas': 0, 'n_mas_1': 0, 'segundos': 0.0})
+        r['corridas'] += 1
+        r['sentencias'] += corrida['sentencias']
+        r['escrituras'] += corrida['escrituras']
+        r['ms'] += corrida['ms']
+        r['max_sentencias'] = max(r['max_sentencias'], corrida['sentencias'])
+        r['lentas'] += corrida['lentas']
+        r['n_mas_1'] += veces > UMBRAL_REPETIDAS
+        r['segundos'] += segundos
+        _corridas.append({'fecha': corrida['fecha'], 'ruta': corrida['ruta'], 'sentencias': corrida['sentencias'],
+                          'escrituras': corrida['escrituras'], 'ms_db': round(corrida['ms'], 2), 'segundos': round(segundos, 3),
+                          'mas_repetida': repetida if veces > 1 else '', 'repeticiones': veces})
+
+# --- Eventos del engine ---
+def _antes(conn, cursor, sentencia, parametros, contexto, multiple):
+    conn.info.setdefault('_t_sentencias', []).append(time.perf_counter())
+
+def _despues(conn, cursor, sentencia, parametros, contexto, multiple):
+    pila = conn.info.get('_t_sentencias')
+    if not pila: return
+    ms = (time.perf_counter() - pila.pop()) * 1000
+    corrida = getattr(_local, 'corrida', None)
+    normalizada = normalizar_sentencia(sentencia)
+    if corrida is not None:
+        corrida['sentencias'] += 1
+        corrida['ms'] += ms
+        corrida['escrituras'] += normalizada[:6].upper() in ('INSERT', 'UPDATE', 'DELETE')
+        corrida['repeticiones'][normalizada] += 1
+    if ms >= UMBRAL_LENTA_MS:
+        if corrida is not None: corrida['lentas'] += 1
+        with _lock:
+            _lentas.append({'fecha': datetime.now(), 'ruta': corrida['ruta'] if corrida else SIN_RUTA, 'ms': round(ms, 2),
+                            'sentencia': normalizada[:500], 'parametros': forma_parametros(parametros, multiple)})
+
+def _error(contexto):
+    # La sentencia falló: after_cursor_execute no se dispara, se descarta su marca de tiempo
+    pila = contexto.connection.info.get('_t_sentencias') if contexto.connection is not None else None
+    if pila: pila.pop()
+
+def instrumentar(engine):
+    """Registra los eventos una sola vez por engine (el script de Streamlit se re-ejecuta en cada rerun)."""
+    with _lock:
+        if id(engine) in _instalado: return
+        _instalado.add(id(engine))
+    event.listen(engine, 'before_cursor_execute', _antes)
+    event.listen(engine, 'after_cursor_execute', _despues)
+    event.listen(engine, 'handle_error', _error)
+
+# --- Consulta (panel de administración) ---
+def por_ruta():
+    with _lock:
+        filas = [{'ruta': ruta, **r} for ruta, r in _rutas.items()]
+    for f in filas:
+        f['sentencias_por_corrida'] = round(f['sentencias'] / f['corridas'], 1) if f['corridas'] else 0.0
+        f['ms_por_corrida'] = round(f['ms'] / f['corridas'], 2) if f['corridas'] else 0.0
+    return sorted(filas, key=lambda f: -f['sentencias'])
+
+def lentas():
+    with _lock:
+        return list(reversed(_lentas))
+
+def corridas():
+    with _lock:
+        return list(reversed(_corridas))
+
+def reiniciar():
+    with _lock:
+        _rutas.clear()
+        _lentas.clear()
+        _corridas.clear()
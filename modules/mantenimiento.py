@@ -0,0 +1,231 @@
+import io
+import sys
+import json
+import time
+import zlib
+import threading
+from datetime import datetime, timedelta, date
+import pandas as pd
+from sqlalchemy import func, select, text
+from models import (engine, SessionLocal, User, Conciliacion, ConciliacionV2, MovimientoBanco, MovimientoContable,
+                    MovimientoArchivado, HuellaMovimiento, Mantenimiento)
+
+# --- Mantenimiento de la base (limpieza, archivo y compactación) ---
+# 1. Limpieza: conciliaciones v2 sin movimientos (pasado un período de gracia) y movimientos huérfanos.
+# 2. Archivo: los movimientos v2 de períodos cerrados (ConciliacionV2 'finalizada', la marca que deja el
+#    conciliador v2 al terminar la conciliación manual) de más de ARCHIVAR_MESES meses salen de las tablas vivas a movimientos_archivados, un bloque comprimido por conciliación y lado.
+#    leer_movimientos devuelve vivos + archivados con las mismas columnas, así que quien lee no necesita
+#    saber dónde están.
+# 3. Compactación: incremental_vacuum + ANALYZE. Pasar la base a auto_vacuum=INCREMENTAL exige un VACUUM
+#    completo, que bloquea la base mientras corre: es un paso explícito (Monitor o --vacuum), nunca de la
+#    corrida automática. Cada corrida deja un informe con el tamaño del archivo y el tiempo de unas
+#    consultas representativas, antes y después.
+# Corre sola cada INTERVALO_DIAS (en un hilo, al arrancar el proceso) o desde el Monitor de Base de Datos.
+
+ARCHIVAR_MESES = 12
+GRACIA_VACIAS_HORAS = 24
+INTERVALO_DIAS = 7
+PAGINAS_VACUUM = 5000
+REPETICIONES_CONSULTA = 3
+
+MODELOS = {'banco': MovimientoBanco, 'mayor': MovimientoContable}
+COLUMNAS_MOVIMIENTO = ['id', 'fecha', 'descripcion', 'monto', 'estado', 'match_id']
+
+# --- Archivo comprimido ---
+def comprimir(df):
+    return zlib.compress(df.to_json(orient='split', date_format='iso', index=False).encode('utf-8'), 9)
+
+def descomprimir(datos):
+    df = pd.read_json(io.StringIO(zlib.decompress(datos).decode('utf-8')), orient='split', dtype=False, convert_dates=False)
+    fechas = pd.to_datetime(df['fecha'], errors='coerce')
+    df['fecha'] = fechas.dt.date.astype(object).where(fechas.notna(), None)
+    return df[COLUMNAS_MOVIMIENTO]
+
+def leer_movimientos(db, user_id, lado, estado=None, incluir_archivo=True):
+    """Movimientos del Conciliador v2 de un lado ('banco'/'mayor'), vivos y archivados, con las columnas de
+    COLUMNAS_MOVIMIENTO más conciliacion_id."""
+    modelo = MODELOS[lado]
+    q = db.query(*[getattr(modelo, c) for c in COLUMNAS_MOVIMIENTO], modelo.conciliacion_id).join(ConciliacionV2).filter(
+        ConciliacionV2.user_id == user_id)
+    if estado is not None: q = q.filter(modelo.estado == estado)
+    partes = [pd.DataFrame(q.all(), columns=COLUMNAS_MOVIMIENTO + ['conciliacion_id'])]
+    if incluir_archivo:
+        archivados = db.query(MovimientoArchivado.conciliacion_id, MovimientoArchivado.datos).filter(
+            MovimientoArchivado.user_id == user_id, MovimientoArchivado.lado == lado)
+        for conciliacion_id, datos in archivados:
+            df = descomprimir(datos).assign(conciliacion_id=conciliacion_id)
+            partes.append(df if estado is None else df[df['estado'] == estado])
+    partes = [p for p in partes if not p.empty] or partes[:1]
+    return pd.concat(partes, ignore_index=True)
+
+# --- 1. Limpieza ---
+def limpiar(db, ahora=None):
+    """Borra las conciliaciones v2 vacías más viejas que la gracia y los movimientos sin conciliación."""
+    limite = (ahora or datetime.utcnow()) - timedelta(hours=GRACIA_VACIAS_HORAS)
+    con_datos = [select(m.conciliacion_id).where(m.conciliacion_id.isnot(None)) for m in (*MODELOS.values(), MovimientoArchivado)]
+    q = db.query(ConciliacionV2).filter(ConciliacionV2.fecha_creacion < limite)
+    for sub in con_datos: q = q.filter(ConciliacionV2.id.not_in(sub))
+    vacias = q.delete(synchronize_session=False)
+    huerfanos = 0
+    for modelo in MODELOS.values():
+        huerfanos += db.query(modelo).filter(
+            modelo.conciliacion_id.is_(None) | modelo.conciliacion_id.not_in(select(ConciliacionV2.id))).delete(synchronize_session=False)
+    db.commit()
+    return {'conciliaciones_vacias': vacias, 'movimientos_huerfanos': huerfanos}
+
+# --- 2. Archivo ---
+def corte_archivo(meses, hoy=None):
+    """Primer día del mes que queda vivo: se archivan los períodos anteriores."""
+    return (pd.Timestamp(hoy or date.today()).to_period('M') - meses).to_timestamp().date()
+
+def archivar(db, meses=ARCHIVAR_MESES, hoy=None):
+    """Mueve los movimientos de las conciliaciones v2 con período anterior al corte a movimientos_archivados
+    (un commit por conciliación: una corrida interrumpida no deja nada a medias). Solo períodos cerrados: una
+    conciliación que no se finalizó sigue en trabajo aunque sea vieja y queda viva."""
+    corte = corte_archivo(meses, hoy)
+    conciliaciones = db.query(ConciliacionV2).filter(ConciliacionV2.periodo < corte, ConciliacionV2.estado == 'finalizada').all()
+    informe = {'corte': corte.isoformat(), 'conciliaciones': 0, 'filas': 0, 'bytes_comprimidos': 0}
+    for c in conciliaciones:
+        filas = 0
+        for lado, modelo in MODELOS.items():
+            q = db.query(*[getattr(modelo, col) for col in COLUMNAS_MOVIMIENTO]).filter(modelo.conciliacion_id == c.id)
+            df = pd.DataFrame(q.all(), columns=COLUMNAS_MOVIMIENTO)
+            if df.empty: continue
+            datos = comprimir(df)
+            fechas = pd.to_datetime(df['fecha'], errors='coerce')
+            db.add(MovimientoArchivado(user_id=c.user_id, conciliacion_id=c.id, lado=lado, periodo=c.periodo,
+                                       desde=fechas.min().date() if fechas.notna().any() else None,
+                                       hasta=fechas.max().date() if fechas.notna().any() else None,
+                                       filas=len(df), datos=datos))
+            db.query(modelo).filter(modelo.conciliacion_id == c.id).delete(synchronize_session=False)
+            filas += len(df)
+            informe['bytes_comprimidos'] += len(datos)
+        c.estado = 'archivada'
+        db.commit()
+        informe['conciliaciones'] += 1
+        informe['filas'] += filas
+    return informe
+
+# --- 3. Compactación ---
+def _pragma(conn, nombre):
+    return conn.execute(text(f"PRAGMA {nombre}")).scalar()
+
+def tamanio(conn):
+    """Bytes del archivo y bytes en páginas libres (SQLite)."""
+    pagina = _pragma(conn, 'page_size')
+    return {'bytes': pagina * _pragma(conn, 'page_count'), 'libres': pagina * _pragma(conn, 'freelist_count')}
+
+def compactar(vacuum_completo=False):
+    """incremental_vacuum + ANALYZE. Con vacuum_completo, si la base todavía no está en auto_vacuum=INCREMENTAL
+    se convierte con un VACUUM completo (bloquea la base: solo a pedido, con la app sin uso). Sin convertir,
+    incremental_vacuum no libera nada y el modo queda 'sin_convertir'."""
+    if engine.dialect.name != 'sqlite': return {'modo': 'omitido'}
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        antes = tamanio(conn)
+        if _pragma(conn, 'auto_vacuum') != 2 and vacuum_completo:
+            conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            conn.execute(text("VACUUM"))
+            modo = 'vacuum_completo'
+        elif _pragma(conn, 'auto_vacuum') != 2:
+            modo = 'sin_convertir'
+        else:
+            # executescript (sqlite3_exec) corre el pragma hasta el final; execute() lo avanza un solo paso (1 página)
+            conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({PAGINAS_VACUUM});")
+            modo = 'incremental'
+        conn.execute(text("ANALYZE"))
+        despues = tamanio(conn)
+    return {'modo': modo, 'bytes_antes': antes['bytes'], 'bytes_despues': despues['bytes'],
+            'liberados': antes['bytes'] - despues['bytes'], 'libres_restantes': despues['libres']}
+
+# --- Consultas de referencia (antes / después) ---
+def _usuario_referencia(db):
+    """El usuario con más movimientos v2 (el peor caso de las pantallas que los leen)."""
+    fila = db.query(ConciliacionV2.user_id, func.count(MovimientoBanco.id)).join(MovimientoBanco).group_by(
+        ConciliacionV2.user_id).order_by(func.count(MovimientoBanco.id).desc()).first()
+    return fila[0] if fila else db.query(func.min(User.id)).scalar()
+
+def medir_consultas(db, user_id):
+    """Mejor tiempo (ms) de cada consulta representativa."""
+    consultas = {
+        'pendientes_banco_v2': lambda: db.query(MovimientoBanco.id, MovimientoBanco.fecha, MovimientoBanco.monto).join(ConciliacionV2).filter(
+            ConciliacionV2.user_id == user_id, MovimientoBanco.estado == 'pendiente').all(),
+        'movimientos_mayor_v2': lambda: db.query(func.count(MovimientoContable.id)).join(ConciliacionV2).filter(
+            ConciliacionV2.user_id == user_id).scalar(),
+        'historial_cierres': lambda: db.query(Conciliacion.id, Conciliacion.periodo_anio, Conciliacion.periodo_mes).filter(
+            Conciliacion.user_id == user_id).all(),
+        'huellas_ultimo_anio': lambda: db.query(func.count(HuellaMovimiento.id)).filter(
+            HuellaMovimiento.user_id == user_id, HuellaMovimiento.fecha >= date.today() - timedelta(days=365)).scalar(),
+    }
+    tiempos = {}
+    for nombre, consulta in consultas.items():
+        mejor = None
+        for _ in range(REPETICIONES_CONSULTA):
+            t0 = time.perf_counter()
+            consulta()
+            ms = (time.perf_counter() - t0) * 1000
+            mejor = ms if mejor is None else min(mejor, ms)
+        tiempos[nombre] = round(mejor, 3)
+    return tiempos
+
+# --- Corrida completa ---
+def ejecutar(meses=ARCHIVAR_MESES, ahora=None, vacuum_completo=False):
+    """Limpieza + archivo + compactación. Guarda y devuelve el informe. vacuum_completo: ver compactar
+    (la corrida automática nunca lo pide)."""
+    t0 = time.perf_counter()
+    ahora = ahora or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        user_id = _usuario_referencia(db)
+        consultas_antes = medir_consultas(db, user_id)
+        informe = {'limpieza': limpiar(db, ahora), 'archivo': archivar(db, meses, ahora.date())}
+        db.close()
+        informe['compactacion'] = compactar(vacuum_completo)
+        db = SessionLocal()
+        consultas_despues = medir_consultas(db, user_id)
+        informe['consultas_ms'] = {k: {'antes': consultas_antes[k], 'despues': consultas_despues[k]} for k in consultas_antes}
+        informe['segundos'] = round(time.perf_counter() - t0, 3)
+        db.add(Mantenimiento(fecha=ahora, informe=informe))
+        db.commit()
+        return informe
+    finally:
+        db.close()
+
+def pendiente(db, ahora=None, intervalo_dias=INTERVALO_DIAS):
+    """Toca mantenimiento si pasaron intervalo_dias desde el último (o desde el alta de la base, si nunca corrió)."""
+    ultimo = db.query(func.max(Mantenimiento.fecha)).scalar() or db.query(func.min(User.created_at)).scalar()
+    return ultimo is not None and ultimo < (ahora or datetime.utcnow()) - timedelta(days=intervalo_dias)
+
+_programado = False
+_lock = threading.Lock()
+
+def programar():
+    """Una vez por proceso: si toca, corre el mantenimiento en un hilo aparte (no bloquea la corrida del script)."""
+    global _programado
+    with _lock:
+        if _programado: return
+        _programado = True
+    db = SessionLocal()
+    try:
+        toca = pendiente(db)
+    finally:
+        db.close()
+    if toca: threading.Thread(target=ejecutar, name='mantenimiento', daemon=True).start()
+
+def historial(db, limite=20):
+    filas = db.query(Mantenimiento.fecha, Mantenimiento.informe).order_by(Mantenimiento.fecha.desc()).limit(limite).all()
+    return pd.DataFrame([{
+        'fecha': f, 'segundos': i.get('segundos'),
+        'vacias': i.get('limpieza', {}).get('conciliaciones_vacias'), 'huerfanos': i.get('limpieza', {}).get('movimientos_huerfanos'),
+        'archivadas': i.get('archivo', {}).get('conciliaciones'), 'filas_archivadas': i.get('archivo', {}).get('filas'),
+        'modo': i.get('compactacion', {}).get('modo'),
+        'mb_antes': round(i.get('compactacion', {}).get('bytes_antes', 0) / 2**20, 2),
+        'mb_despues': round(i.get('compactacion', {}).get('bytes_despues', 0) / 2**20, 2),
+        'consultas_ms_antes': round(sum(c['antes'] for c in i.get('consultas_ms', {}).values()), 2),
+        'consultas_ms_despues': round(sum(c['despues'] for c in i.get('consultas_ms', {}).values()), 2),
+    } for f, i in filas])
+
+# --- python -m modules.mantenimiento [meses] [--vacuum] ---
+if __name__ == "__main__":
+    argumentos = [a for a in sys.argv[1:] if a != '--vacuum']
+    informe = ejecutar(int(argumentos[0]) if argumentos else ARCHIVAR_MESES, vacuum_completo='--vacuum' in sys.argv[1:])
+    print(json.dumps(informe, indent=2, ensure_ascii=False, default=str))
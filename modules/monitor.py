@@ -0,0 +1,98 @@
+import streamlit as st
+import pandas as pd
+from models import SessionLocal
+from modules import instrumentacion, mantenimiento
+
+# Usuarios que ven el monitor en el menú (init_db crea 'admin')
+ADMINISTRADORES = {'admin'}
+
+COLUMNAS_RUTAS = {
+    "ruta": st.column_config.TextColumn("Ruta"),
+    "corridas": st.column_config.NumberColumn("Corridas"),
+    "sentencias": st.column_config.NumberColumn("Sentencias"),
+    "sentencias_por_corrida": st.column_config.NumberColumn("Sent./Corrida"),
+    "max_sentencias": st.column_config.NumberColumn("Máx./Corrida"),
+    "escrituras": st.column_config.NumberColumn("Escrituras"),
+    "ms_por_corrida": st.column_config.NumberColumn("ms DB/Corrida", format="%.2f"),
+    "lentas": st.column_config.NumberColumn("Lentas"),
+    "n_mas_1": st.column_config.NumberColumn("Posibles N+1", help=f"Corridas con una misma sentencia repetida más de {instrumentacion.UMBRAL_REPETIDAS} veces."),
+    "ms": None, "segundos": None,
+}
+
+def es_administrador():
+    return st.session_state.get('username') in ADMINISTRADORES
+
+def render():
+    st.title("🩺 Monitor de Base de Datos")
+    if not es_administrador():
+        st.error("Solo los administradores pueden ver el monitor.")
+        st.stop()
+    st.caption("Sentencias SQL por corrida del script (cada interacción con la app), agrupadas por pantalla. "
+               "Los contadores son del proceso del servidor: incluyen a todas las sesiones desde el último reinicio.")
+
+    c1, c2, _ = st.columns([1, 1, 2])
+    instrumentacion.UMBRAL_LENTA_MS = c1.number_input("Umbral de sentencia lenta (ms)", min_value=0.0,
+                                                       value=float(instrumentacion.UMBRAL_LENTA_MS), step=10.0)
+    if c2.button("🧹 Reiniciar Contadores"):
+        instrumentacion.reiniciar()
+        st.rerun()
+
+    rutas = pd.DataFrame(instrumentacion.por_ruta())
+    st.markdown("##### Por Ruta")
+    if rutas.empty:
+        st.info("Todavía no hay corridas registradas.")
+    else:
+        st.dataframe(rutas, use_container_width=True, hide_index=True, column_config=COLUMNAS_RUTAS)
+
+    corridas = pd.DataFrame(instrumentacion.corridas())
+    if not corridas.empty:
+        repetidas = corridas[corridas['repeticiones'] > instrumentacion.UMBRAL_REPETIDAS]
+        if not repetidas.empty:
+            st.warning(f"{len(repetidas)} corridas repiten una misma sentencia más de {instrumentacion.UMBRAL_REPETIDAS} veces (posible N+1).")
+        with st.expander(f"🕒 Últimas Corridas ({len(corridas)})"):
+            st.dataframe(corridas, use_container_width=True, hide_index=True, column_config={
+                'fecha': st.column_config.DatetimeColumn("Fecha", format="DD/MM HH:mm:ss"),
+                'mas_repetida': st.column_config.TextColumn("Sentencia más repetida", width="large"),
+            })
+
+    lentas = pd.DataFrame(instrumentacion.lentas())
+    st.markdown(f"##### Sentencias Lentas (≥ {instrumentacion.UMBRAL_LENTA_MS:,.0f} ms)")
+    if lentas.empty:
+        st.caption("Ninguna sentencia superó el umbral.")
+    else:
+        st.dataframe(lentas, use_container_width=True, hide_index=True, column_config={
+            'fecha': st.column_config.DatetimeColumn("Fecha", format="DD/MM HH:mm:ss"),
+            'sentencia': st.column_config.TextColumn("Sentencia", width="large"),
+            'parametros': st.column_config.TextColumn("Parámetros", help="Tipos y cantidades de los parámetros ligados (sin valores)."),
+        })
+
+    st.divider()
+    st.markdown("##### 🧰 Mantenimiento")
+    st.caption(f"Limpieza de conciliaciones vacías y movimientos huérfanos, archivo comprimido de los movimientos del "
+               f"Conciliador v2 de períodos cerrados viejos y compactación (incremental_vacuum/ANALYZE). Corre sola cada "
+               f"{mantenimiento.INTERVALO_DIAS} días.")
+    c1, c2, _ = st.columns([1, 1, 2])
+    meses = c1.number_input("Archivar períodos de más de (meses)", min_value=1, value=mantenimiento.ARCHIVAR_MESES, step=1)
+    vacuum = c1.checkbox("VACUUM completo (una vez)", help="Pasa la base a compactación incremental. Bloquea la base mientras "
+                         "corre: usarlo con la app sin uso. La corrida automática nunca lo hace.")
+    if c2.button("▶️ Ejecutar Ahora"):
+        with st.spinner("Ejecutando mantenimiento..."):
+            informe = mantenimiento.ejecutar(int(meses), vacuum_completo=vacuum)
+        st.success(f"Mantenimiento terminado en {informe['segundos']:,.2f} s.")
+        st.json(informe, expanded=False)
+
+    db = SessionLocal()
+    try:
+        historial = mantenimiento.historial(db)
+    finally:
+        db.close()
+    if historial.empty:
+        st.caption("El mantenimiento todavía no corrió.")
+    else:
+        st.dataframe(historial, use_container_width=True, hide_index=True, column_config={
+            'fecha': st.column_config.DatetimeColumn("Fecha", format="DD/MM/YYYY HH:mm"),
+            'mb_antes': st.column_config.NumberColumn("MB Antes", format="%.2f"),
+            'mb_despues': st.column_config.NumberColumn("MB Después", format="%.2f"),
+            'consultas_ms_antes': st.column_config.NumberColumn("Consultas ms (antes)", format="%.2f"),
+            'consultas_ms_despues': st.column_config.NumberColumn("Consultas ms (después)", format="%.2f"),
+        })
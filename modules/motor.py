@@ -0,0 +1,493 @@
+import os
+import functools
+import multiprocessing
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import pandas as pd
+from modules.similitud import indice_tokens, similitud_pares, desempatar, niveles_similitud
+from modules.claves import extraer_claves, emparejar_por_clave
+
+# --- Motor de matcheo sin copias ---
+# El cruce trabaja sobre arrays de numpy extraídos una sola vez del esquema canónico (días, centavos,
+# posiciones) y devuelve índices. Los únicos DataFrames que se materializan son los resultados finales
+# (pendientes de cada lado y conciliados). Con Copy-on-Write, las selecciones intermedias son vistas: se activa
+# solo mientras corre el cruce (con_copy_on_write), no para el resto de pandas del proceso de Streamlit.
+
+def con_copy_on_write(fn):
+    """Corre fn con Copy-on-Write activo (en pandas >= 3 ya es el comportamiento por defecto)."""
+    if int(pd.__version__.split('.')[0]) >= 3: return fn
+    @functools.wraps(fn)
+    def envuelta(*args, **kwargs):
+        with pd.option_context('mode.copy_on_write', True):
+            return fn(*args, **kwargs)
+    return envuelta
+
+BLOQUE = 8192
+# Modo paralelo: a partir de este total de filas (mayor + banco) se reparte el cruce en procesos
+UMBRAL_PARALELO = 200_000
+MAX_PROCESOS = 8
+# Máxima tolerancia de días del slider: el barrido de candidatos se enumera una sola vez hasta este valor
+TOL_MAX = 15
+# Grupos de importe con más candidatos que esto por partida (comisiones fijas, transferencias redondas) no se
+# enumeran: el cruce de pares crece con el cuadrado del grupo. Se resuelven con emparejar_densos_similitud,
+# que desempata por similitud entre los CANDIDATOS_POR_PARTIDA libres más cercanos de cada partida
+CANDIDATOS_POR_PARTIDA = 16
+
+def a_dias(fechas):
+    """Fechas -> número de día (int64). NaT queda como el mínimo int64."""
+    return fechas.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').astype('int64')
+
+def a_centavos(montos):
+    return np.round(montos.to_numpy(dtype='float64') * 100).astype('int64')
+
+def emparejar_exacto(dias_m, cent_m, dias_b, cent_b, libres_m, libres_b, tol):
+    """Greedy en el orden del mayor: cada partida toma el movimiento del banco libre con el mismo importe
+    dentro de +-tol días, priorizando la menor distancia en días y, a igualdad, el primero del extracto.
+    Devuelve (pos_m, pos_b) con las posiciones emparejadas."""
+    n_b = len(cent_b)
+    if n_b == 0: return np.empty(0, dtype='int64'), np.empty(0, dtype='int64')
+    orden_b = np.lexsort((np.arange(n_b), dias_b, cent_b))
+    cent_s = cent_b[orden_b]
+    # Límites de cada grupo de importe en el arreglo ordenado (por importe, día y posición)
+    cents_unicos, inicio = np.unique(cent_s, return_index=True)
+    fin = np.append(inicio[1:], n_b)
+    dias_s = dias_b[orden_b].tolist()
+    usado = bytearray((~libres_b[orden_b]).tobytes())
+
+    pares_m, pares_b = [], []
+    candidatos = np.flatnonzero(libres_m & (cent_m != 0))
+    # El mayor se recorre por bloques para no materializar listas de Python del tamaño completo
+    for inicio_bloque in range(0, len(candidatos), BLOQUE):
+        bloque = candidatos[inicio_bloque:inicio_bloque + BLOQUE]
+        # Grupo de importe de cada partida del bloque, vectorizado (sin un dict de Python del tamaño del extracto)
+        g = np.minimum(np.searchsorted(cents_unicos, cent_m[bloque]), len(cents_unicos) - 1)
+        hay = cents_unicos[g] == cent_m[bloque]
+        for i, d, hay_i, ini, fin_g in zip(bloque.tolist(), dias_m[bloque].tolist(), hay.tolist(),
+                                           inicio[g].tolist(), fin[g].tolist()):
+            if not hay_i: continue
+            a = bisect_left(dias_s, d - tol, ini, fin_g)
+            z = bisect_right(dias_s, d + tol, ini, fin_g)
+            mejor, mejor_dist = -1, None
+            for k in range(a, z):
+                if usado[k]: continue
+                dist = abs(dias_s[k] - d)
+                # Dentro de un mismo día el arreglo ya está ordenado por posición: basta con el primero
+                if mejor_dist is None or dist < mejor_dist or (dist == mejor_dist and orden_b[k] < orden_b[mejor]):
+                    mejor, mejor_dist = k, dist
+            if mejor >= 0:
+                usado[mejor] = 1
+                pares_m.append(i)
+                pares_b.append(int(orden_b[mejor]))
+    return np.asarray(pares_m, dtype='int64'), np.asarray(pares_b, dtype='int64')
+
+# --- Cruce con tolerancia de importe ---
+# Segunda pasada, solo sobre lo que el cruce exacto dejó libre: retenciones, redondeos de tipo de cambio o
+# comisiones descontadas de una transferencia (10.000,00 contra 9.998,50). El banco libre se ordena por
+# centavos una vez y cada partida del mayor consulta su rango [c - delta, c + delta] con searchsorted.
+
+def delta_importe(cent_m, tol_centavos=0, tol_pct=0.0):
+    """Desvío admitido por partida, en centavos: el mayor entre el absoluto y el porcentaje del importe."""
+    return np.maximum(int(tol_centavos), np.round(np.abs(cent_m) * (float(tol_pct) / 100)).astype('int64'))
+
+def emparejar_aproximado(dias_m, cent_m, dias_b, cent_b, libres_m, libres_b, tol, tol_centavos=0, tol_pct=0.0):
+    """Pares dentro de +-delta centavos y +-tol días. Puntaje = desvío de importe relativo a delta + distancia
+    en días relativa a la ventana; se asignan de menor a mayor puntaje (a igualdad, orden del mayor y del extracto).
+    Devuelve (pos_m, pos_b)."""
+    vacio = np.empty(0, dtype='int64')
+    idx_m = np.flatnonzero(libres_m & (cent_m != 0))
+    idx_b = np.flatnonzero(libres_b)
+    if len(idx_m) == 0 or len(idx_b) == 0: return vacio, vacio
+    orden = np.argsort(cent_b[idx_b], kind='stable')
+    idx_b_s, cent_b_s = idx_b[orden], cent_b[idx_b][orden]
+    delta = delta_importe(cent_m[idx_m], tol_centavos, tol_pct)
+    a_todos = np.searchsorted(cent_b_s, cent_m[idx_m] - delta, 'left')
+    z_todos = np.searchsorted(cent_b_s, cent_m[idx_m] + delta, 'right')
+
+    partes_m, partes_b, partes_p = [], [], []
+    # Expansión por bloques del mayor: solo se conservan los pares que además caen en la ventana de días
+    for i0 in range(0, len(idx_m), BLOQUE):
+        a, z = a_todos[i0:i0 + BLOQUE], z_todos[i0:i0 + BLOQUE]
+        cuenta = z - a
+        total = int(cuenta.sum())
+        if total == 0: continue
+        cand_m = np.repeat(idx_m[i0:i0 + BLOQUE], cuenta)
+        desplaz = np.arange(total) - np.repeat(np.cumsum(cuenta) - cuenta, cuenta)
+        cand_b = idx_b_s[np.repeat(a, cuenta) + desplaz]
+        dist = np.abs(dias_b[cand_b] - dias_m[cand_m])
+        ok = dist <= tol
+        if not ok.any(): continue
+        cand_m, cand_b, dist = cand_m[ok], cand_b[ok], dist[ok]
+        desvio = np.abs(cent_b[cand_b] - cent_m[cand_m])
+        d = np.repeat(delta[i0:i0 + BLOQUE], cuenta)[ok]
+        partes_m.append(cand_m)
+        partes_b.append(cand_b)
+        partes_p.append(desvio / np.maximum(d, 1) + dist / (tol + 1))
+    if not partes_m: return vacio, vacio
+    cand_m, cand_b, puntaje = np.concatenate(partes_m), np.concatenate(partes_b), np.concatenate(partes_p)
+    orden = np.lexsort((cand_b, cand_m, puntaje))
+
+    usado_m, usado_b = bytearray(len(cent_m)), bytearray(len(cent_b))
+    pares_m, pares_b = [], []
+    for m, b in zip(cand_m[orden].tolist(), cand_b[orden].tolist()):
+        if usado_m[m] or usado_b[b]: continue
+        usado_m[m] = usado_b[b] = 1
+        pares_m.append(m)
+        pares_b.append(b)
+    pos_m, pos_b = np.asarray(pares_m, dtype='int64'), np.asarray(pares_b, dtype='int64')
+    orden = np.argsort(pos_m, kind='stable')
+    return pos_m[orden], pos_b[orden]
+
+def _sumar_aproximados(df_m, df_b, pos_m, pos_b, libres_m, libres_b, tol, tol_centavos, tol_pct):
+    """Corre la pasada con tolerancia de importe sobre lo que quedó libre y la agrega a los pares exactos."""
+    if not tol_centavos and not tol_pct: return pos_m, pos_b
+    libres_m, libres_b = libres_m.copy(), libres_b.copy()
+    libres_m[pos_m] = False
+    libres_b[pos_b] = False
+    am, ab = emparejar_aproximado(a_dias(df_m['fecha']), a_centavos(df_m['neto']),
+                                  a_dias(df_b['fecha']), a_centavos(df_b['neto']),
+                                  libres_m, libres_b, tol, tol_centavos, tol_pct)
+    return np.concatenate([pos_m, am]), np.concatenate([pos_b, ab])
+
+# --- Pasada por claves ---
+# Antes del cruce por fechas: cheque, DEBIN, transferencia o CUIT extraídos de ambas descripciones + mismo
+# importe, resuelto con un hash join (O(n)). Lo que empareja esta pasada ya no compite en la ventana de días.
+
+def _pasada_claves(df_m, df_b, validas_m, libres_b, por_clave=True):
+    """Devuelve (pos_m, pos_b, etiquetas, libres_m, libres_b) con los libres ya descontados."""
+    if not por_clave:
+        vacio = np.empty(0, dtype='int64')
+        return vacio, vacio, np.empty(0, dtype=object), validas_m, libres_b
+    pos_m, pos_b, etiquetas = emparejar_por_clave(extraer_claves(df_m['descripcion']), extraer_claves(df_b['descripcion']),
+                                                  a_centavos(df_m['neto']), a_centavos(df_b['neto']),
+                                                  a_dias(df_m['fecha']), a_dias(df_b['fecha']), validas_m, libres_b)
+    libres_m, libres_b = validas_m.copy(), libres_b.copy()
+    libres_m[pos_m] = False
+    libres_b[pos_b] = False
+    return pos_m, pos_b, etiquetas, libres_m, libres_b
+
+def _con_etiquetas(etiquetas, n_pares):
+    """Etiquetas de clave para todos los pares: las de la pasada por claves van primero, el resto vacío."""
+    return np.concatenate([etiquetas, np.full(n_pares - len(etiquetas), None, dtype=object)])
+
+# --- Barrido de tolerancia ---
+# Se enumeran una sola vez todos los pares (mayor, banco) de igual importe dentro de TOL_MAX días, con su
+# distancia en días. Cualquier tolerancia <= TOL_MAX se resuelve después filtrando esos pares y aplicando
+# el mismo greedy del motor, sin volver a parsear ni a buscar candidatos. Los grupos de importe densos
+# (más de CANDIDATOS_POR_PARTIDA candidatos por partida a TOL_MAX) quedan aparte y en cada tolerancia se vuelve
+# a medir su densidad, así el barrido decide igual que conciliar con esa tolerancia. Los que siguen densos no
+# pierden el desempate por similitud: se resuelven con emparejar_densos_similitud, sin expandir todos sus pares.
+
+def enumerar_candidatos(dias_m, cent_m, dias_b, cent_b, libres_m, libres_b, tol_max):
+    """Pares candidatos ordenados por (posición mayor, distancia, posición banco) y las filas de los grupos
+    densos (dict con posiciones, días y centavos de cada lado, o None). Devuelve (cand_m, cand_b, dist, densos)."""
+    idx_m = np.flatnonzero(libres_m & (cent_m != 0))
+    idx_b = np.flatnonzero(libres_b)
+    vacio = np.empty(0, dtype='int64')
+    if len(idx_m) == 0 or len(idx_b) == 0: return vacio, vacio, vacio, None
+    # Clave compuesta (grupo de importe, día) en un int64: el grupo sale de factorizar los centavos de ambos lados
+    unicos, grupos = np.unique(np.concatenate([cent_m[idx_m], cent_b[idx_b]]), return_inverse=True)
+    grupos = grupos.reshape(-1)
+    dmin = min(dias_m[idx_m].min(), dias_b[idx_b].min()) - tol_max
+    ancho = int(max(dias_m[idx_m].max(), dias_b[idx_b].max()) - dmin + tol_max + 1)
+    clave_m = grupos[:len(idx_m)].astype('int64') * ancho + (dias_m[idx_m] - dmin)
+    clave_b = grupos[len(idx_m):].astype('int64') * ancho + (dias_b[idx_b] - dmin)
+    orden = np.lexsort((idx_b, clave_b))
+    clave_b_s, idx_b_s = clave_b[orden], idx_b[orden]
+    a = np.searchsorted(clave_b_s, clave_m - tol_max, 'left')
+    z = np.searchsorted(clave_b_s, clave_m + tol_max, 'right')
+    cuenta = z - a
+    # Grupos densos: se cuentan los candidatos por grupo antes de expandir nada
+    grupo_m = grupos[:len(idx_m)]
+    por_grupo = np.bincount(grupo_m, weights=cuenta, minlength=len(unicos))
+    denso = por_grupo > CANDIDATOS_POR_PARTIDA * np.bincount(grupo_m, minlength=len(unicos))
+    densos = None
+    if denso.any():
+        denso_m, denso_b = denso[grupo_m], denso[grupos[len(idx_m):]]
+        pos_m, pos_b = idx_m[denso_m], idx_b[denso_b]
+        densos = {'pos_m': pos_m, 'dias_m': dias_m[pos_m], 'cent_m': cent_m[pos_m],
+                  'pos_b': pos_b, 'dias_b': dias_b[pos_b], 'cent_b': cent_b[pos_b]}
+        cuenta = np.where(denso_m, 0, cuenta)
+    total = int(cuenta.sum())
+    if total == 0: return vacio, vacio, vacio, densos
+    # Expansión vectorizada de los rangos [a, z) de cada partida del mayor
+    cand_m = np.repeat(idx_m, cuenta)
+    desplaz = np.arange(total) - np.repeat(np.cumsum(cuenta) - cuenta, cuenta)
+    cand_b = idx_b_s[np.repeat(a, cuenta) + desplaz]
+    dist = np.abs(dias_b[cand_b] - dias_m[cand_m])
+    orden = np.lexsort((cand_b, dist, cand_m))
+    return cand_m[orden], cand_b[orden], dist[orden], densos
+
+def emparejar_densos_similitud(dias_m, cent_m, dias_b, cent_b, pos_m, pos_b, tol, indice, k=CANDIDATOS_POR_PARTIDA):
+    """Greedy de emparejar_exacto para grupos densos, con el desempate de desempatar: cada partida del mayor (en
+    orden) junta sus k candidatos libres más cercanos en días y toma el de mayor similitud, después el más cercano
+    y el primero del extracto. El costo es lineal en la ventana de cada partida, no en el cuadrado del grupo.
+    pos_m / pos_b: posiciones originales de cada fila (las del índice de tokens). Devuelve (pos_m, pos_b) originales."""
+    vacio = np.empty(0, dtype='int64')
+    n_b = len(cent_b)
+    if n_b == 0 or len(cent_m) == 0: return vacio, vacio
+    orden_b = np.lexsort((np.arange(n_b), dias_b, cent_b))
+    cent_s = cent_b[orden_b]
+    cents_unicos, inicio = np.unique(cent_s, return_index=True)
+    fin = np.append(inicio[1:], n_b)
+    dias_s = dias_b[orden_b].tolist()
+    pos_b_s = pos_b[orden_b]
+    pos_b_l = pos_b_s.tolist()
+    usado = bytearray(n_b)
+    g = np.minimum(np.searchsorted(cents_unicos, cent_m), len(cents_unicos) - 1)
+    hay = cents_unicos[g] == cent_m
+
+    pares_m, pares_b = [], []
+    for i, d, hay_i, ini, fin_g in zip(pos_m.tolist(), dias_m.tolist(), hay.tolist(), inicio[g].tolist(), fin[g].tolist()):
+        if not hay_i: continue
+        a = bisect_left(dias_s, d - tol, ini, fin_g)
+        z = bisect_right(dias_s, d + tol, ini, fin_g)
+        # (distancia, posición en el extracto, índice ordenado) de los libres: los k primeros son los más cercanos
+        libres = sorted((abs(dias_s[j] - d), pos_b_l[j], j) for j in range(a, z) if not usado[j])[:k]
+        if not libres: continue
+        mejor = libres[0]
+        if len(libres) > 1:
+            nivel = niveles_similitud(indice, np.full(len(libres), i), pos_b_s[[c[2] for c in libres]]).tolist()
+            mejor = min(zip(libres, nivel), key=lambda c: (-c[1], c[0][0], c[0][1]))[0]
+        usado[mejor[2]] = 1
+        pares_m.append(i)
+        pares_b.append(mejor[1])
+    return np.asarray(pares_m, dtype='int64'), np.asarray(pares_b, dtype='int64')
+
+def emparejar_densos(densos, tol, indice=None):
+    """Cruce de los grupos apartados por densos (en el barrido, densos a TOL_MAX). Sin índice, emparejar_exacto.
+    Con índice, la densidad se mide a tol: los grupos que a esa tolerancia ya no son densos pasan por candidatos,
+    desempate por similitud y greedy, igual que en conciliar; los que siguen densos, por emparejar_densos_similitud.
+    Devuelve (pos_m, pos_b)."""
+    vacio = np.empty(0, dtype='int64')
+    if densos is None: return vacio, vacio
+    arrays = (densos['dias_m'], densos['cent_m'], densos['dias_b'], densos['cent_b'],
+              np.ones(len(densos['pos_m']), dtype=bool), np.ones(len(densos['pos_b']), dtype=bool), tol)
+    if indice is None:
+        lm, lb = emparejar_exacto(*arrays)
+        return densos['pos_m'][lm], densos['pos_b'][lb]
+    cand_m, cand_b, dist, aun_densos = enumerar_candidatos(*arrays)
+    cand_m, cand_b, dist = desempatar(densos['pos_m'][cand_m], densos['pos_b'][cand_b], dist, indice)
+    pos_m, pos_b = resolver_candidatos(cand_m, cand_b, dist, tol, int(densos['pos_b'].max()) + 1)
+    if aun_densos is None: return pos_m, pos_b
+    dm, db = emparejar_densos_similitud(aun_densos['dias_m'], aun_densos['cent_m'], aun_densos['dias_b'], aun_densos['cent_b'],
+                                        densos['pos_m'][aun_densos['pos_m']], densos['pos_b'][aun_densos['pos_b']], tol, indice)
+    return np.concatenate([pos_m, dm]), np.concatenate([pos_b, db])
+
+def resolver_candidatos(cand_m, cand_b, dist, tol, n_b, densos=None, indice=None):
+    """Greedy sobre los pares con distancia <= tol: cada partida del mayor (en orden) toma su primer candidato libre.
+    Los grupos densos no comparten importe con los candidatos: se resuelven aparte y se intercalan en el orden del mayor."""
+    sel = dist <= tol
+    usado = bytearray(n_b)
+    pares_m, pares_b = [], []
+    ultimo = -1
+    for m, b in zip(cand_m[sel].tolist(), cand_b[sel].tolist()):
+        if m == ultimo or usado[b]: continue
+        usado[b] = 1
+        ultimo = m
+        pares_m.append(m)
+        pares_b.append(b)
+    pos_m, pos_b = np.asarray(pares_m, dtype='int64'), np.asarray(pares_b, dtype='int64')
+    if densos is None: return pos_m, pos_b
+    dm, db = emparejar_densos(densos, tol, indice)
+    pos_m, pos_b = np.concatenate([pos_m, dm]), np.concatenate([pos_b, db])
+    orden = np.argsort(pos_m, kind='stable')
+    return pos_m[orden], pos_b[orden]
+
+def preparar_barrido(df_m, df_b, elegibles_b=None, tol_max=TOL_MAX, similitud=True, por_clave=True):
+    """Estructura reutilizable para cualquier tolerancia <= tol_max (se guarda en la sesión).
+    La pasada por claves no depende de la tolerancia: se resuelve una vez y se excluye de los candidatos."""
+    validas_m = df_m['fecha'].notna().to_numpy()
+    validas_b = df_b['fecha'].notna().to_numpy()
+    libres_b = validas_b if elegibles_b is None else validas_b & np.asarray(elegibles_b, dtype=bool)
+    clave_m, clave_b, etiquetas, libres_m_fecha, libres_b_fecha = _pasada_claves(df_m, df_b, validas_m, libres_b, por_clave)
+    cand_m, cand_b, dist, densos = enumerar_candidatos(a_dias(df_m['fecha']), a_centavos(df_m['neto']),
+                                                       a_dias(df_b['fecha']), a_centavos(df_b['neto']),
+                                                       libres_m_fecha, libres_b_fecha, tol_max)
+    indice = indice_tokens(df_m['descripcion'], df_b['descripcion']) if similitud else None
+    # Filtrar por dist <= tol conserva el orden relativo: el desempate vale para cualquier tolerancia del barrido
+    if indice is not None: cand_m, cand_b, dist = desempatar(cand_m, cand_b, dist, indice)
+    return {'cand_m': cand_m, 'cand_b': cand_b, 'dist': dist, 'densos': densos, 'tol_max': tol_max, 'indice': indice,
+            'clave_m': clave_m, 'clave_b': clave_b, 'etiquetas': etiquetas,
+            'validas_m': validas_m, 'validas_b': validas_b, 'libres_b': libres_b, 'n_b': len(df_b)}
+
+@con_copy_on_write
+def conciliar_con_barrido(df_m, df_b, barrido, tol, tol_centavos=0, tol_pct=0.0):
+    """Mismo resultado que conciliar(df_m, df_b, tol, ...), resuelto desde el barrido precalculado
+    (la pasada con tolerancia de importe, si se pide, se recalcula sobre lo que queda libre)."""
+    tol = min(tol, barrido['tol_max'])
+    pos_m, pos_b = resolver_candidatos(barrido['cand_m'], barrido['cand_b'], barrido['dist'], tol, barrido['n_b'],
+                                       barrido.get('densos'), barrido['indice'])
+    pos_m, pos_b = np.concatenate([barrido['clave_m'], pos_m]), np.concatenate([barrido['clave_b'], pos_b])
+    pos_m, pos_b = _sumar_aproximados(df_m, df_b, pos_m, pos_b, barrido['validas_m'], barrido['libres_b'],
+                                      tol, tol_centavos, tol_pct)
+    return (pendientes(df_m, pos_m, ~barrido['validas_m']), pendientes(df_b, pos_b, ~barrido['validas_b']),
+            armar_conciliados(df_m, df_b, pos_m, pos_b, barrido['indice'], _con_etiquetas(barrido['etiquetas'], len(pos_m))))
+
+def previsualizar_tolerancias(barrido):
+    """Cantidad de conciliados (por clave + por fecha) para cada tolerancia de 0 a tol_max."""
+    filas = []
+    for tol in range(barrido['tol_max'] + 1):
+        pos_m, _ = resolver_candidatos(barrido['cand_m'], barrido['cand_b'], barrido['dist'], tol, barrido['n_b'],
+                                       barrido.get('densos'), barrido['indice'])
+        filas.append({'Tolerancia (días)': tol, 'Conciliados': len(barrido['clave_m']) + len(pos_m)})
+    return pd.DataFrame(filas)
+
+# --- Modo paralelo por particiones de importe ---
+# Como el cruce exige el mismo importe, particionar ambos lados por un hash de los centavos deja particiones
+# independientes por construcción: cada partida del mayor solo compite con movimientos de su misma partición,
+# en el mismo orden relativo. Con similitud, cada worker enumera, desempata y resuelve los candidatos de sus
+# particiones contra el índice de tokens compartido. El resultado es idéntico al del motor de un solo proceso.
+
+def particionar(cent, k):
+    """Partición 0..k-1 de cada importe. Hash multiplicativo (Fibonacci) de los centavos con signo: un módulo
+    directo amontonaría los importes redondos (múltiplos de 1.000,00) en unas pocas particiones."""
+    h = cent.astype('uint64') * np.uint64(0x9E3779B97F4A7C15)
+    return ((h >> np.uint64(32)) % np.uint64(k)).astype('int64')
+
+def _compartir(arrays):
+    """Copia los arrays a un único bloque de memoria compartida. Devuelve (shm, specs) para reconstruir vistas."""
+    specs, offset = {}, 0
+    for nombre, arr in arrays.items():
+        offset = (offset + 7) // 8 * 8
+        specs[nombre] = (offset, arr.shape, arr.dtype.str)
+        offset += arr.nbytes
+    shm = SharedMemory(create=True, size=max(offset, 1))
+    for nombre, arr in arrays.items():
+        off, shape, dtype = specs[nombre]
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=off)[:] = arr
+    return shm, specs
+
+CLAVES_INDICE = ('indptr_m', 'ids_m', 'inv_b', 'largo_m', 'largo_b')
+
+def _resolver_particion(a, pm, pb, tol, indice):
+    """Cruce de una partición (pm, pb: posiciones originales). Sin índice, emparejar_exacto; con índice, el mismo
+    camino que conciliar en un proceso: candidatos, desempate por similitud y greedy. Devuelve (pos_m, pos_b)."""
+    arrays = (a['dias_m'][pm], a['cent_m'][pm], a['dias_b'][pb], a['cent_b'][pb], a['libres_m'][pm], a['libres_b'][pb], tol)
+    if indice is None:
+        lm, lb = emparejar_exacto(*arrays)
+        return pm[lm], pb[lb]
+    cand_m, cand_b, dist, densos = enumerar_candidatos(*arrays)
+    if densos is not None:
+        densos = {**densos, 'pos_m': pm[densos['pos_m']], 'pos_b': pb[densos['pos_b']]}
+    cand_m, cand_b, dist = desempatar(pm[cand_m], pb[cand_b], dist, indice)
+    return resolver_candidatos(cand_m, cand_b, dist, tol, indice['n_b'], densos, indice)
+
+def _emparejar_particiones(nombre_shm, specs, rangos, tol, n_b=None):
+    """Worker: se adjunta a la memoria compartida (sin copiar los datos de entrada) y resuelve sus particiones.
+    n_b: filas del banco si se compartió el índice de tokens (desempate por similitud)."""
+    shm = SharedMemory(name=nombre_shm)
+    try:
+        a = {k: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=off) for k, (off, shape, dtype) in specs.items()}
+        indice = {**{k: a[k] for k in CLAVES_INDICE}, 'n_b': n_b} if n_b is not None else None
+        res_m, res_b = [], []
+        pm = pb = None
+        for (am, zm), (ab, zb) in rangos:
+            pm, pb = a['perm_m'][am:zm], a['perm_b'][ab:zb]
+            rm, rb = _resolver_particion(a, pm, pb, tol, indice)
+            res_m.append(rm)
+            res_b.append(rb)
+        del a, indice, pm, pb
+        vacio = np.empty(0, dtype='int64')
+        return (np.concatenate(res_m) if res_m else vacio), (np.concatenate(res_b) if res_b else vacio)
+    finally:
+        shm.close()
+
+def emparejar_paralelo(dias_m, cent_m, dias_b, cent_b, libres_m, libres_b, tol, procesos, indice=None):
+    """Cruce repartido en procesos por particiones de importe; con índice de tokens desempata por similitud."""
+    k = procesos * 4
+    part_m, part_b = particionar(cent_m, k), particionar(cent_b, k)
+    # Orden estable por partición: dentro de cada una se conserva el orden original de las filas
+    perm_m = np.argsort(part_m, kind='stable')
+    perm_b = np.argsort(part_b, kind='stable')
+    lim_m = np.searchsorted(part_m[perm_m], np.arange(k + 1))
+    lim_b = np.searchsorted(part_b[perm_b], np.arange(k + 1))
+    rangos = [((lim_m[p], lim_m[p + 1]), (lim_b[p], lim_b[p + 1])) for p in range(k)]
+    rangos = [((int(am), int(zm)), (int(ab), int(zb))) for (am, zm), (ab, zb) in rangos if zm > am and zb > ab]
+    # Con pocas particiones no vacías (pocos importes distintos) no se levantan workers sin trabajo
+    lotes = [rangos[w::procesos] for w in range(procesos) if rangos[w::procesos]]
+    vacio = np.empty(0, dtype='int64')
+    if not lotes: return vacio, vacio
+
+    arrays = {'dias_m': dias_m, 'cent_m': cent_m, 'libres_m': libres_m, 'perm_m': perm_m,
+              'dias_b': dias_b, 'cent_b': cent_b, 'libres_b': libres_b, 'perm_b': perm_b}
+    if indice is not None: arrays.update({k: indice[k] for k in CLAVES_INDICE})
+    n_b = indice['n_b'] if indice is not None else None
+    shm, specs = _compartir(arrays)
+    try:
+        # spawn: seguro dentro del servidor de Streamlit (que corre con varios hilos)
+        with ProcessPoolExecutor(max_workers=len(lotes), mp_context=multiprocessing.get_context('spawn')) as pool:
+            futuros = [pool.submit(_emparejar_particiones, shm.name, specs, lote, tol, n_b) for lote in lotes]
+            resultados = [f.result() for f in futuros]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    pos_m = np.concatenate([r[0] for r in resultados])
+    pos_b = np.concatenate([r[1] for r in resultados])
+    # Merge determinístico: en el orden del mayor, igual que el motor de un solo proceso
+    orden = np.argsort(pos_m, kind='stable')
+    return pos_m[orden], pos_b[orden]
+
+def procesos_por_defecto(n_filas):
+    if n_filas < UMBRAL_PARALELO: return 1
+    return max(1, min(MAX_PROCESOS, os.cpu_count() or 1))
+
+def armar_conciliados(df_m, df_b, pos_m, pos_b, indice=None, etiquetas=None):
+    """Tabla de conciliados a partir de las posiciones emparejadas (una sola materialización).
+    Con índice de tokens, Confianza es la similitud de descripciones del par (0 a 100); los pares
+    emparejados por clave (etiquetas no nulas) tienen confianza 100."""
+    confianza = np.round(similitud_pares(indice, pos_m, pos_b) * 100) if indice is not None else np.full(len(pos_m), np.nan)
+    if etiquetas is None: etiquetas = np.full(len(pos_m), None, dtype=object)
+    confianza[pd.notna(etiquetas)] = 100
+    # Las descripciones se toman con iloc: conservan el dtype de texto del esquema (to_numpy crearía un str de
+    # Python por fila, el mayor pico de memoria del cruce)
+    return pd.DataFrame({
+        'Fecha_Mayor': df_m['fecha'].to_numpy()[pos_m], 'Detalle_Mayor': df_m['descripcion'].iloc[pos_m].reset_index(drop=True),
+        'Monto': df_m['neto'].to_numpy()[pos_m],
+        'Diferencia': np.round(df_b['neto'].to_numpy()[pos_b] - df_m['neto'].to_numpy()[pos_m], 2),
+        'Fecha_Banco': df_b['fecha'].to_numpy()[pos_b], 'Detalle_Banco': df_b['descripcion'].iloc[pos_b].reset_index(drop=True),
+        'Confianza': confianza, 'Clave': etiquetas,
+        'id_mayor': df_m['source_row_id'].to_numpy()[pos_m], 'id_banco': df_b['source_row_id'].to_numpy()[pos_b],
+    })
+
+def pendientes(df, pos_emparejadas, excluir=None):
+    """Filas no emparejadas (y no excluidas) de un lado, como un único DataFrame nuevo."""
+    libres = np.ones(len(df), dtype=bool)
+    libres[pos_emparejadas] = False
+    if excluir is not None: libres &= ~excluir
+    return df.iloc[np.flatnonzero(libres)].reset_index(drop=True)
+
+@con_copy_on_write
+def conciliar(df_m, df_b, days_tol, elegibles_b=None, procesos=None, tol_centavos=0, tol_pct=0.0, similitud=True,
+              por_clave=True):
+    """Pipeline completo sobre el esquema canónico. elegibles_b: máscara de movimientos del banco que pueden
+    matchearse (los gastos bancarios clasificados quedan fuera). Las filas sin fecha no participan del cruce
+    y tampoco quedan en pendientes (se informan aparte al ingresar).
+    procesos: None = automático según tamaño; >1 fuerza el modo paralelo por particiones.
+    tol_centavos / tol_pct: si alguno es > 0, después del cruce exacto se emparejan los restantes con
+    tolerancia de importe (la columna Diferencia de los conciliados queda en banco - mayor).
+    similitud: desempata por descripción cuando una partida tiene varios candidatos y calcula la Confianza
+    (también en modo paralelo: el resultado no depende de la cantidad de procesos).
+    por_clave: antes del cruce por fechas, empareja por cheque/DEBIN/transferencia/CUIT + importe."""
+    validas_m = df_m['fecha'].notna().to_numpy()
+    validas_b = df_b['fecha'].notna().to_numpy()
+    libres_b = validas_b if elegibles_b is None else validas_b & np.asarray(elegibles_b, dtype=bool)
+    if procesos is None: procesos = procesos_por_defecto(len(df_m) + len(df_b))
+    clave_m, clave_b, etiquetas, libres_m_fecha, libres_b_fecha = _pasada_claves(df_m, df_b, validas_m, libres_b, por_clave)
+    arrays = (a_dias(df_m['fecha']), a_centavos(df_m['neto']), a_dias(df_b['fecha']), a_centavos(df_b['neto']),
+              libres_m_fecha, libres_b_fecha, days_tol)
+    indice = indice_tokens(df_m['descripcion'], df_b['descripcion']) if similitud else None
+    if procesos > 1:
+        pos_m, pos_b = emparejar_paralelo(*arrays, procesos=procesos, indice=indice)
+    elif indice is not None:
+        cand_m, cand_b, dist, densos = enumerar_candidatos(*arrays)
+        cand_m, cand_b, dist = desempatar(cand_m, cand_b, dist, indice)
+        pos_m, pos_b = resolver_candidatos(cand_m, cand_b, dist, days_tol, len(df_b), densos, indice)
+    else:
+        pos_m, pos_b = emparejar_exacto(*arrays)
+    pos_m, pos_b = np.concatenate([clave_m, pos_m]), np.concatenate([clave_b, pos_b])
+    pos_m, pos_b = _sumar_aproximados(df_m, df_b, pos_m, pos_b, validas_m, libres_b, days_tol, tol_centavos, tol_pct)
+    return (pendientes(df_m, pos_m, ~validas_m), pendientes(df_b, pos_b, ~validas_b),
+            armar_conciliados(df_m, df_b, pos_m, pos_b, indice, _con_etiquetas(etiquetas, len(pos_m))))
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from modules.esquema import esquema_vacio
+
+# --- Varios extractos contra un mismo mayor ---
+# Los extractos de todas las cuentas se unen en un solo lado 'banco' (source_row_id únicos entre cuentas) y
+# se cruzan en una sola pasada contra el mayor: un único índice sobre el mayor y emparejamiento 1 a 1, así
+# que ninguna partida del mayor puede quedar reclamada por dos cuentas. Después el resultado se reparte:
+# cada cuenta se queda con sus conciliados y sus pendientes del banco y arma su propia sesión y su propio
+# cierre. El mayor es compartido: las partidas que ninguna cuenta reclamó quedan en la cuenta principal
+# (la primera), junto con los arrastres del mayor.
+
+def unir_extractos(extractos):
+    """extractos: lista de (cuenta, df canónico) con ids que no se pisan. Devuelve (df_b, cuentas alineadas
+    con df_b como array)."""
+    if not extractos: return esquema_vacio(), np.array([], dtype=object)
+    df_b = pd.concat([df for _, df in extractos], ignore_index=True)
+    cuentas = np.repeat(np.array([c for c, _ in extractos], dtype=object), [len(df) for _, df in extractos])
+    return df_b, cuentas
+
+def repartir(p_m, p_b, matched, df_b, cuentas_b, cuentas):
+    """Resultado del cruce conjunto -> {cuenta: (p_m, p_b, matched)}. Los pendientes del mayor van a la
+    primera cuenta; conciliados y pendientes del banco, a la cuenta de su movimiento del banco."""
+    cuenta_por_id = pd.Series(cuentas_b, index=df_b['source_row_id'].to_numpy())
+    cuenta_pb = cuenta_por_id.reindex(p_b['source_row_id'].to_numpy()).to_numpy()
+    cuenta_mt = cuenta_por_id.reindex(matched['id_banco'].to_numpy()).to_numpy() if 'id_banco' in matched.columns else np.array([], dtype=object)
+    partes = {}
+    for i, cuenta in enumerate(cuentas):
+        partes[cuenta] = (
+            p_m if i == 0 else p_m.iloc[0:0],
+            p_b.loc[cuenta_pb == cuenta].reset_index(drop=True),
+            matched.loc[cuenta_mt == cuenta].reset_index(drop=True) if len(cuenta_mt) else matched,
+        )
+    return partes
+
+def mayor_por_cuenta(p_m, partes, cuentas):
+    """Neto del mayor nuevo que le corresponde a cada cuenta: lo que reclamaron sus conciliados, y a la
+    principal además lo que nadie reclamó. La suma de todas las cuentas es el total del mayor importado."""
+    netos = {c: float(partes[c][2]['Monto'].sum()) if 'Monto' in partes[c][2].columns else 0.0 for c in cuentas}
+    if cuentas: netos[cuentas[0]] += float(p_m['neto'].sum())
+    return netos
+
+def resumen_cuentas(sesiones, cerradas=()):
+    """Tabla por cuenta para el selector de la conciliación multi-cuenta."""
+    filas = [{'Cuenta': c, 'Conciliados': len(res['matched']), 'Pend. Mayor': int(res['totales']['m']['n']) if 'totales' in res else len(res['p_m']),
+              'Pend. Banco': int(res['totales']['b']['n']) if 'totales' in res else len(res['p_b']), 'Estado': 'Abierta'}
+             for c, res in sesiones.items()]
+    filas += [{'Cuenta': c, 'Conciliados': None, 'Pend. Mayor': None, 'Pend. Banco': None, 'Estado': 'Cerrada'} for c in cerradas]
+    return pd.DataFrame(filas)
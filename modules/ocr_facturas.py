@@ -0,0 +1,162 @@
+import io
+import os
+import streamlit as st
+import pandas as pd
+from models import SessionLocal
+from modules.facturas import (procesar_lote, hash_contenido, hashes_procesados, guardar_facturas, cargar_facturas,
+                              OCR_BACKENDS)
+from modules.vinculos import (vincular, facturas_sin_vincular, movimientos_pendientes, extracto_pendiente, armar_registros,
+                              guardar_vinculos, cargar_vinculos, borrar_vinculos, DIAS_ANTES, DIAS_DESPUES)
+
+SIN_OCR = "Ninguno (solo PDFs digitales)"
+
+COLUMNAS_FACTURA = {
+    "nombre_archivo": st.column_config.TextColumn("Archivo"),
+    "tipo": st.column_config.TextColumn("Tipo", width="small"),
+    "punto_venta": st.column_config.NumberColumn("P. Venta", format="%05d"),
+    "numero": st.column_config.NumberColumn("Número", format="%08d"),
+    "fecha": st.column_config.DateColumn("Fecha", format="DD/MM/YYYY"),
+    "cuit_emisor": st.column_config.TextColumn("CUIT Emisor"),
+    "cuit_receptor": st.column_config.TextColumn("CUIT Receptor"),
+    "neto": st.column_config.NumberColumn("Neto", format="$ %.2f"),
+    "iva": st.column_config.NumberColumn("IVA", format="$ %.2f"),
+    "total": st.column_config.NumberColumn("Total", format="$ %.2f"),
+    "hash_archivo": None, "segundos": None, "id": None,
+}
+
+COLUMNAS_VINCULO = {
+    "fecha_factura": st.column_config.DateColumn("Fecha Factura", format="DD/MM/YYYY"),
+    "total_factura": st.column_config.NumberColumn("Total Factura", format="$ %.2f"),
+    "fecha_movimiento": st.column_config.DateColumn("Fecha Mov.", format="DD/MM/YYYY"),
+    "descripcion_movimiento": st.column_config.TextColumn("Movimiento"),
+    "importe": st.column_config.NumberColumn("Importe Aplicado", format="$ %.2f"),
+    "confianza": st.column_config.ProgressColumn("Confianza", min_value=0, max_value=100, format="%d%%"),
+    "user_id": None, "factura_id": None, "ref_id": None, "id": None,
+}
+
+def convert_df_to_excel(df):
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False, sheet_name='Facturas')
+    return output.getvalue()
+
+def render():
+    st.title("📷 OCR de Facturas")
+    user_id = st.session_state.get('user_id')
+    tab_carga, tab_guardadas, tab_vinculos = st.tabs(["📤 Procesar PDFs", "📚 Facturas Extraídas", "🔗 Vincular con Banco"])
+
+    with tab_carga:
+        st.info("Subí los PDFs del mes (podés volver a subir la carpeta completa: los archivos ya procesados se omiten).")
+        archivos = st.file_uploader("Facturas (PDF)", type=['pdf'], accept_multiple_files=True, key="pdf_facturas")
+        c1, c2 = st.columns(2)
+        ocr = c1.selectbox("OCR para PDFs escaneados", [SIN_OCR] + list(OCR_BACKENDS),
+                           help="Las páginas sin capa de texto se leen con OCR (requiere el backend instalado).")
+        procesos = c2.number_input("Procesos", min_value=1, max_value=os.cpu_count() or 1, value=os.cpu_count() or 1,
+                                   help="Los lotes grandes se reparten entre varios procesos.")
+
+        if archivos and st.button("Procesar Facturas", type="primary"):
+            try:
+                import pypdf  # noqa: F401
+            except ImportError:
+                st.error("Falta la librería pypdf (pip install pypdf).")
+                st.stop()
+            lote = [(a.name, a.getvalue()) for a in archivos]
+            db = SessionLocal()
+            try:
+                conocidos = hashes_procesados(db, user_id, {hash_contenido(data) for _, data in lote})
+                with st.spinner(f"Procesando {len(lote) - len(conocidos)} archivos..."):
+                    df, metricas = procesar_lote(lote, conocidos, None if ocr == SIN_OCR else ocr, int(procesos))
+                guardar_facturas(db, user_id, df)
+            finally:
+                db.close()
+            st.session_state['ultimo_lote_facturas'] = (df, metricas)
+
+        if 'ultimo_lote_facturas' in st.session_state:
+            df, metricas = st.session_state['ultimo_lote_facturas']
+            m1, m2, m3, m4, m5 = st.columns(5)
+            m1.metric("Archivos", metricas['archivos'])
+            m2.metric("Nuevos", metricas['nuevos'])
+            m3.metric("Ya procesados", metricas['omitidos'], help="Mismo contenido (hash) que un PDF ya extraído.")
+            m4.metric("Páginas", metricas['paginas'])
+            m5.metric("Páginas/seg", f"{metricas['paginas_por_seg']:,.1f}",
+                      help=f"{metricas['segundos']:.2f}s con {metricas['procesos']} proceso(s).")
+            if not df.empty:
+                estados = df['estado'].value_counts()
+                if estados.get('sin_texto'): st.warning(f"{estados['sin_texto']} PDF(s) sin capa de texto: elegí un backend de OCR para leerlos.")
+                if estados.get('error'): st.error(f"{estados['error']} PDF(s) no se pudieron leer.")
+                st.dataframe(df, use_container_width=True, hide_index=True, column_config=COLUMNAS_FACTURA)
+
+    with tab_guardadas:
+        db = SessionLocal()
+        facturas = cargar_facturas(db, user_id)
+        db.close()
+        if facturas.empty:
+            st.info("Todavía no hay facturas extraídas.")
+        else:
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Facturas", len(facturas))
+            c2.metric("Completas", int((facturas['estado'] == 'ok').sum()))
+            c3.metric("Total", f"${facturas['total'].fillna(0).sum():,.2f}")
+            st.dataframe(facturas, use_container_width=True, hide_index=True, column_config=COLUMNAS_FACTURA)
+            st.download_button("📥 Descargar Excel", data=convert_df_to_excel(facturas), file_name="facturas.xlsx")
+
+    with tab_vinculos:
+        render_vinculos(user_id)
+
+def render_vinculos(user_id):
+    st.info("Busca qué débito o crédito del banco pagó cada factura: mismo importe y CUIT, pagos que cubren varias "
+            "facturas del mismo CUIT y facturas pagadas en partes, dentro de una ventana de días.")
+    res = st.session_state.get('conciliacion_activa')
+    c1, c2, c3, c4 = st.columns(4)
+    usar_v2 = c1.checkbox("Movimientos pendientes (Conciliador v2)", value=True)
+    usar_extracto = c2.checkbox("Extracto de la conciliación activa", value=bool(res), disabled=not res)
+    dias_antes = c3.number_input("Días antes de la factura", min_value=0, max_value=30, value=DIAS_ANTES)
+    dias_despues = c4.number_input("Días después de la factura", min_value=0, max_value=365, value=DIAS_DESPUES)
+
+    if st.button("Buscar Vínculos", type="primary"):
+        db = SessionLocal()
+        try:
+            facturas = facturas_sin_vincular(db, user_id)
+            fuentes = []
+            if usar_v2: fuentes.append(movimientos_pendientes(db, user_id))
+            if usar_extracto and res: fuentes.append(extracto_pendiente(db, user_id, res))
+        finally:
+            db.close()
+        movimientos = pd.concat(fuentes, ignore_index=True) if fuentes else pd.DataFrame(columns=['ref_id', 'fecha', 'descripcion', 'neto', 'origen', 'contexto'])
+        vinculos = vincular(facturas, movimientos, int(dias_antes), int(dias_despues))
+        registros = armar_registros(vinculos, movimientos, user_id)
+        st.session_state['vinculos_propuestos'] = (registros, len(facturas), len(movimientos))
+
+    if 'vinculos_propuestos' in st.session_state:
+        registros, n_facturas, n_movimientos = st.session_state['vinculos_propuestos']
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Facturas sin vínculo", n_facturas)
+        m2.metric("Movimientos", n_movimientos)
+        m3.metric("Facturas vinculadas", registros['factura_id'].nunique() if not registros.empty else 0)
+        m4.metric("Pagos combinados", int((registros['tipo'] == 'combinado_cuit').sum()) if not registros.empty else 0)
+        if not registros.empty:
+            st.dataframe(registros, use_container_width=True, hide_index=True, column_config=COLUMNAS_VINCULO)
+            if st.button("💾 Guardar Vínculos"):
+                db = SessionLocal()
+                guardar_vinculos(db, registros)
+                db.close()
+                del st.session_state['vinculos_propuestos']
+                st.success(f"{len(registros)} vínculos guardados.")
+                st.rerun()
+
+    st.divider()
+    st.markdown("##### Vínculos Guardados")
+    db = SessionLocal()
+    guardados = cargar_vinculos(db, user_id)
+    db.close()
+    if guardados.empty:
+        st.caption("Todavía no hay vínculos guardados.")
+        return
+    st.dataframe(guardados, use_container_width=True, hide_index=True, column_config=COLUMNAS_VINCULO)
+    a_borrar = st.multiselect("Quitar vínculos", guardados['id'].tolist(),
+                              format_func=lambda i: f"#{i} {guardados.loc[guardados['id'] == i, 'numero'].iat[0]} - {guardados.loc[guardados['id'] == i, 'descripcion_movimiento'].iat[0]}")
+    if a_borrar and st.button("🗑️ Quitar Seleccionados"):
+        db = SessionLocal()
+        borrar_vinculos(db, user_id, a_borrar)
+        db.close()
+        st.rerun()
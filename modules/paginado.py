@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+# --- Vista paginada de los pendientes ---
+# Los editores nunca reciben el conjunto completo: filtro (importe, fechas, texto), orden y recorte a una
+# página se resuelven acá, sobre los pendientes indexados por source_row_id. Las marcas y selecciones
+# viven en res['p_m']/res['p_b'] (modules.estado), así que persisten al cambiar de página o de filtro.
+
+TAM_PAGINA = 100
+
+# Etiqueta -> (columna, ascendente)
+ORDENES = {
+    'Fecha ↑': ('fecha', True), 'Fecha ↓': ('fecha', False),
+    'Importe ↑': ('neto', True), 'Importe ↓': ('neto', False),
+    'Descripción': ('descripcion', True),
+}
+
+def filtro_vacio():
+    return {'importe_min': None, 'importe_max': None, 'desde': None, 'hasta': None, 'texto': '', 'excluir': None}
+
+def mascara(df, filtro):
+    """Filas que cumplen el filtro. Los importes se comparan en valor absoluto (el mismo pago es negativo en
+    un lado y positivo en el otro); 'hasta' incluye el día completo; 'excluir' es una columna booleana
+    cuyas filas marcadas no se muestran. Las filas ya cruzadas (fuera de 'Pendiente') nunca se muestran."""
+    filtro = filtro or {}
+    m = df['Pendiente'].to_numpy(dtype=bool, copy=True) if 'Pendiente' in df.columns else np.ones(len(df), dtype=bool)
+    if filtro.get('excluir'):
+        m &= ~df[filtro['excluir']].to_numpy(dtype=bool)
+    if filtro.get('importe_min') is not None or filtro.get('importe_max') is not None:
+        abs_neto = np.abs(df['neto'].to_numpy())
+        if filtro.get('importe_min') is not None: m &= abs_neto >= filtro['importe_min']
+        if filtro.get('importe_max') is not None: m &= abs_neto <= filtro['importe_max']
+    if filtro.get('desde') is not None or filtro.get('hasta') is not None:
+        fechas = df['fecha'].to_numpy()
+        if filtro.get('desde') is not None: m &= fechas >= np.datetime64(pd.Timestamp(filtro['desde']))
+        if filtro.get('hasta') is not None: m &= fechas < np.datetime64(pd.Timestamp(filtro['hasta']) + pd.Timedelta(days=1))
+    texto = (filtro.get('texto') or '').strip()
+    if texto and m.any():
+        # Solo se busca en las filas que sobrevivieron a los filtros numéricos
+        pos = np.flatnonzero(m)
+        hallado = df['descripcion'].iloc[pos].str.contains(texto, case=False, regex=False, na=False).to_numpy(dtype=bool)
+        m[pos[~hallado]] = False
+    return m
+
+def ids_filtrados(df, filtro):
+    """Ids de todas las filas que cumplen el filtro (todas las páginas), para las acciones masivas."""
+    return df.index[mascara(df, filtro)]
+
+def paginar(df, filtro=None, orden=None, numero=1, tam=TAM_PAGINA):
+    """Devuelve {'vista', 'total', 'paginas', 'numero'}: solo las filas de la página pedida (número ya
+    acotado al rango válido), en el orden elegido; el índice sigue siendo el source_row_id."""
+    pos = np.flatnonzero(mascara(df, filtro))
+    if orden in ORDENES and len(pos) > 1:
+        col, asc = ORDENES[orden]
+        valores = df[col].iloc[pos]
+        if col == 'descripcion': valores = valores.str.upper()
+        orden_pos = np.argsort(valores.to_numpy(), kind='stable')
+        pos = pos[orden_pos if asc else orden_pos[::-1]]
+    total = len(pos)
+    paginas = max(1, -(-total // tam))
+    numero = min(max(1, int(numero or 1)), paginas)
+    vista = df.iloc[pos[(numero - 1) * tam: numero * tam]]
+    return {'vista': vista, 'total': total, 'paginas': paginas, 'numero': numero}
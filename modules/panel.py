@@ -0,0 +1,63 @@
+import streamlit as st
+import pandas as pd
+from models import SessionLocal
+from modules.resumen import cargar_resumenes, TRAMOS, ETIQUETAS_TRAMOS
+from modules.conciliacion import MESES
+
+COLUMNAS_TABLA = {
+    "periodo": st.column_config.DateColumn("Período", format="MM/YYYY"),
+    "cuenta": st.column_config.TextColumn("Cuenta"),
+    "saldo_mayor": st.column_config.NumberColumn("Saldo Mayor", format="$ %.2f"),
+    "saldo_banco": st.column_config.NumberColumn("Saldo Banco", format="$ %.2f"),
+    "diferencia": st.column_config.NumberColumn("Diferencia", format="$ %.2f"),
+    "n_conciliados": st.column_config.NumberColumn("Conciliados"),
+    "importe_conciliado": st.column_config.NumberColumn("Importe Conciliado", format="$ %.2f"),
+    "n_pend_mayor": st.column_config.NumberColumn("Pend. Mayor"),
+    "importe_pend_mayor": st.column_config.NumberColumn("$ Pend. Mayor", format="$ %.2f"),
+    "n_pend_banco": st.column_config.NumberColumn("Pend. Banco"),
+    "importe_pend_banco": st.column_config.NumberColumn("$ Pend. Banco", format="$ %.2f"),
+}
+
+def render():
+    st.title("Bienvenido a tu Panel Contable")
+    user_id = st.session_state.get('user_id')
+    db = SessionLocal()
+    resumenes = cargar_resumenes(db, user_id)
+    db.close()
+    if resumenes.empty:
+        st.info("Selecciona una herramienta en el menú de la izquierda para comenzar. "
+                "Cuando cierres tu primera conciliación vas a ver acá la evolución de tus cuentas.")
+        return
+
+    c1, c2 = st.columns(2)
+    cuentas = sorted(resumenes['cuenta'].dropna().unique())
+    if len(cuentas) > 1:
+        cuenta = c1.selectbox("Cuenta", cuentas)
+        resumenes = resumenes[resumenes['cuenta'] == cuenta]
+    anios = sorted(resumenes['periodo_anio'].unique())
+    if len(anios) > 1:
+        desde, hasta = c2.select_slider("Años", options=anios, value=(anios[0], anios[-1]))
+        resumenes = resumenes[resumenes['periodo_anio'].between(desde, hasta)]
+
+    ultimo = resumenes.iloc[-1]
+    n_pend = ultimo['n_pend_mayor'] + ultimo['n_pend_banco'] # NaN en cierres migrados (sin conteos)
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Último Cierre", f"{MESES[int(ultimo['periodo_mes']) - 1]} {int(ultimo['periodo_anio'])}")
+    m2.metric("Diferencia", f"${ultimo['diferencia']:,.2f}" if pd.notna(ultimo['diferencia']) else "-")
+    m3.metric("Pendientes Arrastrados", int(n_pend) if pd.notna(n_pend) else "-")
+    m4.metric("Pendientes +90 días", int(ultimo['n_pend_mas']) if pd.notna(ultimo['n_pend_mas']) else "-")
+
+    serie = resumenes.set_index('periodo')
+    st.markdown("##### Saldos al Cierre")
+    st.line_chart(serie[['saldo_mayor', 'saldo_banco']].rename(columns={'saldo_mayor': 'Mayor', 'saldo_banco': 'Banco'}))
+    g1, g2 = st.columns(2)
+    with g1:
+        st.markdown("##### Pendientes por Antigüedad ($)")
+        st.bar_chart(serie[[f'importe_pend_{t}' for t in TRAMOS]].rename(columns={f'importe_pend_{t}': e for t, e in ETIQUETAS_TRAMOS.items()}))
+    with g2:
+        st.markdown("##### Conciliados vs. Pendientes")
+        st.bar_chart(serie[['n_conciliados', 'n_pend_mayor', 'n_pend_banco']].rename(
+            columns={'n_conciliados': 'Conciliados', 'n_pend_mayor': 'Pend. Mayor', 'n_pend_banco': 'Pend. Banco'}), stack=False)
+
+    with st.expander(f"📋 Detalle por período ({len(resumenes)})"):
+        st.dataframe(resumenes[list(COLUMNAS_TABLA)].iloc[::-1], use_container_width=True, hide_index=True, column_config=COLUMNAS_TABLA)
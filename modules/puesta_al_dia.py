@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+# --- Puesta al día: varios meses atrasados en una sola corrida ---
+# Un mayor y un extracto que cubren varios meses se proyectan una sola vez al esquema canónico y se parten
+# por mes. Cada mes se concilia igual que en el flujo de un período (cruce, arrastres, alias), en orden y en
+# memoria: el saldo de cierre y los pendientes de un mes son el saldo inicial y los arrastres del siguiente.
+# Los meses que cierran con diferencia cero contra el saldo final del extracto (obligatorio por mes: calcularlo de
+# los movimientos dejaría la diferencia en cero siempre) se guardan juntos; el primero con diferencia se detiene para
+# trabajarlo a mano y, al cerrarlo, la corrida sigue con los meses que quedan (modules.conciliacion).
+
+def periodos_entre(desde, hasta):
+    """Meses (anio, mes) desde 'desde' hasta 'hasta' inclusive; ambos como (anio, mes)."""
+    inicio, fin = desde[0] * 12 + desde[1] - 1, hasta[0] * 12 + hasta[1] - 1
+    return [(k // 12, k % 12 + 1) for k in range(inicio, fin + 1)]
+
+def mes_de(fechas):
+    """Clave anio*12 + mes-1 de cada fecha (las fechas NaT quedan en -1)."""
+    f = pd.DatetimeIndex(pd.to_datetime(fechas))
+    return np.where(f.isna(), -1, f.year * 12 + f.month - 1)
+
+def partir_por_mes(fechas, periodos):
+    """Posiciones de las filas de cada período. Lo anterior al primer mes entra en el primero (registraciones
+    tardías, como en el flujo de un período); lo posterior al último queda fuera y se devuelve aparte.
+    Devuelve ([posiciones por período], posiciones posteriores)."""
+    claves = mes_de(fechas)
+    primera, ultima = periodos[0][0] * 12 + periodos[0][1] - 1, periodos[-1][0] * 12 + periodos[-1][1] - 1
+    claves = np.where(claves < primera, primera, claves)
+    partes = [np.flatnonzero(claves == a * 12 + m - 1) for a, m in periodos]
+    return partes, np.flatnonzero(claves > ultima)
+
+def tramos(df_m, huellas_m, df_b, huellas_b, periodos, saldos, nombres):
+    """Cola de meses a conciliar. saldos: {(anio, mes): {'s_fin_m', 's_fin_b'}} (s_fin_m None = calcular de los
+    movimientos; s_fin_b None = sin saldo del extracto, el mes no se cierra en lote); nombres: nombres de los meses. Devuelve (cola, n_posteriores_m, n_posteriores_b)."""
+    partes_m, fuera_m = partir_por_mes(df_m['fecha'], periodos)
+    partes_b, fuera_b = partir_por_mes(df_b['fecha'], periodos)
+    cola = []
+    for (anio, mes), pos_m, pos_b in zip(periodos, partes_m, partes_b):
+        cola.append({
+            'anio': anio, 'mes': mes, 'periodo': f"{nombres[mes - 1]} {anio}", **saldos.get((anio, mes), {'s_fin_m': None, 's_fin_b': None}),
+            'm': df_m.iloc[pos_m].reset_index(drop=True), 'b': df_b.iloc[pos_b].reset_index(drop=True),
+            'huellas': {'mayor': huellas_m.iloc[pos_m].reset_index(drop=True), 'banco': huellas_b.iloc[pos_b].reset_index(drop=True)},
+        })
+    return cola, len(fuera_m), len(fuera_b)
+
+def resumen_cola(puesta):
+    """Tabla de la corrida: meses cerrados en lote, el detenido y los que esperan."""
+    filas = [{'Período': p, 'Estado': 'Cerrado'} for p in puesta['cerrados']]
+    if puesta.get('detenido'): filas.append({'Período': puesta['detenido'], 'Estado': 'Con diferencia (a trabajar)'})
+    filas += [{'Período': t['periodo'], 'Estado': 'En espera'} for t in puesta['cola']]
+    return pd.DataFrame(filas)
@@ -0,0 +1,100 @@
+import re
+from datetime import datetime
+import pandas as pd
+import streamlit as st
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from models import SessionLocal, ReglaGasto, VersionReglasGasto
+
+# --- Diccionario de gastos bancarios persistido por usuario ---
+# Las palabras clave viven en ReglaGasto (una fila por palabra) con un contador de versión por usuario.
+# El clasificador compilado se cachea a nivel de proceso por (user_id, version): todas las sesiones del
+# mismo usuario comparten el mismo y cada "Actualizar Diccionario" incrementa la versión (nueva clave).
+
+REGLAS_DEFAULT = {
+    'Mantenimiento': ['MANT', 'CUENTA', 'PAQUETE', 'COMISION SERV'],
+    'Impuestos/Tasas': ['IMPUESTO', 'LEY 25413', 'PERCEPCION', 'RETENCION', 'SELLOS', 'SIRCREB'],
+    'IVA': ['IVA VENTAS', 'IVA DEBITO', 'IVA 21'],
+    'Comisiones Bancarias': ['COMISION', 'CARGO', 'GASTO EMISION'],
+    'Intereses': ['INTERES', 'INT. PAGO'],
+}
+SIN_CATEGORIA = "Otros Pendientes"
+
+def compilar_reglas(reglas):
+    """Una regex compilada por categoría, en orden de prioridad (gana la primera que coincide)."""
+    return {'reglas': {cat: list(claves) for cat, claves in reglas.items()},
+            'patrones': [(cat, re.compile('|'.join(re.escape(k.upper()) for k in claves))) for cat, claves in reglas.items() if claves]}
+
+def clasificar(compilado, serie):
+    """Categoría de cada descripción (vectorizado por categoría)."""
+    s = serie.fillna('').astype(str).str.upper()
+    resultado = pd.Series(SIN_CATEGORIA, index=serie.index, dtype=object)
+    pendiente = pd.Series(True, index=serie.index)
+    for cat, patron in compilado['patrones']:
+        coincide = pendiente & s.str.contains(patron, regex=True)
+        resultado[coincide] = cat
+        pendiente &= ~coincide
+    return resultado
+
+def version_reglas(db, user_id):
+    fila = db.get(VersionReglasGasto, user_id)
+    return fila.version if fila else 0
+
+def cargar_reglas(db, user_id):
+    """{categoria: [palabras]} en orden de prioridad. Al primer uso se siembra con REGLAS_DEFAULT."""
+    if not db.get(VersionReglasGasto, user_id):
+        _sembrar(db, user_id)
+    filas = db.query(ReglaGasto.categoria_asignada, ReglaGasto.texto_a_buscar) \
+              .filter_by(user_id=user_id).order_by(ReglaGasto.orden, ReglaGasto.id).all()
+    reglas = {}
+    for cat, texto in filas:
+        reglas.setdefault(cat, []).append(texto)
+    return reglas
+
+def _sembrar(db, user_id):
+    try:
+        for orden, (cat, claves) in enumerate(REGLAS_DEFAULT.items()):
+            db.add_all([ReglaGasto(user_id=user_id, texto_a_buscar=k, categoria_asignada=cat, orden=orden) for k in claves])
+        db.add(VersionReglasGasto(user_id=user_id, version=1, actualizado=datetime.utcnow()))
+        db.commit()
+    except IntegrityError:
+        # Otra sesión del mismo usuario sembró primero
+        db.rollback()
+
+def guardar_categoria(db, user_id, categoria, claves):
+    """Reemplaza las palabras de una categoría (las que estaban en otra categoría se mueven) e incrementa la versión."""
+    claves = list(dict.fromkeys(k.strip() for k in claves if k.strip()))
+    orden = db.query(func.min(ReglaGasto.orden)).filter_by(user_id=user_id, categoria_asignada=categoria).scalar()
+    if orden is None:
+        orden = (db.query(func.max(ReglaGasto.orden)).filter_by(user_id=user_id).scalar() or 0) + 1
+    db.query(ReglaGasto).filter(ReglaGasto.user_id == user_id,
+                                (ReglaGasto.categoria_asignada == categoria) | ReglaGasto.texto_a_buscar.in_(claves)) \
+      .delete(synchronize_session=False)
+    db.add_all([ReglaGasto(user_id=user_id, texto_a_buscar=k, categoria_asignada=categoria, orden=orden) for k in claves])
+    fila = db.get(VersionReglasGasto, user_id)
+    if fila is None:
+        fila = VersionReglasGasto(user_id=user_id, version=0)
+        db.add(fila)
+    fila.version = (fila.version or 0) + 1
+    fila.actualizado = datetime.utcnow()
+    db.commit()
+    return fila.version
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def _clasificador_compilado(user_id, version):
+    db = SessionLocal()
+    try:
+        return compilar_reglas(cargar_reglas(db, user_id))
+    finally:
+        db.close()
+
+def clasificador(user_id):
+    """Clasificador vigente del usuario: una consulta por clave primaria para la versión y el resto desde la caché."""
+    if not user_id: return compilar_reglas(REGLAS_DEFAULT)
+    db = SessionLocal()
+    try:
+        if not db.get(VersionReglasGasto, user_id): _sembrar(db, user_id)
+        version = version_reglas(db, user_id)
+    finally:
+        db.close()
+    return _clasificador_compilado(user_id, version)
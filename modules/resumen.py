@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from models import ResumenPeriodo
+
+# --- Resumen materializado de cierres ---
+# Al cerrar un período se guarda una fila por usuario/cuenta/mes en resumen_periodos, dentro de la misma
+# transacción que la Conciliacion. El tablero de Inicio lee solo esas filas: con cientos de cierres sigue
+# siendo una consulta por índice, sin abrir las hojas de trabajo JSON.
+
+# Tramos de antigüedad de los pendientes arrastrados (días al fin del período): sufijo -> límite superior
+TRAMOS = {'30': 30, '60': 60, '90': 90, 'mas': None}
+ETIQUETAS_TRAMOS = {'30': '0-30 días', '60': '31-60 días', '90': '61-90 días', 'mas': '+90 días'}
+
+COLUMNAS_RESUMEN = [
+    'cuenta', 'periodo_anio', 'periodo_mes', 'fecha_cierre', 'saldo_mayor', 'saldo_banco', 'diferencia',
+    'n_conciliados', 'importe_conciliado', 'n_pend_mayor', 'importe_pend_mayor', 'n_pend_banco', 'importe_pend_banco',
+    *[f'n_pend_{t}' for t in TRAMOS], *[f'importe_pend_{t}' for t in TRAMOS],
+]
+
+def fin_de_mes(anio, mes):
+    return pd.Timestamp(int(anio), int(mes), 1) + pd.offsets.MonthEnd(0)
+
+def antiguedad(fechas, montos, corte):
+    """Conteo e importe (valor absoluto) de los pendientes por tramo de antigüedad al 'corte'."""
+    dias = (pd.Timestamp(corte) - pd.to_datetime(pd.Series(fechas), errors='coerce')).dt.days.fillna(0).clip(lower=0).to_numpy()
+    importes = np.abs(np.asarray(montos, dtype=float))
+    datos, desde = {}, -1
+    for tramo, hasta in TRAMOS.items():
+        m = (dias > desde) if hasta is None else (dias > desde) & (dias <= hasta)
+        datos[f'n_pend_{tramo}'] = int(m.sum())
+        datos[f'importe_pend_{tramo}'] = round(float(importes[m].sum()), 2)
+        desde = hasta
+    return datos
+
+def calcular_resumen(anio, mes, matched, pend_m, pend_b):
+    """Conteos e importes del cierre. pend_m/pend_b: los pendientes que se arrastran (esquema canónico)."""
+    montos = matched['Monto'] if matched is not None and 'Monto' in matched.columns else pd.Series(dtype=float)
+    fechas = pd.concat([pend_m['fecha'], pend_b['fecha']], ignore_index=True)
+    netos = np.concatenate([pend_m['neto'].to_numpy(dtype=float), pend_b['neto'].to_numpy(dtype=float)])
+    return {
+        'n_conciliados': len(montos), 'importe_conciliado': round(float(montos.abs().sum()), 2),
+        'n_pend_mayor': len(pend_m), 'importe_pend_mayor': round(float(pend_m['neto'].sum()), 2),
+        'n_pend_banco': len(pend_b), 'importe_pend_banco': round(float(pend_b['neto'].sum()), 2),
+        **antiguedad(fechas, netos, fin_de_mes(anio, mes)),
+    }
+
+def guardar_resumen(db, user_id, conciliacion, cuenta, datos, commit=True):
+    """Reemplaza el resumen del período (volver a cerrar el mismo mes deja solo el último cierre). Sin commit
+    si es parte de la transacción del cierre: 'conciliacion' ya tiene que tener id (db.flush())."""
+    db.query(ResumenPeriodo).filter_by(user_id=user_id, cuenta=cuenta, periodo_anio=conciliacion.periodo_anio,
+                                       periodo_mes=conciliacion.periodo_mes).delete(synchronize_session=False)
+    db.add(ResumenPeriodo(
+        user_id=user_id, conciliacion_id=conciliacion.id, cuenta=cuenta, periodo_anio=conciliacion.periodo_anio,
+        periodo_mes=conciliacion.periodo_mes, fecha_cierre=conciliacion.fecha_cierre, saldo_mayor=conciliacion.saldo_mayor,
+        saldo_banco=conciliacion.saldo_banco, diferencia=conciliacion.diferencia, **datos,
+    ))
+    if commit: db.commit()
+
+def cargar_resumenes(db, user_id, cuenta=None):
+    """Resúmenes del usuario en orden cronológico, con la columna 'periodo' (primer día del mes)."""
+    q = db.query(*[getattr(ResumenPeriodo, c) for c in COLUMNAS_RESUMEN]).filter(ResumenPeriodo.user_id == user_id)
+    if cuenta is not None: q = q.filter(ResumenPeriodo.cuenta == cuenta)
+    df = pd.DataFrame(q.order_by(ResumenPeriodo.periodo_anio, ResumenPeriodo.periodo_mes).all(), columns=COLUMNAS_RESUMEN)
+    # Los cierres migrados no tienen conteos: NULL -> NaN para que las columnas sean numéricas
+    numericas = COLUMNAS_RESUMEN[4:]
+    df[numericas] = df[numericas].apply(pd.to_numeric, errors='coerce')
+    df['periodo'] = pd.to_datetime(pd.DataFrame({'year': df['periodo_anio'], 'month': df['periodo_mes'], 'day': 1}))
+    return df
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+from modules.texto import tokens
+
+# --- Similitud de descripciones ---
+# Los tokens de ambos lados se traducen a ids comunes. Del lado del banco se arma un índice invertido plano:
+# claves token * n_b + fila ordenadas, de modo que las filas de cada token quedan contiguas y "¿la fila b
+# tiene el token t?" es un searchsorted. La similitud se calcula solo para pares ya bloqueados por importe y
+# fecha (los candidatos del motor), nunca sobre todo mayor x banco.
+# Las descripciones se tokenizan por bloques y cada token se reduce a un hash de 64 bits: los textos de un
+# bloque se liberan antes del siguiente, así el pico de memoria no crece con los strings de todo el archivo.
+
+BLOQUE_TOKENS = 16384
+
+def _hashes_tokens(serie):
+    """(fila, hash del token) de cada token de la serie, tokenizada de a BLOQUE_TOKENS filas."""
+    serie = serie.reset_index(drop=True)
+    filas, hashes = [np.empty(0, dtype='int64')], [np.empty(0, dtype='uint64')]
+    for i0 in range(0, len(serie), BLOQUE_TOKENS):
+        t = tokens(serie.iloc[i0:i0 + BLOQUE_TOKENS])
+        filas.append(t['fila'].to_numpy(dtype='int64') + i0)
+        hashes.append(pd.util.hash_array(t['token'].to_numpy(dtype=object)))
+    return np.concatenate(filas), np.concatenate(hashes)
+
+def indice_tokens(desc_m, desc_b):
+    fila_m, hash_m = _hashes_tokens(desc_m)
+    fila_b, hash_b = _hashes_tokens(desc_b)
+    n_m, n_b = len(desc_m), len(desc_b)
+    ids, _ = pd.factorize(np.concatenate([hash_m, hash_b]))
+    ids_m, ids_b = ids[:len(hash_m)].astype('int64'), ids[len(hash_m):].astype('int64')
+    # Tokens del mayor en formato CSR (fila -> rango en 'ids')
+    orden = np.argsort(fila_m, kind='stable')
+    indptr_m = np.zeros(n_m + 1, dtype='int64')
+    np.cumsum(np.bincount(fila_m, minlength=n_m), out=indptr_m[1:])
+    return {
+        'indptr_m': indptr_m, 'ids_m': ids_m[orden],
+        'inv_b': np.sort(ids_b * max(n_b, 1) + fila_b),
+        'largo_m': np.bincount(fila_m, minlength=n_m), 'largo_b': np.bincount(fila_b, minlength=n_b),
+        'n_b': n_b,
+    }
+
+def similitud_pares(indice, pos_m, pos_b):
+    """Jaccard de tokens (0 a 1) para cada par (pos_m[i], pos_b[i]); costo proporcional a pares x tokens."""
+    pos_m, pos_b = np.asarray(pos_m, dtype='int64'), np.asarray(pos_b, dtype='int64')
+    if len(pos_m) == 0: return np.empty(0, dtype='float64')
+    indptr, inv = indice['indptr_m'], indice['inv_b']
+    cuenta = indptr[pos_m + 1] - indptr[pos_m]
+    total = int(cuenta.sum())
+    comunes = np.zeros(len(pos_m), dtype='float64')
+    if total and len(inv):
+        par = np.repeat(np.arange(len(pos_m)), cuenta)
+        desplaz = np.arange(total) - np.repeat(np.cumsum(cuenta) - cuenta, cuenta)
+        clave = indice['ids_m'][np.repeat(indptr[pos_m], cuenta) + desplaz] * max(indice['n_b'], 1) + pos_b[par]
+        i = np.minimum(np.searchsorted(inv, clave), len(inv) - 1)
+        comunes = np.bincount(par, weights=(inv[i] == clave), minlength=len(pos_m))
+    union = indice['largo_m'][pos_m] + indice['largo_b'][pos_b] - comunes
+    return np.where(union > 0, comunes / np.maximum(union, 1), 0.0)
+
+def niveles_similitud(indice, pos_m, pos_b, paso=0.1):
+    """Similitud de cada par redondeada hacia abajo a 'paso' (entero 0..1/paso): la clave de desempate."""
+    return np.floor(similitud_pares(indice, pos_m, pos_b) / paso + 1e-9).astype('int64')
+
+def desempatar(cand_m, cand_b, dist, indice, paso=0.1):
+    """Reordena los candidatos de cada partida del mayor con más de una opción: primero la similitud
+    (redondeada a 'paso', para que diferencias mínimas de texto no le ganen a la fecha), después la distancia
+    en días y la posición en el extracto. Las partidas con un solo candidato no se tocan.
+    Dentro de la ventana de días la similitud manda sobre la fecha: un movimiento con la descripción de la
+    partida a 2 días le gana a uno de otro proveedor el mismo día (la fecha solo decide entre descripciones
+    igual de parecidas)."""
+    if len(cand_m) == 0: return cand_m, cand_b, dist
+    inicio = np.r_[True, cand_m[1:] != cand_m[:-1]]
+    grupo = np.cumsum(inicio) - 1
+    ambiguo = np.bincount(grupo)[grupo] > 1
+    nivel = np.zeros(len(cand_m), dtype='int64')
+    sel = np.flatnonzero(ambiguo)
+    nivel[sel] = niveles_similitud(indice, cand_m[sel], cand_b[sel], paso)
+    orden = np.lexsort((cand_b, dist, -nivel, cand_m))
+    return cand_m[orden], cand_b[orden], dist[orden]
@@ -0,0 +1,53 @@
+import re
+import numpy as np
+import pandas as pd
+
+# --- Normalización de descripciones ---
+RE_NO_ALFANUM = re.compile(r'[^A-Z0-9 ]+')
+RE_ESPACIOS = re.compile(r'\s+')
+
+def normalizar_descripcion(serie):
+    """Mayúsculas, sin acentos ni puntuación y con espacios colapsados (vectorizado)."""
+    s = serie.fillna('').astype(str).str.upper()
+    # Solo las filas con caracteres no ASCII necesitan la descomposición de acentos
+    no_ascii = ~s.str.isascii()
+    if no_ascii.any():
+        s = s.copy()
+        s[no_ascii] = s[no_ascii].str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+    s = s.str.replace(RE_NO_ALFANUM, ' ', regex=True)
+    return s.str.replace(RE_ESPACIOS, ' ', regex=True).str.strip()
+
+# --- Tokens para similitud de descripciones ---
+# Se trabaja a nivel token (sin regex por fila): los números pierden los ceros a la izquierda
+# (CHEQUE 00012345 = CHEQUE 12345) y un CUIT separado en 2-8-1 dígitos se une en un único token de 11,
+# igual que cuando viene sin guiones. Así el mismo identificador coincide en ambos lados.
+PALABRAS_VACIAS = {'DE', 'DEL', 'LA', 'EL', 'LOS', 'LAS', 'Y', 'A', 'EN', 'POR', 'PARA', 'CON', 'AL', 'NRO', 'NUM'}
+
+def tokens(serie):
+    """Pares (fila, token) sin repetidos, con fila = posición en la serie. Se descartan palabras vacías
+    y tokens de un solo caracter."""
+    t = normalizar_descripcion(serie.reset_index(drop=True)).str.split(' ').explode()
+    fila, tok = t.index.to_numpy(dtype='int64'), t.to_numpy(dtype=object, copy=True)
+    largo = t.str.len().fillna(0).to_numpy(dtype='int64')
+    digitos = t.str.isdigit().fillna(False).to_numpy(dtype=bool)
+    vivo = largo > 0
+    # CUIT 20-12345678-9 -> tokens consecutivos de 2, 8 y 1 dígitos en la misma fila
+    if len(tok) > 2:
+        i = np.flatnonzero((largo[:-2] == 2) & (largo[1:-1] == 8) & (largo[2:] == 1) & digitos[:-2] & digitos[1:-1] & digitos[2:]
+                           & (fila[:-2] == fila[2:]))
+        if len(i):
+            tok[i] = tok[i] + tok[i + 1] + tok[i + 2]
+            vivo[i + 1] = vivo[i + 2] = False
+    sin_ceros = pd.Series(tok[digitos], dtype=object).str.lstrip('0')
+    tok[digitos] = sin_ceros.where(sin_ceros != '', '0').to_numpy(dtype=object)
+    # Los números valen aunque tengan un solo dígito; las palabras, desde dos letras
+    ok = vivo & ((largo > 1) | digitos) & ~pd.Series(tok, dtype=object).isin(PALABRAS_VACIAS).to_numpy()
+    return pd.DataFrame({'fila': fila[ok], 'token': tok[ok]}).drop_duplicates()
+
+# --- Patrones (descripción sin la parte variable) ---
+RE_TOKEN_CON_DIGITOS = re.compile(r'\b\w*\d\w*\b')
+
+def patron_descripcion(serie):
+    """Descripción normalizada sin tokens con dígitos (n° de cheque, CBU, fechas): lo que se repite mes a mes."""
+    s = normalizar_descripcion(serie).str.replace(RE_TOKEN_CON_DIGITOS, ' ', regex=True)
+    return s.str.replace(RE_ESPACIOS, ' ', regex=True).str.strip()
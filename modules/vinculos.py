@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert
+from models import Factura, VinculoFactura
+from modules.mantenimiento import leer_movimientos
+from modules.claves import extraer_claves
+
+# --- Vínculo factura <-> movimiento bancario ---
+# Las facturas se indexan por (total en centavos, CUIT de emisor o receptor) y los movimientos por
+# (importe absoluto en centavos, CUIT de la descripción). El vínculo sale de hash joins sobre esas claves,
+# filtrados por una ventana de días, en pasadas de confianza decreciente:
+#   1. importe + CUIT (1 a 1)
+#   2. pagos combinados del mismo CUIT: un movimiento que paga varias facturas, o una factura pagada en
+#      varios movimientos (sumas acotadas a MAX_PARTES elementos entre MAX_CANDIDATOS candidatos)
+#   3. solo importe (1 a 1), cuando ningún lado trae un CUIT que lo contradiga
+
+DIAS_ANTES = 5 # Un pago puede figurar unos días antes de la fecha de la factura (anticipos)
+DIAS_DESPUES = 60
+MAX_PARTES = 4
+MAX_CANDIDATOS = 15
+CONFIANZA = {'importe_cuit': 100, 'combinado_cuit': 90, 'importe': 70}
+
+def _dias(fechas):
+    return (pd.to_datetime(fechas).to_numpy().astype('datetime64[D]').astype('int64'))
+
+def _centavos(montos):
+    return np.abs(np.round(pd.to_numeric(montos, errors='coerce').fillna(0.0).to_numpy() * 100)).astype('int64')
+
+def preparar_facturas(df):
+    """Una fila por (factura, CUIT): la contraparte puede ser el emisor (compras) o el receptor (ventas)."""
+    base = pd.DataFrame({'factura_id': df['id'].to_numpy(), 'cent': _centavos(df['total']), 'dia': _dias(df['fecha'])})
+    claves = pd.concat([base.assign(cuit=df['cuit_emisor'].to_numpy()), base.assign(cuit=df['cuit_receptor'].to_numpy())])
+    claves = claves[claves['cuit'].notna()].drop_duplicates(['factura_id', 'cuit'])
+    return base, claves
+
+def preparar_movimientos(df):
+    return pd.DataFrame({'pos': np.arange(len(df)), 'cent': _centavos(df['neto']), 'dia': _dias(df['fecha']),
+                         'cuit': extraer_claves(df['descripcion'])['cuit'].to_numpy()})
+
+def _en_ventana(dia_mov, dia_fac, dias_antes, dias_despues):
+    d = dia_mov - dia_fac
+    return (d >= -dias_antes) & (d <= dias_despues)
+
+def _greedy(pares, libres_f, libres_m):
+    """1 a 1 por cercanía de fecha: cada par se toma si la factura y el movimiento siguen libres."""
+    pares = pares.assign(dist=(pares['dia_m'] - pares['dia_f']).abs()).sort_values(['dist', 'factura_id', 'pos'], kind='stable')
+    elegidos = []
+    for f, p, n_f, n_m in pares[['factura_id', 'pos', 'n_f', 'n_m']].itertuples(index=False):
+        if f in libres_f and p in libres_m:
+            libres_f.discard(f)
+            libres_m.discard(p)
+            elegidos.append((f, p, n_f == 1 and n_m == 1))
+    return elegidos
+
+def _con_conteos(pares):
+    pares = pares.drop_duplicates(['factura_id', 'pos'])
+    return pares.assign(n_f=pares.groupby('factura_id')['pos'].transform('size'),
+                        n_m=pares.groupby('pos')['factura_id'].transform('size'))
+
+def subconjunto(valores, objetivo, max_partes=MAX_PARTES):
+    """Posiciones de 2..max_partes valores (positivos) que suman exactamente el objetivo, o None.
+    Búsqueda en profundidad sobre los valores ordenados de mayor a menor, con poda por suma."""
+    orden = sorted(range(len(valores)), key=lambda i: -valores[i])
+    v = [valores[i] for i in orden]
+    def buscar(inicio, resto, elegidos):
+        if resto == 0: return elegidos if len(elegidos) >= 2 else None
+        if len(elegidos) == max_partes: return None
+        for i in range(inicio, len(v)):
+            if v[i] > resto or v[i] <= 0: continue
+            # Los que siguen son menores: si ni tomando los más grandes posibles se llega, cortar
+            if v[i] * (max_partes - len(elegidos)) < resto: break
+            hallado = buscar(i + 1, resto - v[i], elegidos + [i])
+            if hallado: return hallado
+        return None
+    hallado = buscar(0, objetivo, [])
+    return [orden[i] for i in hallado] if hallado else None
+
+def vincular(facturas, movimientos, dias_antes=DIAS_ANTES, dias_despues=DIAS_DESPUES):
+    """facturas: id, fecha, total, cuit_emisor, cuit_receptor. movimientos: fecha, descripcion, neto (+ columnas
+    de referencia que se conservan). Devuelve un DataFrame con un vínculo por fila: factura_id, pos (posición del
+    movimiento), importe aplicado, confianza, tipo y grupo (mismo número para las partes de un pago combinado)."""
+    columnas = ['factura_id', 'pos', 'importe', 'confianza', 'tipo', 'grupo']
+    if facturas.empty or movimientos.empty: return pd.DataFrame(columns=columnas)
+    base_f, claves_f = preparar_facturas(facturas)
+    mov = preparar_movimientos(movimientos)
+    libres_f, libres_m = set(base_f['factura_id']), set(mov['pos'])
+    vinculos, grupo = [], 0
+
+    # 1. Importe + CUIT
+    pares = claves_f.merge(mov[mov['cuit'].notna()], on=['cent', 'cuit'], suffixes=('_f', '_m'))
+    pares = pares[_en_ventana(pares['dia_m'], pares['dia_f'], dias_antes, dias_despues)]
+    for f, p, _ in _greedy(_con_conteos(pares), libres_f, libres_m):
+        grupo += 1
+        vinculos.append((f, p, mov['cent'].iat[p], CONFIANZA['importe_cuit'], 'importe_cuit', grupo))
+
+    # 2. Combinados por CUIT (ambas direcciones)
+    por_cuit = claves_f[claves_f['factura_id'].isin(libres_f)].merge(
+        mov[mov['cuit'].notna() & mov['pos'].isin(libres_m)], on='cuit', suffixes=('_f', '_m'))
+    por_cuit = por_cuit[_en_ventana(por_cuit['dia_m'], por_cuit['dia_f'], dias_antes, dias_despues)]
+    por_cuit = por_cuit.assign(dist=(por_cuit['dia_m'] - por_cuit['dia_f']).abs())
+    # Un movimiento que paga varias facturas
+    for p, cand in por_cuit.groupby('pos', sort=False):
+        cand = cand[cand['factura_id'].isin(libres_f)].drop_duplicates('factura_id').sort_values('dist').head(MAX_CANDIDATOS)
+        if p not in libres_m or len(cand) < 2: continue
+        partes = subconjunto(cand['cent_f'].tolist(), int(cand['cent_m'].iat[0]))
+        if partes:
+            grupo += 1
+            libres_m.discard(p)
+            for i in partes:
+                f = cand['factura_id'].iat[i]
+                libres_f.discard(f)
+                vinculos.append((f, p, cand['cent_f'].iat[i], CONFIANZA['combinado_cuit'], 'combinado_cuit', grupo))
+    # Una factura pagada en varios movimientos
+    for f, cand in por_cuit.groupby('factura_id', sort=False):
+        cand = cand[cand['pos'].isin(libres_m)].drop_duplicates('pos').sort_values('dist').head(MAX_CANDIDATOS)
+        if f not in libres_f or len(cand) < 2: continue
+        partes = subconjunto(cand['cent_m'].tolist(), int(cand['cent_f'].iat[0]))
+        if partes:
+            grupo += 1
+            libres_f.discard(f)
+            for i in partes:
+                p = cand['pos'].iat[i]
+                libres_m.discard(p)
+                vinculos.append((f, p, cand['cent_m'].iat[i], CONFIANZA['combinado_cuit'], 'combinado_cuit', grupo))
+
+    # 3. Solo importe: se descarta si ambos lados traen CUIT y no coinciden
+    f_libres = base_f[base_f['factura_id'].isin(libres_f)]
+    pares = f_libres.merge(mov[mov['pos'].isin(libres_m)], on='cent', suffixes=('_f', '_m'))
+    pares = pares[_en_ventana(pares['dia_m'], pares['dia_f'], dias_antes, dias_despues)]
+    if not pares.empty:
+        cuits_f = claves_f.groupby('factura_id')['cuit'].agg(set)
+        contradice = [pd.notna(c) and f in cuits_f.index and c not in cuits_f[f] for f, c in zip(pares['factura_id'], pares['cuit'])]
+        pares = pares[~np.asarray(contradice, dtype=bool)]
+        for f, p, unico in _greedy(_con_conteos(pares), libres_f, libres_m):
+            grupo += 1
+            # Con más de un candidato posible la elección por cercanía es menos segura
+            vinculos.append((f, p, mov['cent'].iat[p], CONFIANZA['importe'] if unico else CONFIANZA['importe'] - 20, 'importe', grupo))
+
+    df = pd.DataFrame(vinculos, columns=columnas)
+    df['importe'] = df['importe'].astype('int64') / 100
+    return df
+
+# --- Fuentes ---
+def facturas_sin_vincular(db, user_id):
+    vinculadas = db.query(VinculoFactura.factura_id).filter(VinculoFactura.user_id == user_id)
+    q = db.query(Factura.id, Factura.fecha, Factura.total, Factura.cuit_emisor, Factura.cuit_receptor, Factura.tipo,
+                 Factura.punto_venta, Factura.numero).filter(
+        Factura.user_id == user_id, Factura.total.isnot(None), Factura.fecha.isnot(None), Factura.id.notin_(vinculadas))
+    return pd.DataFrame(q.all(), columns=['id', 'fecha', 'total', 'cuit_emisor', 'cuit_receptor', 'tipo', 'punto_venta', 'numero'])
+
+def _sin_vincular(db, user_id, df, origen, contexto=None):
+    q = db.query(VinculoFactura.ref_id).filter(VinculoFactura.user_id == user_id, VinculoFactura.origen == origen)
+    if contexto is not None: q = q.filter(VinculoFactura.contexto == contexto)
+    usados = {r for (r,) in q}
+    return df[~df['ref_id'].isin(usados)].reset_index(drop=True)
+
+def movimientos_pendientes(db, user_id):
+    """Movimientos del Conciliador v2 aún pendientes, sin vínculo."""
+    # Vivos y archivados: un movimiento viejo archivado sigue pudiendo vincularse
+    df = leer_movimientos(db, user_id, 'banco', estado='pendiente')[['id', 'fecha', 'descripcion', 'monto']].set_axis(
+        ['ref_id', 'fecha', 'descripcion', 'neto'], axis=1).assign(origen='movimiento_banco', contexto=None)
+    return _sin_vincular(db, user_id, df, 'movimiento_banco')
+
+def contexto_extracto(res):
+    """Clave de la conciliación de la que sale el extracto: sus source_row_id solo valen dentro de ella."""
+    return f"{res.get('cuenta') or ''}|{res['periodo']}"
+
+def extracto_pendiente(db, user_id, res):
+    """Pendientes del banco de la conciliación activa (res['p_b']), sin vínculo en esa misma conciliación."""
+    p_b = res['p_b']
+    if 'Pendiente' in p_b.columns: p_b = p_b[p_b['Pendiente'].to_numpy()]
+    contexto = contexto_extracto(res)
+    df = pd.DataFrame({'ref_id': p_b['source_row_id'].to_numpy(), 'fecha': p_b['fecha'].to_numpy(),
+                       'descripcion': p_b['descripcion'].to_numpy(), 'neto': p_b['neto'].to_numpy(), 'origen': 'extracto',
+                       'contexto': contexto})
+    return _sin_vincular(db, user_id, df, 'extracto', contexto)
+
+# --- Persistencia ---
+def armar_registros(vinculos, movimientos, user_id):
+    mov = movimientos.iloc[vinculos['pos'].to_numpy()]
+    return pd.DataFrame({
+        'user_id': user_id, 'factura_id': vinculos['factura_id'].astype(int).to_numpy(), 'origen': mov['origen'].to_numpy(),
+        'ref_id': mov['ref_id'].astype(int).to_numpy(), 'contexto': mov['contexto'].to_numpy(), 'fecha_movimiento': pd.to_datetime(mov['fecha']).dt.date.to_numpy(),
+        'descripcion_movimiento': mov['descripcion'].to_numpy(), 'importe': vinculos['importe'].to_numpy(),
+        'confianza': vinculos['confianza'].astype(int).to_numpy(), 'tipo': vinculos['tipo'].to_numpy(),
+    })
+
+def guardar_vinculos(db, registros, commit=True):
+    if registros.empty: return
+    db.execute(insert(VinculoFactura.__table__).prefix_with('OR IGNORE'), registros.astype(object).to_dict(orient='records'))
+    if commit: db.commit()
+
+def cargar_vinculos(db, user_id):
+    q = db.query(VinculoFactura, Factura).join(Factura).filter(VinculoFactura.user_id == user_id).order_by(Factura.fecha, VinculoFactura.id)
+    return pd.DataFrame([{
+        'id': v.id, 'fecha_factura': f.fecha, 'cuit_emisor': f.cuit_emisor, 'numero': f"{f.punto_venta or 0:05d}-{f.numero or 0:08d}",
+        'total_factura': f.total, 'fecha_movimiento': v.fecha_movimiento, 'descripcion_movimiento': v.descripcion_movimiento,
+        'importe': v.importe, 'confianza': v.confianza, 'tipo': v.tipo, 'origen': v.origen,
+    } for v, f in q.all()])
+
+def borrar_vinculos(db, user_id, ids):
+    db.query(VinculoFactura).filter(VinculoFactura.user_id == user_id, VinculoFactura.id.in_(list(ids))).delete(synchronize_session=False)
+    db.commit()
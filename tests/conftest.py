@@ -0,0 +1,23 @@
+import os
+import sys
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Los módulos se importan como en la app (from models import ..., from modules import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Base
+
+
+@pytest.fixture
+def db():
+    """Sesión sobre una base SQLite en memoria con el esquema de models (no toca contabilidad.db)."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    sesion = sessionmaker(bind=engine)()
+    try:
+        yield sesion
+    finally:
+        sesion.close()
+        engine.dispose()
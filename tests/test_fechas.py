@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+from modules.fechas import normalizar_fechas
+
+
+def test_dia_primero_con_primera_fila_ambigua():
+    rng = np.random.default_rng(0)
+    dias = rng.integers(0, 2000, 20_000)
+    dias[0] = 64 # 05/03/2020: primera fila ambigua, como en la mayoría de los extractos
+    reales = pd.Timestamp('2020-01-01') + pd.to_timedelta(dias, unit='D')
+    columna = pd.Series(reales.strftime('%d/%m/%Y'))
+
+    fechas, formato, invalidas = normalizar_fechas(columna)
+
+    assert formato == '%d/%m/%Y'
+    assert len(invalidas) == 0
+    assert (fechas.to_numpy() == reales.to_numpy()).all()
+
+
+def test_filas_invalidas():
+    columna = pd.Series(['05/03/2026', '31/02/2026', '', None, 'sin fecha', '06/03/2026'])
+    fechas, formato, invalidas = normalizar_fechas(columna)
+    assert formato == '%d/%m/%Y'
+    assert list(invalidas) == [1, 4]
+    assert fechas.iloc[0] == pd.Timestamp('2026-03-05') and fechas.iloc[5] == pd.Timestamp('2026-03-06')
@@ -0,0 +1,45 @@
+import json
+from sqlalchemy import create_engine, inspect, text
+import models
+from models import User, FormatoArchivo
+from modules.formatos import buscar_formato, guardar_formato
+
+MAPEO_V1 = {'fecha': 'Fecha', 'descripcion': 'Concepto', 'monto_1': 'Debe', 'monto_2': 'Haber'}
+MAPEO_V2 = {'fecha': 'Fecha', 'concepto': 'Concepto', 'monto': 'Importe'}
+
+
+def test_cada_modulo_guarda_su_formato_del_mismo_archivo(db):
+    user = User(username="ana")
+    db.add(user)
+    db.commit()
+    guardar_formato(db, user.id, 'conciliacion', 'banco', 'h1', MAPEO_V1, {'usecols': ['Fecha', 'Concepto', 'Debe', 'Haber']})
+    guardar_formato(db, user.id, 'conciliador_v2', 'banco', 'h1', MAPEO_V2, {'usecols': ['Fecha', 'Concepto', 'Importe']})
+
+    assert buscar_formato(db, user.id, 'conciliacion', 'banco', 'h1').mapeo == MAPEO_V1
+    assert buscar_formato(db, user.id, 'conciliador_v2', 'banco', 'h1').mapeo == MAPEO_V2
+    assert db.query(FormatoArchivo).count() == 2
+
+
+def test_migrar_formatos_agrega_el_modulo_a_la_clave(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'viejo.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE formatos_archivo (id INTEGER PRIMARY KEY, user_id INTEGER, origen VARCHAR, huella VARCHAR, "
+                          "mapeo JSON, opciones_lectura JSON, usos INTEGER, ultimo_uso DATETIME, "
+                          "CONSTRAINT uq_formato_usuario_huella UNIQUE (user_id, origen, huella))"))
+        conn.execute(text("CREATE INDEX ix_formatos_archivo_huella ON formatos_archivo (huella)"))
+        for i, mapeo in ((1, MAPEO_V1), (2, MAPEO_V2)):
+            conn.execute(text("INSERT INTO formatos_archivo (id, user_id, origen, huella, mapeo, usos) VALUES (:i, 1, 'banco', :h, :m, 1)"),
+                         {'i': i, 'h': f'h{i}', 'm': json.dumps(mapeo)})
+    monkeypatch.setattr(models, 'engine', engine)
+
+    models.agregar_columnas_faltantes()
+    models.migrar_formatos()
+    models.migrar_formatos() # Idempotente
+
+    unicos = [u['column_names'] for u in inspect(engine).get_unique_constraints("formatos_archivo")]
+    assert unicos == [['user_id', 'modulo', 'origen', 'huella']]
+    with engine.begin() as conn:
+        filas = conn.execute(text("SELECT id, modulo FROM formatos_archivo ORDER BY id")).all()
+        assert [tuple(f) for f in filas] == [(1, 'conciliacion'), (2, 'conciliador_v2')]
+        # El mismo archivo ya admite un formato por módulo
+        conn.execute(text("INSERT INTO formatos_archivo (user_id, modulo, origen, huella) VALUES (1, 'conciliador_v2', 'banco', 'h1')"))
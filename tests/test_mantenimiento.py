@@ -0,0 +1,53 @@
+from datetime import date
+import pandas as pd
+from models import User, ConciliacionV2, MovimientoBanco, MovimientoContable, MovimientoArchivado
+from modules.mantenimiento import archivar, leer_movimientos
+
+
+def _conciliacion(db, user, periodo, estado):
+    c = ConciliacionV2(user_id=user.id, periodo=periodo, estado=estado)
+    db.add(c)
+    db.flush()
+    db.add_all([MovimientoBanco(conciliacion_id=c.id, fecha=periodo, descripcion="TRF PROVEEDOR A", monto=-1500.0),
+                MovimientoBanco(conciliacion_id=c.id, fecha=periodo, descripcion="COMISION", monto=-12.5),
+                MovimientoContable(conciliacion_id=c.id, fecha=periodo, descripcion="PAGO PROVEEDOR A", monto=-1500.0)])
+    db.commit()
+    return c
+
+
+def test_archiva_periodos_finalizados_y_los_lee_de_vuelta(db):
+    user = User(username="ana")
+    db.add(user)
+    db.commit()
+    vieja = _conciliacion(db, user, date(2023, 5, 1), 'finalizada')
+    abierta = _conciliacion(db, user, date(2023, 6, 1), 'en_progreso')
+    reciente = _conciliacion(db, user, date(2026, 9, 1), 'finalizada')
+    antes = {lado: leer_movimientos(db, user.id, lado) for lado in ('banco', 'mayor')}
+
+    informe = archivar(db, 12, date(2026, 10, 1))
+
+    assert informe['conciliaciones'] == 1
+    assert informe['filas'] == 3
+    assert db.get(ConciliacionV2, vieja.id).estado == 'archivada'
+    assert db.query(MovimientoBanco).filter_by(conciliacion_id=vieja.id).count() == 0
+    assert db.query(MovimientoArchivado).filter_by(conciliacion_id=vieja.id).count() == 2
+    # Lo que no está cerrado o no es viejo queda en las tablas vivas
+    assert db.query(MovimientoBanco).filter_by(conciliacion_id=abierta.id).count() == 2
+    assert db.query(MovimientoBanco).filter_by(conciliacion_id=reciente.id).count() == 2
+
+    def normalizar(df):
+        # Lo archivado vuelve del JSON comprimido con NaN donde lo vivo trae None: se comparan como nulos
+        df = df.drop(columns='id').sort_values(['conciliacion_id', 'descripcion']).reset_index(drop=True)
+        return df.astype(object).where(df.notna(), None)
+
+    for lado, previo in antes.items():
+        pd.testing.assert_frame_equal(normalizar(leer_movimientos(db, user.id, lado)), normalizar(previo))
+
+
+def test_una_segunda_corrida_no_vuelve_a_archivar(db):
+    user = User(username="ana")
+    db.add(user)
+    db.commit()
+    _conciliacion(db, user, date(2023, 5, 1), 'finalizada')
+    archivar(db, 12, date(2026, 10, 1))
+    assert archivar(db, 12, date(2026, 10, 1))['conciliaciones'] == 0
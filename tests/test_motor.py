@@ -0,0 +1,102 @@
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pytest
+from modules.esquema import TIPOS
+from modules.motor import conciliar, preparar_barrido, conciliar_con_barrido, TOL_MAX
+
+# Pico admitido del cruce, en veces el tamaño de la entrada. Con 25.000 filas por lado da ~2.8x con las opciones
+# por defecto (lo mismo que con 100.000; por debajo de ~20.000 pesan los costos fijos) y ~2.0x sin similitud ni
+# claves. El límite deja ~25% de margen sobre el valor por defecto
+FACTOR_MEMORIA_MAX = 3.5
+
+
+def datos_sinteticos(n, seed=0):
+    rng = np.random.default_rng(seed)
+    fechas = pd.Timestamp('2026-01-01') + pd.to_timedelta(rng.integers(0, 365, n), unit='D')
+    montos = np.round(rng.integers(100, 5_000_000, n) / 100, 2)
+    df_m = pd.DataFrame({'fecha': fechas, 'descripcion': [f"PAGO {i}" for i in range(n)], 'neto': montos,
+                         'origen': 'mayor.xlsx', 'source_row_id': np.arange(n)}).astype(TIPOS)
+    desfase = pd.to_timedelta(rng.integers(0, 4, n), unit='D')
+    df_b = pd.DataFrame({'fecha': fechas + desfase, 'descripcion': [f"TRF {i}" for i in range(n)], 'neto': montos,
+                         'origen': 'banco.xlsx', 'source_row_id': np.arange(n)}).astype(TIPOS)
+    return df_m, df_b.sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+
+def medir_pico_memoria(fn, *args, **kwargs):
+    """Ejecuta fn y devuelve (resultado, pico de memoria en bytes) medido con tracemalloc."""
+    tracemalloc.start()
+    try:
+        resultado = fn(*args, **kwargs)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return resultado, pico
+
+
+def test_pico_de_memoria_acotado():
+    # Con las mismas opciones que usa la app (pasada por claves y similitud)
+    df_m, df_b = datos_sinteticos(25_000)
+    tamanio = int(df_m.memory_usage(deep=True).sum() + df_b.memory_usage(deep=True).sum())
+    (_, _, matched), pico = medir_pico_memoria(conciliar, df_m, df_b, 3)
+    assert len(matched) == len(df_m)
+    assert pico <= FACTOR_MEMORIA_MAX * tamanio, f"Pico de memoria {pico / tamanio:.2f}x supera {FACTOR_MEMORIA_MAX}x la entrada"
+
+
+def _pares(matched):
+    return matched[['id_mayor', 'id_banco']].reset_index(drop=True)
+
+
+def _casos_particiones(n):
+    """Casos borde del modo paralelo: importes redondos (pocos importes distintos, particiones vacías o muy
+    cargadas), empates que resuelve la similitud, un solo importe y un lado sin filas."""
+    df_m, df_b = datos_sinteticos(n)
+    rng = np.random.default_rng(1)
+    redondos = rng.integers(1, 6, n) * 1000.0
+    # Importes repetidos con contrapartes distintas en la descripción: empates que resuelve la similitud
+    repetidos = rng.integers(1, 40, n) * 1000.0
+    neto_b = pd.Series(repetidos).iloc[df_b['source_row_id']].to_numpy()
+    return {'aleatorios': (df_m, df_b),
+            'importes redondos': (df_m.assign(neto=redondos), df_b.assign(neto=redondos[rng.permutation(n)])),
+            'empates por similitud': (df_m.assign(neto=repetidos, descripcion=[f"PAGO PROV {i % 50}" for i in range(n)]),
+                                      df_b.assign(neto=neto_b, descripcion=[f"TRF PROV {i % 50}" for i in df_b['source_row_id']])),
+            'un solo importe': (df_m.assign(neto=1000.0), df_b.assign(neto=1000.0)),
+            'banco vacío': (df_m, df_b.iloc[:0])}
+
+
+def test_paralelo_identico_a_un_proceso():
+    # Con las opciones por defecto y sin similitud ni claves; un pool por corrida, así que pocas filas
+    for nombre, (m, b) in _casos_particiones(1_000).items():
+        for opciones in ({}, {'similitud': False, 'por_clave': False}):
+            referencia = conciliar(m, b, 3, procesos=1, **opciones)[2]
+            paralelo = conciliar(m, b, 3, procesos=2, **opciones)[2]
+            assert _pares(paralelo).equals(_pares(referencia)), f"El modo paralelo difiere del de un proceso ({nombre}, {opciones})"
+
+
+@pytest.fixture(scope='module')
+def grupos_densos():
+    """Importes repetidos en grupos densos (más de CANDIDATOS_POR_PARTIDA candidatos por partida desde tolerancia 1)
+    con las descripciones cruzadas dentro de cada día, y el par correcto de cada partida del mayor."""
+    dias, por_dia = 30, 10
+    n = dias * por_dia
+    fechas = pd.Timestamp('2026-01-01') + pd.to_timedelta(np.arange(n) // por_dia, unit='D')
+    proveedor = [f"PROVEEDOR {chr(65 + i % 26)}{i // 26}" for i in range(n)]
+    df_m = pd.DataFrame({'fecha': fechas, 'descripcion': [f"PAGO {p}" for p in proveedor], 'neto': -1000.0,
+                         'origen': 'mayor.xlsx', 'source_row_id': np.arange(n)}).astype(TIPOS)
+    # Dentro de cada día el extracto trae los mismos pagos en orden inverso
+    orden_b = (np.arange(n) // por_dia) * por_dia + (por_dia - 1 - np.arange(n) % por_dia)
+    df_b = pd.DataFrame({'fecha': fechas, 'descripcion': [f"TRF {proveedor[i]}" for i in orden_b], 'neto': -1000.0,
+                         'origen': 'banco.xlsx', 'source_row_id': np.arange(n)}).astype(TIPOS)
+    # Par correcto: la fila del extracto con el mismo proveedor
+    return df_m, df_b, preparar_barrido(df_m, df_b), np.argsort(orden_b)
+
+
+@pytest.mark.parametrize('tol', [0, 1, 3, 7, TOL_MAX])
+def test_barrido_igual_a_conciliar_en_grupos_densos(grupos_densos, tol):
+    df_m, df_b, barrido, esperado = grupos_densos
+    referencia = conciliar(df_m, df_b, tol, procesos=1)[2]
+    desde_barrido = conciliar_con_barrido(df_m, df_b, barrido, tol)[2]
+    assert _pares(desde_barrido).equals(_pares(referencia)), f"El barrido difiere de conciliar con tolerancia {tol}"
+    # Cada pago con la transferencia de su proveedor
+    correctos = int((esperado[desde_barrido['id_mayor'].to_numpy()] == desde_barrido['id_banco'].to_numpy()).sum())
+    assert correctos == len(df_m)
@@ -0,0 +1,29 @@
+from datetime import date
+import pandas as pd
+from models import User, Factura
+from modules.vinculos import vincular, extracto_pendiente, armar_registros, guardar_vinculos
+
+
+def _res(cuenta, periodo, fecha):
+    # Los source_row_id del extracto arrancan de 0 en cada conciliación
+    p_b = pd.DataFrame({'source_row_id': [0, 1], 'fecha': [fecha, fecha], 'descripcion': ['TRF 20123456786', 'COMISION'],
+                        'neto': [-1210.0, -15.0]})
+    return {'cuenta': cuenta, 'periodo': periodo, 'p_b': p_b}
+
+
+def test_los_vinculos_del_extracto_no_tapan_filas_de_otra_conciliacion(db):
+    user = User(username="ana")
+    db.add(user)
+    db.commit()
+    db.add(Factura(user_id=user.id, fecha=date(2024, 1, 10), total=1210.0, cuit_emisor='20123456786'))
+    db.commit()
+    enero = _res('Cuenta Principal', 'Enero 2024', date(2024, 1, 12))
+    movimientos = extracto_pendiente(db, user.id, enero)
+    facturas = pd.read_sql("SELECT id, fecha, total, cuit_emisor, cuit_receptor FROM facturas", db.bind)
+    guardar_vinculos(db, armar_registros(vincular(facturas, movimientos), movimientos, user.id))
+
+    assert extracto_pendiente(db, user.id, enero)['ref_id'].tolist() == [1]
+    febrero = extracto_pendiente(db, user.id, _res('Cuenta Principal', 'Febrero 2024', date(2024, 2, 12)))
+    assert febrero['ref_id'].tolist() == [0, 1]
+    otra_cuenta = extracto_pendiente(db, user.id, _res('Caja de Ahorro', 'Enero 2024', date(2024, 1, 12)))
+    assert otra_cuenta['ref_id'].tolist() == [0, 1]